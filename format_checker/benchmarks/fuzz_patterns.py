@@ -0,0 +1,178 @@
+"""
+Checks that the linear-time Module Path and Fully-Qualified Name patterns
+accept exactly the same values as the patterns they replaced, and times both
+on adversarial inputs.
+
+Run it from the root directory:
+
+    $ python format_checker/benchmarks/fuzz_patterns.py
+"""
+
+import os
+import re
+import csv
+import sys
+import time
+import random
+import argparse
+
+# The checker modules are imported like main.py does, from their directory
+CHECKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CHECKER_DIR)
+
+from common_checks import common_data  # noqa: E402
+
+
+# Patterns that used to validate these columns, which backtrack
+LEGACY_PATTERNS = {
+    "Module Path": re.compile(r"((\w|\.|-)+(\/|\w|\.|-)*)|^$"),
+    "Fully-Qualified Name": re.compile(
+        r"((\w|\s)+\.)+(\w+|\d+|\W+)+(\[((\d+)|(\w+|\s)+)\])?"
+    ),
+}
+
+# Columns of the dataset files whose values are checked by each pattern
+DATASET_COLUMNS = {
+    "Module Path": [
+        "Module Path",
+        "Test-Introducing Commit Module Path",
+    ],
+    "Fully-Qualified Name": [
+        "Fully-Qualified Test Name (packageName.ClassName.methodName)",
+        "Test-Introducing Commit Fully-Qualified Test Name",
+    ],
+}
+
+DATASET_FILES = ["pr-data.csv", "tic-fic-data.csv", "tso-iso-rates.csv"]
+
+# Characters random values are made of: every class the patterns tell
+# apart, including non-ASCII word characters and whitespace
+ALPHABET = "aZ09_ .-/[]()$#\n\té١　!"
+
+# Inputs that make the legacy patterns backtrack, as a function of size
+ADVERSARIAL_INPUTS = {
+    "Module Path": [
+        ("word then !", lambda n: "a" * n + "!"),
+        ("dotted then !", lambda n: "a." * (n // 2) + "!"),
+        ("slashes then !", lambda n: "a/" * (n // 2) + "!"),
+    ],
+    "Fully-Qualified Name": [
+        ("dotted, ending in a dot", lambda n: "a." * (n // 2)),
+        ("spaced, no dot", lambda n: "a " * (n // 2)),
+        ("word then !", lambda n: "a" * n + "!"),
+    ],
+}
+
+
+def compare(name, values):
+    """Returns the values on which both patterns of name disagree."""
+
+    legacy = LEGACY_PATTERNS[name]
+    current = common_data[name]
+    return [
+        value
+        for value in values
+        if bool(legacy.fullmatch(value)) != bool(current.fullmatch(value))
+    ]
+
+
+def dataset_values(name):
+    """Yields the values of the dataset files checked by the pattern."""
+
+    for filename in DATASET_FILES:
+        if not os.path.exists(filename):
+            continue
+        with open(filename, newline="", encoding="utf-8") as dataset:
+            for row in csv.DictReader(dataset):
+                for column in DATASET_COLUMNS[name]:
+                    if row.get(column) is not None:
+                        yield row[column]
+
+
+def random_values(count, max_length, rng):
+    """Yields count random values of up to max_length characters."""
+
+    for _ in range(count):
+        length = rng.randint(0, max_length)
+        yield "".join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def time_match(pattern, value):
+    """Returns how long it takes to fully match value with pattern."""
+
+    start = time.perf_counter()
+    pattern.fullmatch(value)
+    return time.perf_counter() - start
+
+
+def benchmark(name, sizes, limit):
+    """
+    Prints the matching time of both patterns of name on each adversarial
+    input, and returns the slowest time of the current pattern. The legacy
+    pattern is no longer timed on an input once it takes over limit
+    seconds.
+    """
+
+    slowest = 0
+    for label, make in ADVERSARIAL_INPUTS[name]:
+        legacy_done = False
+        for size in sizes:
+            value = make(size)
+            current = time_match(common_data[name], value)
+            slowest = max(slowest, current)
+            legacy = "skipped"
+            if not legacy_done:
+                elapsed = time_match(LEGACY_PATTERNS[name], value)
+                legacy = "%.4fs" % elapsed
+                legacy_done = elapsed > limit
+            print(
+                "%-20s %-24s %8d  legacy %9s  current %.6fs"
+                % (name, label, size, legacy, current)
+            )
+    return slowest
+
+
+def main(argv):
+    """Compares and times the patterns, failing on any mismatch."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--max-length", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 4000, 16000, 64000],
+    )
+    parser.add_argument(
+        "--limit",
+        type=float,
+        default=1.0,
+        help="seconds after which the legacy pattern is no longer timed",
+    )
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    failed = False
+    for name in LEGACY_PATTERNS:
+        values = list(dataset_values(name))
+        values += random_values(args.iterations, args.max_length, rng)
+        mismatches = compare(name, values)
+        print(
+            "%s: %d values compared, %d mismatches"
+            % (name, len(values), len(mismatches))
+        )
+        for value in mismatches[:10]:
+            print("  " + repr(value))
+        failed = failed or bool(mismatches)
+
+    for name in LEGACY_PATTERNS:
+        slowest = benchmark(name, args.sizes, args.limit)
+        print("%s: slowest current match took %.6fs" % (name, slowest))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,341 @@
+"""
+Times the format checker on synthetic datasets of growing size: change
+detection, run_checks, check_sort and main.py from end to end. Results are
+appended to a history file, and any benchmark that got slower than in the
+previous runs on the same machine is flagged as a regression.
+
+Run it from the root directory:
+
+    $ python format_checker/benchmarks/run_benchmarks.py --sizes 1000 100000
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+from datetime import datetime, timezone
+
+# The checker modules are imported like main.py does, from their directory
+CHECKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CHECKER_DIR)
+
+import utils  # noqa: E402
+import key_index  # noqa: E402
+from synthetic import DISTRIBUTIONS, build_history  # noqa: E402
+from common_checks import check_sort, run_checks  # noqa: E402
+from diagnostics import Diagnostics  # noqa: E402
+from pr_checker import pr_data, validate_pr  # noqa: E402
+from utils import get_changed_lines  # noqa: E402
+
+MAIN = os.path.join(CHECKER_DIR, "main.py")
+
+DATASET_FILES = ["pr-data.csv", "tic-fic-data.csv", "tso-iso-rates.csv"]
+PR_FILE = "pr-data.csv"
+
+# File the results of every run are appended to
+RESULTS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "results.jsonl"
+)
+
+# Number of previous results a new one is compared with
+BASELINE_RUNS = 5
+
+# Differences smaller than this many seconds are never regressions
+NOISE_FLOOR = 0.005
+
+
+def count_changed(changes):
+    """Counts the changed lines of every file."""
+
+    return sum(
+        last - first + 1
+        for change in changes.values()
+        for first, last in change["changed"]
+    )
+
+
+def count_rows():
+    """Counts the rows of every dataset file."""
+
+    rows = 0
+    for filename in DATASET_FILES:
+        with open(filename, "rb") as dataset:
+            rows += sum(1 for _ in dataset) - 1
+    return rows
+
+
+def run_main(*args):
+    """Runs main.py with args, checking that it didn't crash."""
+
+    process = subprocess.run(
+        (sys.executable, MAIN) + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if process.returncode not in (0, 1):
+        raise RuntimeError(process.stderr.decode("utf-8", "replace"))
+
+
+def define_benchmarks(rows, commits):
+    """
+    Returns the benchmarks of a repository built by build_history, as
+    (name, function) pairs, where each function does the timed work and
+    returns the number of rows it handled.
+    """
+
+    last = ["HEAD~1", "HEAD"]
+    history = ["HEAD~" + str(commits), "HEAD"] if commits else last
+    changes = get_changed_lines(DATASET_FILES, last)
+
+    def changed_lines(commit_range):
+        return count_changed(get_changed_lines(DATASET_FILES, commit_range))
+
+    def check_all():
+        run_checks(PR_FILE, pr_data, Diagnostics(), None, validate_pr)
+        return rows
+
+    def check_changed():
+        run_checks(
+            PR_FILE, pr_data, Diagnostics(), changes[PR_FILE], validate_pr
+        )
+        return count_changed({PR_FILE: changes[PR_FILE]})
+
+    def sort_all():
+        check_sort(PR_FILE, Diagnostics())
+        return rows
+
+    def sort_changed():
+        check_sort(PR_FILE, Diagnostics(), changes[PR_FILE])
+        return count_changed({PR_FILE: changes[PR_FILE]})
+
+    def main_all():
+        run_main("--all", "--no-cache")
+        return count_rows()
+
+    def main_all_cached():
+        run_main("--all")
+        return count_rows()
+
+    # Timed once the validation cache was filled by a first run
+    main_all_cached.warm_up = True
+
+    def main_changed():
+        run_main(*last)
+        return count_changed(changes)
+
+    def main_unchanged():
+        # The startup time, as a push that doesn't touch the dataset
+        run_main("HEAD", "HEAD")
+        return 0
+
+    return [
+        ("get_changed_lines (last commit)", lambda: changed_lines(last)),
+        ("get_changed_lines (history)", lambda: changed_lines(history)),
+        ("run_checks pr-data.csv (all rows)", check_all),
+        ("run_checks pr-data.csv (last commit)", check_changed),
+        ("check_sort pr-data.csv (all rows)", sort_all),
+        ("check_sort pr-data.csv (last commit)", sort_changed),
+        ("main.py --all --no-cache", main_all),
+        ("main.py --all (warm cache)", main_all_cached),
+        ("main.py (last commit)", main_changed),
+        ("main.py (no dataset changes)", main_unchanged),
+    ]
+
+
+def time_benchmark(function, repeat):
+    """
+    Runs function repeat times, returning its best time and rows. Functions
+    whose warm_up attribute is set are run once more before, untimed.
+    """
+
+    if getattr(function, "warm_up", False):
+        function()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+def load_results(path):
+    """Reads the results recorded by previous runs."""
+
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as results:
+        return [json.loads(line) for line in results if line.strip()]
+
+
+def find_baseline(previous, result):
+    """
+    Returns the median time of the last results of the same benchmark and
+    size on the same machine, or None if there are none.
+    """
+
+    times = [
+        record["seconds"]
+        for record in previous
+        if record["benchmark"] == result["benchmark"]
+        and record["size"] == result["size"]
+        and record["machine"] == result["machine"]
+    ][-BASELINE_RUNS:]
+    return statistics.median(times) if times else None
+
+
+def get_revision():
+    """Returns the commit of the tool being benchmarked, if known."""
+
+    try:
+        return utils.git("-C", CHECKER_DIR, "rev-parse", "HEAD").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_size(size, args, machine, revision, skipped):
+    """
+    Builds a synthetic repository of size rows and times every benchmark
+    that isn't in skipped on it, returning their results. Benchmarks that
+    exceed the time budget are added to skipped.
+    """
+
+    directory = tempfile.mkdtemp(prefix="idoft-benchmark-")
+    cwd = os.getcwd()
+    try:
+        start = time.perf_counter()
+        build_history(
+            directory,
+            size,
+            args.commits,
+            args.edits,
+            args.distribution,
+            corrupt=args.corrupt,
+            seed=args.seed,
+        )
+        print(
+            "Built %d rows and %d commits in %.2fs"
+            % (size, args.commits, time.perf_counter() - start)
+        )
+        os.chdir(directory)
+        # Every repository gets its own cache, as it would in CI
+        os.environ["IDOFT_CACHE_DIR"] = os.path.join(directory, ".cache")
+        utils.get_cache_dir.cache_clear()
+        key_index.get_blob_ids.cache_clear()
+        run_checks.cache = None
+
+        results = []
+        for name, function in define_benchmarks(size, args.commits):
+            if name in skipped:
+                continue
+            seconds, rows = time_benchmark(function, args.repeat)
+            results.append(
+                {
+                    "time": datetime.now(timezone.utc).isoformat(),
+                    "revision": revision,
+                    "machine": machine,
+                    "python": platform.python_version(),
+                    "benchmark": name,
+                    "size": size,
+                    "rows": rows,
+                    "seconds": seconds,
+                }
+            )
+            if seconds > args.budget:
+                skipped.add(name)
+        return results
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv):
+    """Runs the benchmarks, failing if any of them regressed."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="rows of pr-data.csv of each synthetic dataset",
+    )
+    parser.add_argument("--commits", type=int, default=20)
+    parser.add_argument("--edits", type=int, default=20)
+    parser.add_argument(
+        "--distribution", choices=DISTRIBUTIONS, default="uniform"
+    )
+    parser.add_argument("--corrupt", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=60.0,
+        help="seconds after which a benchmark isn't run on larger sizes",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="fraction by which a benchmark has to be slower than its "
+        "baseline to be a regression",
+    )
+    parser.add_argument("--results", default=RESULTS_FILE)
+    parser.add_argument(
+        "--no-record",
+        action="store_true",
+        help="compare with previous results without recording these",
+    )
+    args = parser.parse_args(argv)
+
+    previous = load_results(args.results)
+    machine = platform.node() + " " + platform.machine()
+    revision = get_revision()
+    skipped = set()
+    regressions = 0
+    print(
+        "%-40s %10s %10s %12s %10s"
+        % ("Benchmark", "Size", "Time (s)", "Rows/s", "Baseline")
+    )
+    for size in sorted(args.sizes):
+        results = benchmark_size(size, args, machine, revision, skipped)
+        for result in results:
+            baseline = find_baseline(previous, result)
+            regressed = (
+                baseline is not None
+                and result["seconds"] > baseline * (1 + args.threshold)
+                and result["seconds"] - baseline > NOISE_FLOOR
+            )
+            regressions += regressed
+            rate = result["rows"] / result["seconds"] if result["rows"] else 0
+            print(
+                "%-40s %10d %10.4f %12.0f %10s%s"
+                % (
+                    result["benchmark"],
+                    size,
+                    result["seconds"],
+                    rate,
+                    "-" if baseline is None else "%.4f" % baseline,
+                    "  REGRESSION" if regressed else "",
+                )
+            )
+        if not args.no_record:
+            with open(args.results, "a", encoding="utf-8") as output:
+                for result in results:
+                    output.write(json.dumps(result) + "\n")
+    for name in sorted(skipped):
+        print("Over the budget, stopped growing: " + name)
+    if regressions:
+        print("%d regression(s) found" % regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
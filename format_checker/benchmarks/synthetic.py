@@ -0,0 +1,442 @@
+"""
+Generates synthetic dataset files that follow the rules of the format checker,
+optionally with some corrupted rows, and local git repositories whose history
+edits them, to benchmark the tool at sizes the real dataset hasn't reached.
+
+Run it from the root directory:
+
+    $ python format_checker/benchmarks/synthetic.py /tmp/idoft-1e5 \\
+        --rows 100000 --commits 20 --edits 50 --distribution tail
+"""
+
+import os
+import sys
+import random
+import hashlib
+import argparse
+import subprocess
+from collections import Counter
+
+# The checker modules are imported like main.py does, from their directory
+CHECKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CHECKER_DIR)
+
+from pr_checker import pr_data  # noqa: E402
+from tic_fic_checker import tic_fic_data  # noqa: E402
+from tso_iso_checker import (  # noqa: E402
+    ALPHA,
+    chi_square_p,
+    table_statistic,
+    tso_iso_rates,
+)
+
+
+PR_FILE = "pr-data.csv"
+TIC_FIC_FILE = "tic-fic-data.csv"
+TSO_ISO_FILE = "tso-iso-rates.csv"
+
+# Number of tests of each synthetic project
+TESTS_PER_PROJECT = 50
+
+# Every n-th test of pr-data.csv is referred to by the other files, which is
+# about how many the real dataset files refer to
+TIC_FIC_STRIDE = 8
+TSO_ISO_STRIDE = 20
+
+CATEGORIES = ["ID", "OD", "OD-Vic", "OD-Brit", "NOD", "UD", "NDOD;NOD"]
+
+# Statuses of pr-data.csv and how often they appear
+STATUSES = [
+    ("", 60),
+    ("Accepted", 20),
+    ("Opened", 8),
+    ("Rejected", 2),
+    ("DeveloperFixed", 3),
+    ("Deleted", 3),
+    ("Skipped", 2),
+    ("InspiredAFix", 1),
+    ("MovedOrRenamed", 1),
+]
+
+# Ways in which a row of each file can be corrupted, as the checker reports
+# them: column rules, row lengths, order and references between files
+CORRUPTIONS = {
+    PR_FILE: ["category", "sha", "status", "url", "length", "order", "copy"],
+    TIC_FIC_FILE: ["sha", "flag", "days", "dangling"],
+    TSO_ISO_FILE: ["p-value", "less-greater", "runs", "dangling"],
+}
+
+# Positions of the rows of a history's edits, as a fraction of the file
+DISTRIBUTIONS = ["uniform", "tail", "clustered"]
+
+# Default weights of the kinds of edit made to pr-data.csv by each commit
+EDIT_MIX = {"modify": 6, "insert": 3, "delete": 1}
+
+
+def sha(*parts):
+    """Returns a 40-digit hexadecimal SHA derived from parts."""
+
+    return hashlib.sha1(":".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+
+def test_fields(i):
+    """
+    Returns the Project URL, SHA Detected, Module Path and Fully-Qualified
+    Test Name of the i-th test. Numbers are zero-padded, so tests are
+    generated in the order pr-data.csv is sorted by.
+    """
+
+    project, test = divmod(i, TESTS_PER_PROJECT)
+    return [
+        "https://github.com/org%07d/project%07d" % (project, project),
+        sha("project", project),
+        "." if project % 4 == 0 else "module-%d/core" % (project % 3),
+        "org.example.p%07d.Class%03d.test%04d" % (project, test // 10, test),
+    ]
+
+
+def pr_row(i, rng):
+    """Returns the fields of a valid row of pr-data.csv for the i-th test."""
+
+    fields = test_fields(i)
+    status = rng.choices(
+        [status for status, _ in STATUSES],
+        [weight for _, weight in STATUSES],
+    )[0]
+    pr_link = notes = ""
+    if status in ["Accepted", "Opened", "Rejected", "InspiredAFix"]:
+        pr_link = fields[0] + "/pull/%d" % rng.randint(1, 99999)
+    if status in ["Skipped", "InspiredAFix", "MovedOrRenamed"]:
+        notes = (
+            "https://github.com/TestingResearchIllinois/idoft/issues/%d"
+            % rng.randint(1, 999)
+        )
+    return fields + [rng.choice(CATEGORIES), status, pr_link, notes]
+
+
+def tic_fic_row(i, rng):
+    """Returns the fields of a valid row of tic-fic-data.csv."""
+
+    fields = test_fields(i)
+    same = rng.random() < 0.5
+    tic = sha("tic", i)
+    fic = tic if same else sha("fic", i)
+    row = fields + ["TRUE" if same else "FALSE", tic, fields[3], fields[2]]
+    row.append(fic)
+    if same:
+        return row + [""] * 10
+    row += [rng.choice(["TRUE", "FALSE"]) for _ in range(4)]
+    row += [str(rng.randint(0, 50)) for _ in range(5)]
+    return row + ["%.9f" % rng.uniform(0, 1000)]
+
+
+def format_p_value(p):
+    """
+    Writes a P-Value the way the dataset does: with seven decimals, in
+    scientific notation if it is smaller than that shows, or 0.
+    """
+
+    if p >= 1e-4:
+        return "%.7f" % p
+    if p > 0:
+        return "%.2E" % p
+    return "0"
+
+
+def tso_iso_row(i, rng):
+    """
+    Returns the fields of a valid row of tso-iso-rates.csv, whose P-Value
+    is the one of the chi-square test of its failures and runs.
+    """
+
+    fields = test_fields(i)
+    runs = [100] * 21
+    # Most flaky tests fail a few times in some orders, and others always
+    # fail in them
+    most = rng.choice([2, 5, 100])
+    failures = [rng.choice([0, 0, 0, rng.randint(1, most)]) for _ in runs]
+    statistic = table_statistic(failures, runs)
+    if statistic is None:
+        # The test always or never failed, so any P-Value goes
+        p_value = "1"
+    else:
+        p_value = format_p_value(chi_square_p(statistic, len(runs) - 1))
+    passed = sum(runs) - sum(failures)
+    return fields + [
+        "(" + ";".join(map(str, failures)) + ")",
+        "(" + ";".join(map(str, runs)) + ")",
+        p_value,
+        "less" if float(p_value) < ALPHA else "greater",
+        str(sum(runs)),
+        str(passed),
+        "4000",
+        str(rng.randint(0, 4000)),
+    ]
+
+
+def corrupt_row(filename, fields, kind):
+    """
+    Corrupts the fields of a row of filename in the given way (one of
+    CORRUPTIONS), returning the rows to write in its place.
+    """
+
+    fields = list(fields)
+    if kind == "category":
+        fields[4] += ";"
+    elif kind == "sha":
+        fields[1] = fields[1][:-1] + "g"
+    elif kind == "status":
+        fields[5] += ";"
+    elif kind == "url":
+        fields[0] = fields[0].replace("https", "http", 1)
+    elif kind == "length":
+        fields.pop()
+    elif kind == "order":
+        # Sorts after the following rows of the same project
+        fields[3] = "zzz." + fields[3]
+    elif kind == "copy":
+        return [fields, fields]
+    elif kind == "flag":
+        fields[4] = "YES"
+    elif kind == "days":
+        fields[-1] = "-1"
+    elif kind == "dangling":
+        fields[3] += "Missing"
+    elif kind == "p-value":
+        fields[6] = "0.05x"
+    elif kind == "less-greater":
+        fields[7] = "LESS"
+    elif kind == "runs":
+        fields[5] = "(100;)"
+    return [fields]
+
+
+def write_rows(path, columns, rows):
+    """Writes the header and rows of a dataset file, one line at a time."""
+
+    with open(path, "w", encoding="utf-8", newline="") as dataset:
+        dataset.write(",".join(columns) + "\n")
+        for fields in rows:
+            dataset.write(",".join(fields) + "\n")
+
+
+def generate_rows(filename, make_row, numbers, corrupt, rng, counts):
+    """
+    Yields the rows made by make_row for each number, corrupting a corrupt
+    fraction of them and counting each corruption in counts.
+    """
+
+    for i in numbers:
+        fields = make_row(i, rng)
+        if corrupt and rng.random() < corrupt:
+            kind = rng.choice(CORRUPTIONS[filename])
+            counts[filename + ": " + kind] += 1
+            yield from corrupt_row(filename, fields, kind)
+        else:
+            yield fields
+
+
+def write_dataset(directory, rows, corrupt=0.0, seed=0):
+    """
+    Writes the three dataset files into directory: pr-data.csv with the
+    given number of rows, sorted, and the other files with rows that refer
+    to some of its tests. A corrupt fraction of the rows of each file are
+    corrupted. Rows are streamed to disk, so any size fits in memory.
+    Returns how many rows were corrupted in each way.
+    """
+
+    rng = random.Random(seed)
+    counts = Counter()
+    os.makedirs(directory, exist_ok=True)
+    files = [
+        (PR_FILE, pr_data, pr_row, 1),
+        (TIC_FIC_FILE, tic_fic_data, tic_fic_row, TIC_FIC_STRIDE),
+        (TSO_ISO_FILE, tso_iso_rates, tso_iso_row, TSO_ISO_STRIDE),
+    ]
+    for filename, schema, make_row, stride in files:
+        write_rows(
+            os.path.join(directory, filename),
+            schema["columns"],
+            generate_rows(
+                filename,
+                make_row,
+                range(0, rows, stride),
+                corrupt,
+                rng,
+                counts,
+            ),
+        )
+    return counts
+
+
+def git_in(directory, *args):
+    """Runs a git command in directory, returning its decoded output."""
+
+    return subprocess.check_output(
+        ("git", "-C", directory) + args, stderr=subprocess.STDOUT
+    ).decode("utf-8")
+
+
+def edit_position(distribution, size, start, rng):
+    """
+    Picks the line (counting from 0) of a file of size rows that an edit
+    touches: anywhere, mostly near the end, or near start.
+    """
+
+    if distribution == "uniform":
+        position = rng.randrange(size)
+    elif distribution == "tail":
+        position = size - 1 - int(rng.expovariate(100 / size))
+    else:
+        position = start + int(rng.gauss(0, 10))
+    return min(max(position, 0), size - 1)
+
+
+def apply_edit(lines, kind, position, referenced, rng):
+    """
+    Edits the rows of pr-data.csv (without its header) at position so that
+    they stay valid and sorted: by changing a row's Category, inserting a
+    new test right after it or deleting it if nothing refers to it.
+    """
+
+    fields = lines[position].split(",")
+    if kind == "modify":
+        fields[4] = rng.choice(CATEGORIES)
+        lines[position] = ",".join(fields)
+    elif kind == "insert":
+        # Extending the test name keeps the file sorted, unless the next
+        # row extends it already
+        while position + 1 < len(lines) and lines[position + 1].split(",")[
+            3
+        ].startswith(fields[3] + "x"):
+            position += 1
+            fields = lines[position].split(",")
+        fields[3] += "x"
+        lines.insert(position + 1, ",".join(fields))
+    elif len(lines) > 1 and fields[3] not in referenced:
+        del lines[position]
+
+
+def build_history(
+    directory,
+    rows,
+    commits,
+    edits=10,
+    distribution="uniform",
+    mix=None,
+    corrupt=0.0,
+    seed=0,
+):
+    """
+    Creates a git repository in directory whose first commit adds a
+    synthetic dataset of the given number of rows, followed by commits that
+    make edits to pr-data.csv. Their positions follow distribution and
+    their kinds are chosen with the weights of mix (see EDIT_MIX). A
+    corrupt fraction of commits also break the Status of an edited row.
+    Returns how many rows of the first commit were corrupted in each way.
+    """
+
+    mix = mix or EDIT_MIX
+    rng = random.Random(seed)
+    counts = write_dataset(directory, rows, corrupt, seed)
+    git_in(directory, "init", "-q")
+    git_in(directory, "config", "user.name", "Benchmark")
+    git_in(directory, "config", "user.email", "benchmark@example.com")
+    git_in(directory, "add", PR_FILE, TIC_FIC_FILE, TSO_ISO_FILE)
+    git_in(directory, "commit", "-q", "-m", "Add synthetic dataset")
+    if commits <= 0:
+        return counts
+
+    path = os.path.join(directory, PR_FILE)
+    with open(path, encoding="utf-8") as dataset:
+        header, *lines = dataset.read().splitlines()
+    referenced = {
+        test_fields(i)[3]
+        for stride in (TIC_FIC_STRIDE, TSO_ISO_STRIDE)
+        for i in range(0, rows, stride)
+    }
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    for commit in range(commits):
+        start = rng.randrange(len(lines))
+        for _ in range(edits):
+            position = edit_position(distribution, len(lines), start, rng)
+            kind = rng.choices(kinds, weights)[0]
+            apply_edit(lines, kind, position, referenced, rng)
+        if corrupt and rng.random() < corrupt:
+            position = edit_position(distribution, len(lines), start, rng)
+            lines[position] = ",".join(
+                corrupt_row(PR_FILE, lines[position].split(","), "status")[0]
+            )
+            counts["history: status"] += 1
+        write_rows(path, [header], (line.split(",") for line in lines))
+        git_in(directory, "commit", "-q", "-am", "Edit %d" % (commit + 1))
+    return counts
+
+
+def parse_mix(value):
+    """Parses an edit mix written as kind=weight,kind=weight."""
+
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in EDIT_MIX:
+            raise argparse.ArgumentTypeError("unknown kind of edit: " + kind)
+        mix[kind] = float(weight)
+    return mix
+
+
+def main(argv):
+    """Writes a synthetic dataset, with a git history if asked to."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("directory")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument(
+        "--corrupt",
+        type=float,
+        default=0.0,
+        help="fraction of rows (and of commits) that are corrupted",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--commits",
+        type=int,
+        default=0,
+        help="number of commits editing the dataset, making directory a "
+        "git repository",
+    )
+    parser.add_argument("--edits", type=int, default=10)
+    parser.add_argument(
+        "--distribution", choices=DISTRIBUTIONS, default="uniform"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=EDIT_MIX,
+        help="weights of the kinds of edit, e.g. modify=6,insert=3,delete=1",
+    )
+    args = parser.parse_args(argv)
+
+    if args.commits:
+        counts = build_history(
+            args.directory,
+            args.rows,
+            args.commits,
+            args.edits,
+            args.distribution,
+            args.mix,
+            args.corrupt,
+            args.seed,
+        )
+    else:
+        counts = write_dataset(
+            args.directory, args.rows, args.corrupt, args.seed
+        )
+    for kind, count in sorted(counts.items()):
+        print("%-32s %d" % (kind, count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,59 +1,212 @@
 """Contains implementations of rules that are common to all dataset files"""
 
+import os
 import re
-import csv
-import subprocess
+import sys
+from bisect import bisect_left
+from collections import namedtuple
+from functools import partial
+from itertools import islice
+from diagnostics import Diagnostics
+from profiling import Tally, enabled, timed
 from utils import (
-    get_committed_lines,
-    get_uncommitted_lines,
+    checked_ranges,
     log_info,
     log_std_error,
+    log_std_warning,
     log_esp_error,
 )
+from line_index import (
+    get_line,
+    merge_ranges,
+    open_dataset,
+    parse_line,
+    read_raw_lines,
+)
 
 
-# Contains regexes for columns that are commmon to pr-data and tic-fic-data
+# Contains regexes for columns that are commmon to pr-data and tic-fic-data.
+# Module Path and Fully-Qualified Name accept the same values as
+# ((\w|\.|-)+(\/|\w|\.|-)*)|^$ and
+# ((\w|\s)+\.)+(\w+|\d+|\W+)+(\[((\d+)|(\w+|\s)+)\])? respectively, but
+# without nested quantifiers, so they are matched in linear time (see
+# benchmarks/fuzz_patterns.py)
 common_data = {
     "Project URL": re.compile(r"(https:\/\/github.com)(\/(\w|\.|-)+){2}"),
     "SHA": re.compile(r"\b[0-9a-f]{40}\b"),
-    "Module Path": re.compile(r"((\w|\.|-)+(\/|\w|\.|-)*)|^$"),
-    "Fully-Qualified Name": re.compile(
-        r"((\w|\s)+\.)+(\w+|\d+|\W+)+(\[((\d+)|(\w+|\s)+)\])?"
+    "Module Path": re.compile(r"[\w.-][\w./-]*|"),
+    # A package or class name followed by a dot and anything else, since
+    # the rest of the old pattern matched any non-empty string
+    "Fully-Qualified Name": re.compile(r"[\w\s]+\.(?s:.+)"),
+}
+
+# Rules for the columns above, shared by all dataset files
+common_rules = {
+    "Project URL": common_data["Project URL"],
+    "SHA Detected": common_data["SHA"],
+    "Module Path": common_data["Module Path"],
+    "Fully-Qualified Test Name (packageName.ClassName.methodName)": (
+        common_data["Fully-Qualified Name"]
     ),
 }
 
+ERROR = "error"
+WARNING = "warning"
+
+# Pattern of a column rule whose violations are logged with given severity
+Rule = namedtuple("Rule", ["pattern", "severity"], defaults=[ERROR])
+
+
+# Matches the raw bytes of a field, which may contain quoted commas
+RAW_FIELD = re.compile(rb'(?:"[^"]*"|[^,"\r\n])*')
+
+# Smallest number of bytes of a file that a worker process validates at once
+MIN_CHUNK_SIZE = 1 << 20
+
+# Number of rows looked up in the validation cache at once
+CACHE_BATCH = 512
+
+# Rows of a range looked up in the validation cache before deciding whether
+# it pays off, and the fewest of them that have to be found for it to: a
+# lookup costs about half as much as checking the row
+CACHE_SAMPLE = 4 * CACHE_BATCH
+MIN_HIT_RATE = 0.5
+
+# Deleting more rows than this at once usually means the file was rewritten,
+# so its order is checked in full
+BULK_DELETION = 1000
+
 
 def check_header(header, valid_dict, filename, log):
     """Validates that the header is correct."""
 
-    if not header == valid_dict["columns"]:
+    if list(header) != valid_dict["columns"]:
 
         # Check that columns are properly formatted
-        log_esp_error(filename, log, "The header is improperly formatted")
+        log_esp_error(
+            filename, log, "The header is improperly formatted", "header", 1
+        )
+
 
+def parts_in(values, separator, value):
+    """Checks that every part of value, split by separator, is in values."""
 
-def check_common_rules(filename, row, i, log):
+    return values.issuperset(value.split(separator))
+
+
+def in_values(values, separator=None):
     """
-    Checks validity of Project URL, SHA Detected, Module Path,
-    Fully-Qualified Test Name (packageName.ClassName.methodName).
+    Returns a matcher that accepts a value if it is one of values or, given
+    a separator, if every part of it is.
     """
 
-    if not common_data["Project URL"].fullmatch(row["Project URL"]):
-        log_std_error(filename, log, i, row, "Project URL")
-    if not common_data["SHA"].fullmatch(row["SHA Detected"]):
-        log_std_error(filename, log, i, row, "SHA Detected")
-    if not common_data["Module Path"].fullmatch(row["Module Path"]):
-        log_std_error(filename, log, i, row, "Module Path")
-    if not common_data["Fully-Qualified Name"].fullmatch(
-        row["Fully-Qualified Test Name (packageName.ClassName.methodName)"]
-    ):
-        log_std_error(
-            filename,
-            log,
-            i,
-            row,
-            "Fully-Qualified Test Name (packageName.ClassName.methodName)",
+    values = frozenset(values)
+    if separator is None:
+        return values.__contains__
+    return partial(parts_in, values, separator)
+
+
+def compile_matcher(pattern):
+    """
+    Turns a rule pattern into a function that tells whether a value matches
+    it: regexes must match the whole value and lists hold the valid values.
+    Callables are used as they are.
+    """
+
+    if isinstance(pattern, re.Pattern):
+        return pattern.fullmatch
+    if isinstance(pattern, (list, tuple, set, frozenset)):
+        return in_values(pattern)
+    return pattern
+
+
+def validate_row(table, cross_rules, filename, fields, i, log):
+    """Checks every rule of a compiled schema on the fields of row i."""
+
+    for position, column, matches, is_error in table:
+        value = fields[position]
+        if not matches(value):
+            if is_error:
+                log_std_error(filename, log, i, value, column)
+            else:
+                log_std_warning(filename, log, i, value, column)
+    for check_rule in cross_rules:
+        check_rule(filename, fields, i, log)
+
+
+def compile_validator(data_dict):
+    """
+    Compiles the rules of a dataset schema into a function that validates a
+    row's fields in a single loop. Each entry of data_dict["rules"] maps a
+    column to its pattern, or to a Rule when the pattern isn't an error.
+    The functions in data_dict["cross_rules"] then check the row as a
+    whole, given its fields, which they read at positions resolved once
+    with column_positions. The validator can be pickled, and sent to worker
+    processes, as long as its patterns and rules are defined at module
+    level.
+    """
+
+    columns = data_dict["columns"]
+    table = []
+    for column, rule in data_dict["rules"].items():
+        if not isinstance(rule, Rule):
+            rule = Rule(rule)
+        table.append(
+            (
+                columns.index(column),
+                column,
+                compile_matcher(rule.pattern),
+                rule.severity == ERROR,
+            )
         )
+    cross_rules = tuple(data_dict.get("cross_rules", ()))
+    return partial(validate_row, tuple(table), cross_rules)
+
+
+def column_positions(data_dict, *columns):
+    """Resolves the names of columns of a schema into their positions."""
+
+    return tuple(data_dict["columns"].index(column) for column in columns)
+
+
+def intern_fields(fields, positions):
+    """
+    Returns the fields of a row as a tuple whose values at positions, those
+    of columns that repeat across rows (e.g. Project URL or Status), are
+    interned, so that rows kept in memory share a single copy of each.
+    """
+
+    fields = list(fields)
+    for position in positions:
+        if position < len(fields):
+            fields[position] = sys.intern(fields[position])
+    return tuple(fields)
+
+
+def instrument_validator(file, validate, tally):
+    """
+    Returns a copy of a compiled validator whose column and cross rules are
+    timed by tally, each as a phase of its own. Validators that weren't
+    compiled by compile_validator are returned as they are.
+    """
+
+    if not isinstance(validate, partial) or validate.func is not validate_row:
+        return validate
+    table, cross_rules = validate.args
+    table = tuple(
+        (
+            position,
+            column,
+            tally.wrap("rule " + file + ": " + column, matches),
+            is_error,
+        )
+        for position, column, matches, is_error in table
+    )
+    cross_rules = tuple(
+        tally.wrap("rule " + file + ": " + check_rule.__name__, check_rule)
+        for check_rule in cross_rules
+    )
+    return partial(validate_row, table, cross_rules)
 
 
 def check_row_length(header_len, filename, row, i, log):
@@ -69,57 +222,273 @@ def check_row_length(header_len, filename, row, i, log):
             + str(header_len)
             + " but is "
             + str(len(row)),
+            "row-length",
+            i,
         )
 
 
-def check_sort(filename, log):
-    """Checks order of a file."""
-
-    command = (
-        'echo "$(head -n1 '
-        + filename
-        + " && tail -n +2 "
-        + filename
-        + ' | LC_ALL=C sort -k1,1 -k4,4 -t, -f)" >  sorted-'
-        + filename
-        + "; diff "
-        + filename
-        + " sorted-"
-        + filename
-        + "; rm sorted-"
-        + filename
+def sort_key(line):
+    """
+    Computes the key a raw line is ordered by: its Project URL and
+    Fully-Qualified Test Name, case-folded and compared bytewise (as in
+    LC_ALL=C sort -f), with the whole line as last resort. Quoted fields
+    keep their quotes, but commas inside them don't split the line.
+    """
+
+    line = line.rstrip(b"\r\n")
+    fields = []
+    pos = 0
+    for _ in range(4):
+        match = RAW_FIELD.match(line, pos)
+        fields.append(match.group().upper())
+        pos = match.end() + 1
+        if line[match.end() : pos] != b",":
+            fields += [b""] * (4 - len(fields))
+            break
+    return (fields[0], fields[3], line)
+
+
+def log_unsorted(filename, log, i):
+    """Logs that row i of filename should come before row i - 1."""
+
+    log_esp_error(
+        filename,
+        log,
+        "The file is not properly ordered: row "
+        + str(i)
+        + " should come before row "
+        + str(i - 1),
+        "sort-order",
+        i,
+    )
+
+
+def check_sort_full(filename, log):
+    """
+    Checks order of a whole file, comparing each row with the previous one
+    in a single pass. Returns the number of rows it read.
+    """
+
+    data, index = open_dataset(filename)
+    i = 1
+    previous = None
+    for i, line in read_raw_lines(data, index, [(2, len(index))]):
+        key = sort_key(line)
+        if previous is not None and key < previous:
+            log_unsorted(filename, log, i)
+            break
+        previous = key
+    return i - 1
+
+
+def check_sort_changes(filename, log, changes):
+    """
+    Checks order of a file given its changes, comparing only the rows next
+    to a changed or deleted row with each other. A full pass is made if the
+    header changed or many rows were deleted at once. Returns the number of
+    pairs of rows it compared.
+    """
+
+    changed_lines = merge_ranges(changes["changed"])
+    header_changed = (changed_lines and changed_lines[0][0] <= 1) or any(
+        line == 0 for line, _ in changes["deleted"]
     )
-    diff = subprocess.check_output(command, shell=True).decode("utf-8")
-    if diff != "":
-        log_esp_error(filename, log, "The file is not properly ordered")
-
-
-def run_checks(file, data_dict, log, commit_range, checks):
-    """Checks rule compliance for any given dataset file."""
-
-    committed_lines = get_committed_lines(file, commit_range)
-    uncommitted_lines = get_uncommitted_lines(file)
-    with open(file, newline="") as csvfile:
-        info = csv.DictReader(csvfile, data_dict["columns"])
-        header = next(info)
-        if "1" in uncommitted_lines or "1" in committed_lines:
-            check_header(list(header.values()), data_dict, file, log)
-        if uncommitted_lines != [] or committed_lines != []:
-            for i, row in enumerate(info):
-                i += 2
-                line = str(i)
-                # The line is either:
-                # (1) only uncommitted (needs to always bechecked locally),
-                # (2) only committed (needs to always be checked in CI) or
-                # (3) both in the unpushed commits and uncommitted (which in
-                # practice is the same as (1)--the committed one is
-                # deprecated--)
-                if (line in uncommitted_lines) or (line in committed_lines):
-                    params = [file, row, line, log]
-                    for check_rule in checks:
-                        if check_rule.__name__ == check_row_length.__name__:
-                            check_rule(len(header), *params)
-                            continue
-                        check_rule(*params)
+    deleted = sum(count for _, count in changes["deleted"])
+    if header_changed or deleted > BULK_DELETION:
+        return check_sort_full(filename, log)
+
+    # Each boundary i stands for the pair of rows (i - 1, i)
+    boundaries = set()
+    for first, last in changed_lines:
+        boundaries.update(range(first, last + 2))
+    boundaries.update(line + 1 for line, _ in changes["deleted"])
+    if not boundaries:
+        return 0
+    data, index = open_dataset(filename)
+    compared = 0
+    for i in sorted(boundaries):
+        # Row 2 is preceded by the header, which isn't sorted
+        if i < 3 or i > len(index):
+            continue
+        compared += 1
+        if sort_key(get_line(data, index, i)) < sort_key(
+            get_line(data, index, i - 1)
+        ):
+            log_unsorted(filename, log, i)
+            break
+    return compared
+
+
+def check_sort(filename, log, changes=None):
+    """
+    Checks order of a file: in full, or only around its changes if they
+    are known (see check_sort_changes).
+    """
+
+    with timed("check_sort " + filename) as timer:
+        if changes is None:
+            timer.rows = check_sort_full(filename, log)
+        else:
+            timer.rows = check_sort_changes(filename, log, changes)
+
+
+def check_fields(file, data_dict, log, validate, i, fields):
+    """Checks the parsed fields of line i."""
+
+    columns = data_dict["columns"]
+    line = str(i)
+    if i == 1:
+        check_header(fields, data_dict, file, log)
+    elif len(fields) != len(columns):
+        check_row_length(len(columns), file, fields, line, log)
+    else:
+        validate(file, fields, line, log)
+
+
+def check_lines(
+    file, data_dict, log, validate, data, index, ranges, cache, tally=None
+):
+    """
+    Checks the lines of data contained in the (first, last) ranges. Rows
+    that are found in the validation cache are skipped without being
+    parsed, and rows that log nothing are added to it. If fewer than
+    MIN_HIT_RATE of the first CACHE_SAMPLE rows are found, the rest are
+    checked without looking them up, but still added. If a tally is
+    given, parsing and each rule are timed by it.
+    """
+
+    parse = parse_line
+    if tally is not None:
+        validate = instrument_validator(file, validate, tally)
+        parse = tally.wrap("parse " + file, parse_line)
+    lines = read_raw_lines(data, index, ranges)
+    if cache is None:
+        for i, line in lines:
+            check_fields(file, data_dict, log, validate, i, parse(line))
+        return
+    looked_up = found = 0
+    while True:
+        batch = list(islice(lines, CACHE_BATCH))
+        if not batch:
+            break
+        digests = [cache.digest(file, line) for _, line in batch]
+        if looked_up < CACHE_SAMPLE or found >= MIN_HIT_RATE * looked_up:
+            known = cache.lookup(digests)
+            looked_up += len(digests)
+            found += len(known)
         else:
+            known = ()
+        for (i, line), digest in zip(batch, digests):
+            if digest in known:
+                continue
+            fields = parse(line)
+            logged = len(log)
+            check_fields(file, data_dict, log, validate, i, fields)
+            if len(log) == logged:
+                cache.add(digest)
+
+
+def check_chunk(file, data_dict, validate, cache, profile, chunk):
+    """
+    Checks the lines of file in the (first, last) range chunk in a worker
+    process, returning its diagnostics, what was found in or added to the
+    validation cache and, if profile is set, the time taken by each rule.
+    """
+
+    data, index = open_dataset(file)
+    log = Diagnostics()
+    tally = Tally() if profile else None
+    check_lines(
+        file, data_dict, log, validate, data, index, [chunk], cache, tally
+    )
+    return log, cache, tally
+
+
+def split_chunks(index, size):
+    """
+    Splits a file of size bytes, whose line index is index, into (first,
+    last) ranges of lines covering roughly the same number of bytes. There
+    are a few chunks per CPU, each one at least MIN_CHUNK_SIZE bytes long.
+    """
+
+    count = min(size // MIN_CHUNK_SIZE, (os.cpu_count() or 1) * 4)
+    starts = [1]
+    for k in range(1, count):
+        start = bisect_left(index, size * k // count) + 1
+        if starts[-1] < start <= len(index):
+            starts.append(start)
+    starts.append(len(index) + 1)
+    return [(first, last - 1) for first, last in zip(starts, starts[1:])]
+
+
+def audit_checks(file, data_dict, log, validate, cache, tally=None):
+    """
+    Checks rule compliance for every line of any given dataset file. Large
+    files are split into chunks that are checked in parallel by a pool of
+    processes, and their diagnostics are merged back in row order. If
+    audit_checks.columnar is set, the columnar backend is used instead.
+    If a tally is given, parsing and each rule are timed by it.
+    """
+
+    if getattr(audit_checks, "columnar", False):
+        from columnar import audit_columns
+
+        audit_columns(file, data_dict, log, validate, cache)
+        return
+    data, index = open_dataset(file)
+    chunks = split_chunks(index, len(data))
+    if len(chunks) <= 1:
+        check_lines(
+            file, data_dict, log, validate, data, index, chunks, cache, tally
+        )
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor() as executor:
+        check = partial(
+            check_chunk, file, data_dict, validate, cache, tally is not None
+        )
+        for chunk_log, chunk_cache, chunk_tally in executor.map(check, chunks):
+            log.extend(chunk_log)
+            if cache is not None:
+                cache.merge(chunk_cache)
+            if tally is not None:
+                tally.merge(chunk_tally)
+
+
+def run_checks(file, data_dict, log, changes, validate):
+    """
+    Checks rule compliance for any given dataset file, using the validator
+    compiled from its schema. Only the lines contained in the (first, last)
+    ranges of checked_ranges(changes) are checked, or every line if changes
+    is None. If run_checks.cache is set, it is used as validation cache.
+    While profiling is enabled, parsing and each rule are timed too.
+    """
+
+    cache = getattr(run_checks, "cache", None)
+    tally = Tally() if enabled() else None
+    with timed("check " + file) as timer:
+        if changes is None:
+            audit_checks(file, data_dict, log, validate, cache, tally)
+            timer.rows = max(len(open_dataset(file)[1]) - 1, 0)
+        elif not checked_ranges(changes):
             log_info(file, log, "There are no changes to be checked")
+        else:
+            data, index = open_dataset(file)
+            ranges = merge_ranges(checked_ranges(changes))
+            check_lines(
+                file,
+                data_dict,
+                log,
+                validate,
+                data,
+                index,
+                ranges,
+                cache,
+                tally,
+            )
+            timer.rows = sum(last - first + 1 for first, last in ranges)
+        if cache is not None:
+            cache.save()
+    if tally is not None:
+        tally.flush()
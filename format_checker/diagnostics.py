@@ -0,0 +1,233 @@
+"""
+Implements the collection of the errors, warnings and informational messages
+found by the checkers, and their output in several formats.
+"""
+
+import sys
+import json
+from collections import Counter
+
+
+ERROR = "error"
+WARNING = "warning"
+INFO = "info"
+
+# Severity of a diagnostic as a SARIF level and a GitHub workflow command
+SARIF_LEVELS = {ERROR: "error", WARNING: "warning", INFO: "note"}
+GITHUB_COMMANDS = {ERROR: "error", WARNING: "warning", INFO: "notice"}
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+TOOL_NAME = "idoft-format-checker"
+
+FORMATS = ["text", "json", "sarif", "github"]
+
+
+class Diagnostic:
+    """
+    Something a checker found in a dataset file: an invalid value of a
+    column, if column is given, or else a free-form message. Its text is
+    only built when it is written.
+    """
+
+    __slots__ = ("file", "row", "column", "rule", "severity", "value")
+
+    def __init__(self, file, row, column, rule, severity, value):
+        self.file = file
+        self.row = row
+        self.column = column
+        self.rule = rule
+        self.severity = severity
+        self.value = value
+
+    def message(self):
+        """Describes the diagnostic, without saying where it was found."""
+
+        if self.column is None:
+            return self.value
+        return "Invalid " + self.column + ': "' + self.value + '"'
+
+    def text(self):
+        """Formats the diagnostic as a line (or two) of plain text."""
+
+        if self.severity == INFO:
+            return "INFO: On file " + self.file + ": " + self.message()
+        if self.severity == WARNING:
+            return (
+                "WARNING: On file "
+                + self.file
+                + ", row "
+                + str(self.row)
+                + ": \n"
+                + self.message()
+            )
+        if self.column is None:
+            return "ERROR: On file " + self.file + ": " + self.message()
+        return (
+            "ERROR: On file "
+            + self.file
+            + ", row "
+            + str(self.row)
+            + ":\n"
+            + self.message()
+        )
+
+    def to_dict(self):
+        """Returns the fields of the diagnostic as a dictionary."""
+
+        return {
+            "file": self.file,
+            "row": None if self.row is None else int(self.row),
+            "column": self.column,
+            "rule": self.rule,
+            "severity": self.severity,
+            "value": self.value if self.column is not None else None,
+            "message": self.message(),
+        }
+
+    def sarif(self):
+        """Formats the diagnostic as a SARIF result."""
+
+        location = {"artifactLocation": {"uri": self.file}}
+        if self.row is not None:
+            location["region"] = {"startLine": int(self.row)}
+        return {
+            "ruleId": self.rule,
+            "level": SARIF_LEVELS[self.severity],
+            "message": {"text": self.message()},
+            "locations": [{"physicalLocation": location}],
+        }
+
+    def github(self):
+        """Formats the diagnostic as a GitHub Actions workflow command."""
+
+        properties = "file=" + escape_property(self.file)
+        if self.row is not None:
+            properties += ",line=" + str(self.row)
+        properties += ",title=" + escape_property(self.rule)
+        return (
+            "::"
+            + GITHUB_COMMANDS[self.severity]
+            + " "
+            + properties
+            + "::"
+            + escape_data(self.message())
+        )
+
+
+def escape_data(value):
+    """Escapes the message of a GitHub workflow command."""
+
+    return (
+        value.replace("%", "%25").replace("\r", "%0D").replace("\n", "%0A")
+    )
+
+
+def escape_property(value):
+    """Escapes a property of a GitHub workflow command."""
+
+    return escape_data(value).replace(":", "%3A").replace(",", "%2C")
+
+
+class Diagnostics:
+    """
+    Collects the diagnostics of a run in the order they are found. It is
+    passed to the checkers in place of a logger, and everything it holds is
+    written at once when the run ends.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, diagnostic):
+        """Adds a diagnostic."""
+
+        self.records.append(diagnostic)
+
+    def extend(self, other):
+        """Adds the diagnostics collected by another instance."""
+
+        self.records.extend(other.records)
+
+    def count(self, severity):
+        """Counts the diagnostics of the given severity."""
+
+        return sum(1 for record in self.records if record.severity == severity)
+
+    def count_by_rule(self):
+        """Counts the errors and warnings of each rule."""
+
+        return Counter(
+            record.rule for record in self.records if record.severity != INFO
+        )
+
+    def format(self, output_format):
+        """Formats every diagnostic in one of FORMATS."""
+
+        if output_format == "text":
+            lines = [record.text() for record in self.records]
+        elif output_format == "json":
+            lines = [json.dumps(record.to_dict()) for record in self.records]
+            lines.append(
+                json.dumps({"summary": dict(self.count_by_rule())})
+            )
+        elif output_format == "github":
+            lines = [
+                record.github()
+                for record in self.records
+                if record.severity != INFO
+            ]
+        else:
+            return json.dumps(self.sarif(), indent=2) + "\n"
+        return "".join(line + "\n" for line in lines)
+
+    def sarif(self):
+        """Builds a SARIF log of the errors and warnings."""
+
+        counts = self.count_by_rule()
+        return {
+            "$schema": SARIF_SCHEMA,
+            "version": "2.1.0",
+            "runs": [
+                {
+                    "tool": {
+                        "driver": {
+                            "name": TOOL_NAME,
+                            "rules": [{"id": rule} for rule in sorted(counts)],
+                        }
+                    },
+                    "results": [
+                        record.sarif()
+                        for record in self.records
+                        if record.severity != INFO
+                    ],
+                    "properties": {"counts": dict(counts)},
+                }
+            ],
+        }
+
+    def write(self, stream, output_format):
+        """Writes every diagnostic to stream with a single write."""
+
+        stream.write(self.format(output_format))
+
+
+def write_output(diagnostics, output_format, path, summary):
+    """
+    Writes the diagnostics and the summary of a run. Text goes to stderr in
+    one write, and other formats go to stdout (or to the file at path, if
+    given), with the summary still on stderr.
+    """
+
+    if path is not None:
+        with open(path, "w", encoding="utf-8") as output:
+            diagnostics.write(output, output_format)
+        sys.stderr.write(summary)
+    elif output_format == "text":
+        sys.stderr.write(diagnostics.format(output_format) + summary)
+    else:
+        diagnostics.write(sys.stdout, output_format)
+        sys.stderr.write(summary)
@@ -0,0 +1,479 @@
+"""
+Exports the dataset files, as they are at a commit, to an indexed SQLite
+database (and optionally to Parquet files), which can then be queried by
+project, test, SHA, category and status in milliseconds. The database
+remembers the commit it was exported from, so that exporting a later commit
+only applies the rows that changed since then.
+
+Run it from the root directory:
+
+    $ python format_checker/export.py build [commit] [--parquet DIR]
+    $ python format_checker/export.py query --status Opened --category OD
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import importlib.util
+from array import array
+from line_index import get_blob_line_index, parse_line, read_raw_lines
+from schemas import SCHEMAS
+from utils import (
+    CatFile,
+    get_cache_dir,
+    git,
+    parse_diff,
+    replace_atomically,
+    rev_exists,
+)
+
+
+DATASET_FILES = list(SCHEMAS)
+
+# Columns that can be queried, by option, which are indexed in every table
+# that has them
+QUERY_COLUMNS = {
+    "project": "Project URL",
+    "sha": "SHA Detected",
+    "test": "Fully-Qualified Test Name (packageName.ClassName.methodName)",
+    "category": "Category",
+    "status": "Status",
+}
+
+# Rows inserted with a single statement
+INSERT_BATCH = 1000
+
+
+def column_name(column):
+    """
+    Turns the name of a column (or of a file) into an SQL name, e.g.
+    "Fully-Qualified Test Name (packageName.ClassName.methodName)" into
+    fully_qualified_test_name.
+    """
+
+    name = re.sub(r"\(.*?\)", "", column)
+    return re.sub(r"\W+", "_", name).strip("_").lower()
+
+
+def table_name(filename):
+    """Returns the name of the table of a dataset file, e.g. pr_data."""
+
+    return column_name(os.path.splitext(filename)[0])
+
+
+def get_database_path():
+    """Returns the path of the database the dataset is exported to."""
+
+    return os.path.join(get_cache_dir(), "dataset.sqlite")
+
+
+def get_schema():
+    """Describes the columns of every table, to tell when they change."""
+
+    return json.dumps(
+        {
+            filename: ["raw", "line"] + SCHEMAS[filename][0]["columns"]
+            for filename in SCHEMAS
+        },
+        sort_keys=True,
+    )
+
+
+def create_tables(connection):
+    """
+    Creates the table of every dataset file, with the raw text of each row,
+    its line in the file and a column for each of its fields, and their
+    indexes.
+    """
+
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS export (key TEXT PRIMARY KEY, value TEXT)"
+    )
+    for filename, (data_dict, _) in SCHEMAS.items():
+        table = table_name(filename)
+        columns = [column_name(column) for column in data_dict["columns"]]
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS "
+            + table
+            + " (raw TEXT NOT NULL, line INTEGER NOT NULL, "
+            + ", ".join(column + " TEXT" for column in columns)
+            + ")"
+        )
+        indexed = ["raw", "line"] + [
+            column_name(column)
+            for column in QUERY_COLUMNS.values()
+            if column in data_dict["columns"]
+        ]
+        for column in indexed:
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)"
+                % (table, column, table, column)
+            )
+
+
+def drop_tables(connection):
+    """Drops the table of every dataset file."""
+
+    for filename in SCHEMAS:
+        connection.execute("DROP TABLE IF EXISTS " + table_name(filename))
+
+
+def read_setting(connection, key):
+    """Returns a setting of the export, or None if it isn't set."""
+
+    try:
+        row = connection.execute(
+            "SELECT value FROM export WHERE key = ?", (key,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # Nothing has been exported yet
+        return None
+    return None if row is None else row[0]
+
+
+def write_setting(connection, key, value):
+    """Sets a setting of the export."""
+
+    connection.execute(
+        "INSERT OR REPLACE INTO export VALUES (?, ?)", (key, value)
+    )
+
+
+def insert_lines(connection, filename, lines):
+    """
+    Inserts the (line number, raw line) pairs of filename as rows, skipping
+    those that don't have as many fields as it has columns. Returns how
+    many were inserted.
+    """
+
+    table = table_name(filename)
+    width = len(SCHEMAS[filename][0]["columns"])
+    statement = "INSERT INTO %s VALUES (%s)" % (
+        table,
+        ", ".join("?" * (width + 2)),
+    )
+    inserted = 0
+    batch = []
+    for i, line in lines:
+        fields = parse_line(line)
+        if len(fields) == width:
+            batch.append([line.decode("utf-8").rstrip("\r\n"), i] + fields)
+        if len(batch) == INSERT_BATCH:
+            connection.executemany(statement, batch)
+            inserted += len(batch)
+            batch = []
+    connection.executemany(statement, batch)
+    return inserted + len(batch)
+
+
+def delete_lines(connection, filename, lines):
+    """
+    Deletes the rows of filename at the given line numbers. Returns how
+    many were deleted.
+    """
+
+    return connection.executemany(
+        "DELETE FROM " + table_name(filename) + " WHERE line = ?",
+        ((i,) for i in lines),
+    ).rowcount
+
+
+def shift_lines(connection, filename, hunks):
+    """
+    Renumbers the rows of filename that the (old start, old count, new
+    start, new count) hunks of a diff left in place, whose lines moved by
+    the lines the hunks before them added or removed. Each row is first
+    given the negated new number, so that no row is moved twice.
+    """
+
+    table = table_name(filename)
+    shift = 0
+    for k, (old_start, old_count, _, new_count) in enumerate(hunks):
+        shift += new_count - old_count
+        # Lines after the hunk, up to the next one, where hunks that only
+        # add lines add them after their old start
+        first = old_start + old_count if old_count else old_start + 1
+        last = None
+        if k + 1 < len(hunks):
+            next_start, next_count = hunks[k + 1][:2]
+            last = next_start - 1 if next_count else next_start
+        if shift == 0 or (last is not None and last < first):
+            continue
+        connection.execute(
+            "UPDATE "
+            + table
+            + " SET line = -(line + ?) WHERE line >= ?"
+            + ("" if last is None else " AND line <= ?"),
+            (shift, first) + (() if last is None else (last,)),
+        )
+    connection.execute("UPDATE " + table + " SET line = -line WHERE line < 0")
+
+
+def read_blob(cat_file, commit, filename):
+    """
+    Returns the contents and line index of filename at commit, which are
+    empty if it doesn't exist there.
+    """
+
+    blob = cat_file.read(commit + ":" + filename)
+    if blob is None or not blob[2]:
+        return b"", array("q")
+    return blob[2], get_blob_line_index(blob[0], blob[2])
+
+
+def export_commit(connection, commit, full=False):
+    """
+    Brings the database up to date with the dataset files at commit, by
+    applying the lines that changed since the commit it was exported from,
+    or by exporting them from scratch if full is set, there is no such
+    commit or the columns have changed. Returns the (inserted, deleted)
+    rows of each file, or None if the database was up to date.
+    """
+
+    schema = get_schema()
+    base = read_setting(connection, "commit")
+    if read_setting(connection, "schema") != schema:
+        drop_tables(connection)
+        full = True
+    create_tables(connection)
+    if base == commit and not full:
+        return None
+    changes = None
+    if not full and base is not None and rev_exists(base):
+        diff = git(
+            "diff",
+            "-U0",
+            "--no-color",
+            "--no-ext-diff",
+            "--no-renames",
+            base,
+            commit,
+            "--",
+            *DATASET_FILES,
+        )
+        changes = parse_diff(diff, base)
+
+    counts = {}
+    with CatFile() as cat_file, connection:
+        for filename in DATASET_FILES:
+            change = None if changes is None else changes.get(filename)
+            data, index = read_blob(cat_file, commit, filename)
+            if changes is not None and change is None and data:
+                counts[filename] = (0, 0)
+                continue
+            if (
+                change is None
+                or any(line == 1 for line, _ in change["removed"])
+                or any(first == 1 for first, _ in change["changed"])
+            ):
+                # Exported from scratch, the header may have changed too
+                deleted = connection.execute(
+                    "DELETE FROM " + table_name(filename)
+                ).rowcount
+                ranges = [(2, len(index))]
+            else:
+                deleted = delete_lines(
+                    connection, filename, (i for i, _ in change["removed"])
+                )
+                shift_lines(connection, filename, change["hunks"])
+                ranges = change["changed"]
+            inserted = insert_lines(
+                connection, filename, read_raw_lines(data, index, ranges)
+            )
+            counts[filename] = (inserted, deleted)
+        write_setting(connection, "commit", commit)
+        write_setting(connection, "schema", schema)
+    return counts
+
+
+def write_parquet(connection, directory):
+    """
+    Writes the table of every dataset file to a Parquet file of the same
+    name in directory, replacing it atomically.
+    """
+
+    import pyarrow
+    import pyarrow.parquet
+
+    os.makedirs(directory, exist_ok=True)
+    for filename, (data_dict, _) in SCHEMAS.items():
+        table = table_name(filename)
+        columns = [column_name(column) for column in data_dict["columns"]]
+        rows = connection.execute(
+            "SELECT %s FROM %s ORDER BY line" % (", ".join(columns), table)
+        ).fetchall()
+        arrays = [
+            pyarrow.array([row[k] for row in rows], pyarrow.string())
+            for k in range(len(columns))
+        ]
+
+        def write(output, _):
+            pyarrow.parquet.write_table(
+                pyarrow.Table.from_arrays(arrays, names=columns), output
+            )
+            return True
+
+        replace_atomically(os.path.join(directory, table + ".parquet"), write)
+
+
+def query_rows(connection, filename, filters):
+    """
+    Returns the raw lines of filename whose columns match every filter,
+    which maps options of QUERY_COLUMNS to values, in the order they are in
+    the file, or None if filename lacks some of the columns. Projects can be
+    given as owner/name, tests ending with * match every test they are a
+    prefix of, and categories match rows with several categories that
+    include them.
+    """
+
+    columns = SCHEMAS[filename][0]["columns"]
+    clauses = []
+    parameters = []
+    for option, value in filters.items():
+        if QUERY_COLUMNS[option] not in columns:
+            return None
+        column = column_name(QUERY_COLUMNS[option])
+        if option == "project" and "://" not in value:
+            value = "https://github.com/" + value.strip("/")
+        if option == "test" and value.endswith("*"):
+            clauses.append("substr(%s, 1, ?) = ?" % column)
+            parameters += [len(value) - 1, value[:-1]]
+        elif option == "category":
+            clauses.append(
+                "(%s = ? OR ';' || %s || ';' LIKE ?)" % (column, column)
+            )
+            parameters += [value, "%;" + value + ";%"]
+        else:
+            clauses.append(column + " = ?")
+            parameters.append(value)
+    return [
+        raw
+        for raw, in connection.execute(
+            "SELECT raw FROM "
+            + table_name(filename)
+            + (" WHERE " + " AND ".join(clauses) if clauses else "")
+            + " ORDER BY line",
+            parameters,
+        )
+    ]
+
+
+def build(args, connection):
+    """Exports a commit, as asked by the build command."""
+
+    if args.parquet and importlib.util.find_spec("pyarrow") is None:
+        sys.exit("--parquet requires pyarrow to be installed")
+    commit = git("rev-parse", "--verify", args.commit + "^{commit}").strip()
+    start = time.perf_counter()
+    counts = export_commit(connection, commit, args.full)
+    if counts is None:
+        summary = "Already up to date with " + commit[:12]
+    else:
+        summary = "Exported " + commit[:12] + ": " + ", ".join(
+            "%s +%d -%d" % (filename, inserted, deleted)
+            for filename, (inserted, deleted) in counts.items()
+        )
+    if args.parquet and (
+        counts is not None
+        or not all(
+            os.path.exists(
+                os.path.join(args.parquet, table_name(name) + ".parquet")
+            )
+            for name in SCHEMAS
+        )
+    ):
+        write_parquet(connection, args.parquet)
+    sys.stderr.write(
+        "%s in %.0f ms\n" % (summary, (time.perf_counter() - start) * 1000)
+    )
+    return 0
+
+
+def query(args, connection):
+    """Writes the rows that match the query of the query command."""
+
+    if args.update:
+        commit = git("rev-parse", "--verify", "HEAD^{commit}").strip()
+        export_commit(connection, commit)
+    filters = {
+        option: getattr(args, option)
+        for option in QUERY_COLUMNS
+        if getattr(args, option) is not None
+    }
+    start = time.perf_counter()
+    matches = 0
+    sections = []
+    for filename in [args.file] if args.file else DATASET_FILES:
+        rows = query_rows(connection, filename, filters)
+        if rows is None:
+            if args.file:
+                sys.exit(
+                    filename + " can't be queried by " + ", ".join(filters)
+                )
+            continue
+        if rows or args.file:
+            header = ",".join(SCHEMAS[filename][0]["columns"])
+            sections.append("\n".join([header] + rows) + "\n")
+            matches += len(rows)
+    sys.stdout.write("\n".join(sections))
+    sys.stderr.write(
+        "%d row(s) in %.1f ms\n"
+        % (matches, (time.perf_counter() - start) * 1000)
+    )
+    return 0
+
+
+def main(argv):
+    """Runs the build or query command."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", help="file the dataset is exported to")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser(
+        "build", help="export the dataset files at a commit"
+    )
+    build_parser.add_argument("commit", nargs="?", default="HEAD")
+    build_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="export every row again instead of only those that changed",
+    )
+    build_parser.add_argument(
+        "--parquet",
+        metavar="DIR",
+        help="also write each table to a Parquet file in DIR",
+    )
+    query_parser = commands.add_parser(
+        "query", help="list the rows that match every given value"
+    )
+    query_parser.add_argument("--file", choices=DATASET_FILES)
+    query_parser.add_argument("--project", help="URL or owner/name")
+    query_parser.add_argument("--sha", help="SHA Detected")
+    query_parser.add_argument("--test", help="name, or prefix ending in *")
+    query_parser.add_argument("--category")
+    query_parser.add_argument("--status")
+    query_parser.add_argument(
+        "--no-update",
+        dest="update",
+        action="store_false",
+        help="don't bring the database up to date with HEAD first",
+    )
+    args = parser.parse_args(argv)
+
+    path = args.database or get_database_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path)
+    try:
+        if args.command == "build":
+            return build(args, connection)
+        return query(args, connection)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,206 @@
+"""
+Implements the fix mode, which rewrites the dataset files with the values
+that are trivially fixable fixed (e.g. "Opened;" as Status, or stray
+whitespace) and the rows of pr-data.csv in the order check_sort expects.
+Files are sorted with an external merge sort, so that they don't have to fit
+in memory, and replaced atomically.
+"""
+
+import io
+import os
+import csv
+import heapq
+import tempfile
+from contextlib import ExitStack
+from common_checks import Rule, compile_matcher, sort_key
+from key_index import PR_FILE
+from line_index import parse_line
+from schemas import SCHEMAS
+from utils import log_info, replace_atomically
+
+
+# Bytes of rows sorted in memory at once, over which they are sorted in
+# runs that are written to temporary files and then merged
+SORT_BUFFER = 1 << 26
+
+# Most runs merged at once, to stay well under the limit of open files
+MAX_MERGE = 64
+
+
+def compile_fixers(data_dict):
+    """
+    Returns the position of every column of a schema that has a rule, with
+    a function that tells whether a value matches it.
+    """
+
+    columns = data_dict["columns"]
+    fixers = []
+    for column, rule in data_dict["rules"].items():
+        if not isinstance(rule, Rule):
+            rule = Rule(rule)
+        fixers.append((columns.index(column), compile_matcher(rule.pattern)))
+    return fixers
+
+
+def fix_value(value, matches):
+    """
+    Returns a value that breaks a rule without its surrounding whitespace
+    and trailing semicolons, if that is what it takes to follow it, or else
+    None.
+    """
+
+    stripped = value.strip()
+    for candidate in (stripped, stripped.rstrip(";").rstrip()):
+        if candidate != value and matches(candidate):
+            return candidate
+    return None
+
+
+def fix_line(line, columns, fixers, stats):
+    """
+    Fixes the values of a raw line that are trivially fixable, counting them
+    in stats. Lines with nothing to fix are returned as they are, so that
+    their quoting is kept, and every line is given a newline.
+    """
+
+    fields = parse_line(line)
+    fixed = 0
+    if len(fields) == columns:
+        for position, matches in fixers:
+            value = fix_value(fields[position], matches)
+            if value is not None:
+                fields[position] = value
+                fixed += 1
+    if not fixed:
+        return line if line[-1:] == b"\n" else line + b"\n"
+    stats["values"] += fixed
+    output = io.StringIO()
+    csv.writer(output, lineterminator="\n").writerow(fields)
+    return output.getvalue().encode("utf-8")
+
+
+def read_rows(dataset, data_dict, order, stats):
+    """
+    Yields the fixed rows of a dataset file open after its header, skipping
+    blank lines. If the rows are to be put in order, those that were out of
+    order are counted in stats.
+    """
+
+    columns = len(data_dict["columns"])
+    fixers = compile_fixers(data_dict)
+    previous = None
+    for line in dataset:
+        if not line.strip():
+            stats["blank"] += 1
+            continue
+        line = fix_line(line, columns, fixers, stats)
+        if order:
+            key = sort_key(line)
+            if previous is not None and key < previous:
+                stats["unsorted"] += 1
+            previous = key
+        yield line
+
+
+def write_run(directory, lines):
+    """Sorts lines and writes them to a new temporary file in directory."""
+
+    lines.sort(key=sort_key)
+    handle, path = tempfile.mkstemp(dir=directory, suffix=".run")
+    with os.fdopen(handle, "wb") as run:
+        run.writelines(lines)
+    return path
+
+
+def merge_runs(paths, output):
+    """Merges sorted runs into output, deleting them once merged."""
+
+    with ExitStack() as stack:
+        runs = [stack.enter_context(open(path, "rb")) for path in paths]
+        output.writelines(heapq.merge(*runs, key=sort_key))
+    for path in paths:
+        os.unlink(path)
+
+
+def sort_lines(lines, output, directory, buffer_size=SORT_BUFFER):
+    """
+    Writes lines to output ordered by sort_key, holding at most about
+    buffer_size bytes of them in memory: larger inputs are split into
+    sorted runs, kept in a temporary directory inside directory, which are
+    then merged MAX_MERGE at a time.
+    """
+
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        runs = []
+        buffer = []
+        size = 0
+        for line in lines:
+            buffer.append(line)
+            size += len(line)
+            if size >= buffer_size:
+                runs.append(write_run(scratch, buffer))
+                buffer = []
+                size = 0
+        if not runs:
+            buffer.sort(key=sort_key)
+            output.writelines(buffer)
+            return
+        if buffer:
+            runs.append(write_run(scratch, buffer))
+        while len(runs) > MAX_MERGE:
+            merged = []
+            for start in range(0, len(runs), MAX_MERGE):
+                handle, path = tempfile.mkstemp(dir=scratch, suffix=".run")
+                with os.fdopen(handle, "wb") as run:
+                    merge_runs(runs[start : start + MAX_MERGE], run)
+                merged.append(path)
+            runs = merged
+        merge_runs(runs, output)
+
+
+def fix_file(filename, data_dict, order, buffer_size=SORT_BUFFER):
+    """
+    Rewrites a dataset file with its trivially fixable values fixed, blank
+    lines removed and, if order is set, its rows sorted by sort_key. The
+    header is kept as it is. Returns what was fixed, counted by kind.
+    """
+
+    stats = {"values": 0, "blank": 0, "unsorted": 0}
+
+    def write(output, directory):
+        with open(filename, "rb") as dataset:
+            header = dataset.readline()
+            output.write(header if header[-1:] == b"\n" else header + b"\n")
+            rows = read_rows(dataset, data_dict, order, stats)
+            if order:
+                sort_lines(rows, output, directory, buffer_size)
+            else:
+                output.writelines(rows)
+        return any(stats.values())
+
+    if os.path.getsize(filename):
+        replace_atomically(filename, write)
+    return stats
+
+
+def fix_dataset(filenames, log):
+    """
+    Fixes every dataset file, sorting pr-data.csv, and logs what was
+    fixed in each of them.
+    """
+
+    for filename in filenames:
+        if not os.path.exists(filename):
+            continue
+        data_dict, _ = SCHEMAS[filename]
+        stats = fix_file(filename, data_dict, filename == PR_FILE)
+        fixes = []
+        if stats["values"]:
+            fixes.append("fixed %d value(s)" % stats["values"])
+        if stats["blank"]:
+            fixes.append("removed %d blank line(s)" % stats["blank"])
+        if stats["unsorted"]:
+            fixes.append("sorted the rows")
+        if fixes:
+            message = ", ".join(fixes)
+            log_info(filename, log, message[0].upper() + message[1:])
@@ -0,0 +1,637 @@
+"""
+Implements the history scan, which replays the commits of a range that
+changed the dataset files and finds which violations each of them introduced
+and which it fixed. The files are read once, as they were at the start of
+the range, and then kept up to date by applying the diff of each commit, so
+that only the rows a commit touched are checked again.
+"""
+
+import os
+import json
+import subprocess
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from common_checks import check_fields, log_unsorted, sort_key
+from diagnostics import Diagnostics
+from key_index import (
+    PR_FILE,
+    REFERENCE_KEY,
+    REFERRING_FILES,
+    UNIQUE_KEY,
+    key_hash,
+    log_dangling,
+    log_duplicate,
+    log_removed,
+)
+from line_index import parse_line, split_lines
+from schemas import SCHEMAS
+from utils import HUNK_HEADER, CatFile, git
+
+
+# Fewest commits scanned by each process when the range is split
+MIN_SEGMENT = 50
+
+# Violations introduced (as diagnostics, counted by rule) and fixed by a
+# commit, and the number of violations of each rule left after it
+CommitReport = namedtuple(
+    "CommitReport",
+    ["commit", "time", "subject", "introduced", "counts", "fixed", "totals"],
+)
+
+
+def get_history_range(commit_range):
+    """
+    Turns the commits given on the command line (nothing, a tip, a base and
+    a tip, or base..tip) into the commit the scan starts from, or None to
+    start from an empty dataset, and the commit it ends at.
+    """
+
+    if not commit_range:
+        return None, "HEAD"
+    if len(commit_range) == 1:
+        base, separator, tip = commit_range[0].partition("..")
+        if not separator:
+            return None, base
+        return base or None, tip or "HEAD"
+    return commit_range[0], commit_range[1]
+
+
+def list_commits(base, tip):
+    """
+    Lists the commits after base up to tip that changed the dataset files,
+    oldest first, following only the first parent of merges.
+    """
+
+    revisions = tip if base is None else base + ".." + tip
+    return git(
+        "rev-list",
+        "--reverse",
+        "--first-parent",
+        revisions,
+        "--",
+        *SCHEMAS,
+    ).split()
+
+
+def read_commits(base, tip):
+    """
+    Streams the diff of every commit listed by list_commits through a single
+    git log, yielding the id, time and subject of each with the hunks of
+    each file it changed, as (old start, old count, new start, new lines).
+    Lines keep no newline unless they are the last one and had none, as
+    split_lines does.
+    """
+
+    revisions = tip if base is None else base + ".." + tip
+    args = (
+        "git",
+        "log",
+        "--reverse",
+        "--first-parent",
+        "--diff-merges=first-parent",
+        "-p",
+        "-U0",
+        "--no-color",
+        "--no-ext-diff",
+        "--no-renames",
+        "--format=%x00%H %ct %s",
+        revisions,
+        "--",
+    ) + tuple(SCHEMAS)
+    with subprocess.Popen(args, stdout=subprocess.PIPE) as process:
+        commit = None
+        hunks = None
+        added = None
+        old_path = None
+        remaining = 0
+        last_sign = None
+        for line in process.stdout:
+            if line[-1:] == b"\n":
+                line = line[:-1]
+            if line[:1] == b"\\":
+                # "\ No newline at end of file", about the previous line
+                if last_sign == b"+":
+                    added[-1] += b"\n"
+                continue
+            if remaining > 0:
+                # Hunk body, which may look like a header ("+++ ...") too
+                last_sign = line[:1]
+                if last_sign == b"+":
+                    added.append(line[1:])
+                remaining -= 1
+                continue
+            if line[:1] == b"\0":
+                if commit is not None:
+                    yield commit + (hunks,)
+                commit_id, time, subject = (
+                    line[1:].decode("utf-8", "replace").split(" ", 2) + [""]
+                )[:3]
+                commit = (commit_id, int(time), subject)
+                hunks = {}
+            elif line.startswith(b"--- "):
+                old_path = line[4:].decode("utf-8")
+            elif line.startswith(b"+++ "):
+                path = line[4:].decode("utf-8")
+                if path == "/dev/null":
+                    path = old_path
+                hunks[path[2:]] = file_hunks = []
+            elif line.startswith(b"@@ "):
+                match = HUNK_HEADER.match(line.decode("utf-8", "replace"))
+                old_start, old_count, new_start, new_count = (
+                    int(group) if group is not None else 1
+                    for group in match.groups()
+                )
+                added = []
+                file_hunks.append((old_start, old_count, new_start, added))
+                remaining = old_count + new_count
+        if commit is not None:
+            yield commit + (hunks,)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args)
+
+
+def read_files(base):
+    """Reads the dataset files as they were in base, if it isn't None."""
+
+    contents = {filename: b"" for filename in SCHEMAS}
+    if base is None:
+        return contents
+    with CatFile() as cat_file:
+        for filename in SCHEMAS:
+            blob = cat_file.read(base + ":" + filename)
+            if blob is not None:
+                contents[filename] = blob[2]
+    return contents
+
+
+def same_line(line):
+    """
+    Returns line without the newline split_lines leaves on a last line
+    that had none, so that adding one doesn't make it a different row.
+    """
+
+    return line[:-1] if line[-1:] == b"\n" else line
+
+
+def hunk_span(start, count):
+    """
+    Returns where the count lines a hunk says start at line start are, as
+    a slice of the lines counting from 0. When count is 0, start is the
+    line they come after instead.
+    """
+
+    first = start - 1 if count else start
+    return first, first + count
+
+
+class DatasetState:
+    """
+    The dataset files as of some commit: their lines, how many rows have
+    each key, and the number of violations of each rule in them. The rules
+    a row breaks and its keys are found once per distinct row, and remembered
+    for every later commit. References whose test was removed from
+    pr-data.csv during the scan count as removed-reference, and all other
+    references to tests that aren't in it as dangling-reference.
+    """
+
+    def __init__(self, contents):
+        self.lines = {}
+        self.rows = {filename: {} for filename in SCHEMAS}
+        self.unique = Counter()
+        self.references = {filename: Counter() for filename in SCHEMAS}
+        # Dangling references, by file and key, left by removing their test
+        self.removed = Counter()
+        self.totals = Counter()
+        for filename, data in contents.items():
+            lines = split_lines(data)
+            self.lines[filename] = lines
+            self.totals.update(self.header_rules(filename))
+            for line in lines[1:]:
+                rules, unique, reference = self.row(filename, line)
+                self.totals.update(rules)
+                self.count_keys(filename, unique, reference, 1)
+        lines = self.lines[PR_FILE]
+        self.totals["sort-order"] = sum(
+            1 for j in range(2, len(lines)) if self.unsorted(lines, j)
+        )
+        self.totals["duplicate-test"] = sum(
+            count - 1 for count in self.unique.values() if count > 1
+        )
+        self.totals["dangling-reference"] = (
+            sum(
+                self.dangling(filename, key)
+                for filename in REFERRING_FILES
+                for key in self.references[filename]
+            )
+            - sum(self.removed.values())
+        )
+        self.totals["removed-reference"] = sum(self.removed.values())
+        self.totals += Counter()
+
+    def row(self, filename, line):
+        """
+        Returns the rules a row breaks and its unique and reference keys
+        (None if it is malformed), checking it only the first time.
+        """
+
+        rows = self.rows[filename]
+        row = rows.get(line)
+        if row is None:
+            data_dict, validate = SCHEMAS[filename]
+            fields = parse_line(line)
+            log = Diagnostics()
+            check_fields(filename, data_dict, log, validate, 2, fields)
+            rules = tuple(record.rule for record in log.records)
+            if len(fields) <= max(UNIQUE_KEY):
+                row = (rules, None, None)
+            elif filename == PR_FILE:
+                row = (
+                    rules,
+                    key_hash(fields, UNIQUE_KEY),
+                    key_hash(fields, REFERENCE_KEY),
+                )
+            else:
+                row = (rules, None, key_hash(fields, REFERENCE_KEY))
+            rows[line] = row
+        return row
+
+    def header_rules(self, filename):
+        """Returns the rules the header of filename breaks."""
+
+        lines = self.lines[filename]
+        if not lines:
+            return ()
+        data_dict, validate = SCHEMAS[filename]
+        log = Diagnostics()
+        fields = parse_line(lines[0])
+        check_fields(filename, data_dict, log, validate, 1, fields)
+        return tuple(record.rule for record in log.records)
+
+    def count_keys(self, filename, unique, reference, sign):
+        """Adds (or subtracts) the keys of a row to the counts."""
+
+        if unique is not None:
+            self.unique[unique] += sign
+        if reference is not None:
+            self.references[filename][reference] += sign
+
+    def dangling(self, filename, key):
+        """Counts the rows of filename with a key not in pr-data.csv."""
+
+        if self.references[PR_FILE][key] > 0:
+            return 0
+        return self.references[filename][key]
+
+    @staticmethod
+    def unsorted(lines, j):
+        """Tells whether line j should come before line j - 1."""
+
+        return sort_key(lines[j]) < sort_key(lines[j - 1])
+
+    def unsorted_pairs(self, spans):
+        """
+        Returns the unsorted pairs of consecutive rows of pr-data.csv that
+        end in one of the spans of lines or right after it, with the line
+        each one ends at.
+        """
+
+        lines = self.lines[PR_FILE]
+        ends = set()
+        for first, end in spans:
+            ends.update(range(max(first, 2), min(end + 1, len(lines))))
+        return [
+            ((lines[j - 1], same_line(lines[j])), j)
+            for j in sorted(ends)
+            if self.unsorted(lines, j)
+        ]
+
+    def apply(self, hunks):
+        """
+        Applies the hunks of a commit to the files, returning the
+        diagnostics of the violations it introduced, with rows numbered as
+        in that commit, how many of each rule it introduced, and how many
+        of each rule it fixed.
+        """
+
+        log = Diagnostics()
+        introduced = Counter()
+        fixed = Counter()
+        removed = {}
+        added = {}
+        old_spans = {}
+        new_spans = {}
+        for filename, file_hunks in hunks.items():
+            lines = self.lines[filename]
+            old_spans[filename] = [
+                hunk_span(old_start, old_count)
+                for old_start, old_count, _, _ in file_hunks
+            ]
+            new_spans[filename] = [
+                hunk_span(new_start, len(new_lines))
+                for _, _, new_start, new_lines in file_hunks
+            ]
+            removed[filename] = [
+                line
+                for first, end in old_spans[filename]
+                for line in lines[max(first, 1) : end]
+            ]
+            added[filename] = [
+                (j + 1, line)
+                for (first, _), (_, _, _, new_lines) in zip(
+                    new_spans[filename], file_hunks
+                )
+                for j, line in enumerate(new_lines, first)
+                if j > 0
+            ]
+
+        keys = self.touched_keys(removed, added)
+        before = self.count_violations(*keys[:2])
+        old_pairs = Counter()
+        if PR_FILE in hunks:
+            old_pairs.update(
+                pair for pair, _ in self.unsorted_pairs(old_spans[PR_FILE])
+            )
+        old_headers = {
+            filename: Counter(self.header_rules(filename))
+            for filename in hunks
+        }
+        for filename, file_hunks in hunks.items():
+            for line in removed[filename]:
+                self.count_keys(filename, *self.row(filename, line)[1:], -1)
+            for _, line in added[filename]:
+                self.count_keys(filename, *self.row(filename, line)[1:], 1)
+            # Later hunks first, so that the earlier ones don't move them
+            lines = self.lines[filename]
+            for (first, end), (_, _, _, new_lines) in zip(
+                reversed(old_spans[filename]), reversed(file_hunks)
+            ):
+                lines[first:end] = new_lines
+
+        for filename in hunks:
+            self.diff_header(
+                filename, old_headers[filename], log, introduced, fixed
+            )
+            self.diff_rows(filename, removed, added, log, introduced, fixed)
+        if PR_FILE in hunks:
+            for pair, j in self.unsorted_pairs(new_spans[PR_FILE]):
+                if old_pairs[pair] > 0:
+                    old_pairs[pair] -= 1
+                else:
+                    log_unsorted(PR_FILE, log, j + 1)
+                    introduced["sort-order"] += 1
+            fixed["sort-order"] += sum(old_pairs.values())
+        after = self.count_violations(*keys[:2])
+        self.diff_integrity(before, after, *keys[2:], log, introduced, fixed)
+
+        self.totals.update(introduced)
+        self.totals.subtract(fixed)
+        self.totals += Counter()
+        return log, +introduced, +fixed
+
+    def diff_header(self, filename, before, log, introduced, fixed):
+        """
+        Compares the rules the header of filename breaks with those it
+        broke before, logging it if it breaks new ones.
+        """
+
+        after = Counter(self.header_rules(filename))
+        if after - before:
+            data_dict, validate = SCHEMAS[filename]
+            check_fields(
+                filename,
+                data_dict,
+                log,
+                validate,
+                1,
+                parse_line(self.lines[filename][0]),
+            )
+        introduced.update(after - before)
+        fixed.update(before - after)
+
+    def diff_rows(self, filename, removed, added, log, introduced, fixed):
+        """
+        Compares the rows of filename a commit removed with those it added,
+        logging the ones that weren't there before if they break any rule,
+        and counting the rules broken by the ones that are gone.
+        """
+
+        data_dict, validate = SCHEMAS[filename]
+        gone = Counter(map(same_line, removed[filename]))
+        for i, line in added[filename]:
+            if gone[same_line(line)] > 0:
+                # Moved or left as it was
+                gone[same_line(line)] -= 1
+                continue
+            rules = self.row(filename, line)[0]
+            if rules:
+                check_fields(
+                    filename, data_dict, log, validate, i, parse_line(line)
+                )
+                introduced.update(rules)
+        for line, count in gone.items():
+            for rule in self.row(filename, line)[0]:
+                fixed[rule] += count
+
+    def touched_keys(self, removed, added):
+        """
+        Finds the unique keys of the rows of pr-data.csv and the reference
+        keys of the rows of every file that a commit removed or added, which
+        are the only ones whose violations it can change. Also returns the
+        number and contents of the last added row with each key, and the
+        removed row of pr-data.csv with each reference key.
+        """
+
+        unique_keys = set()
+        reference_keys = set()
+        added_rows = {}
+        removed_tests = {}
+        for filename, lines in removed.items():
+            for line in lines:
+                _, unique, reference = self.row(filename, line)
+                if unique is not None:
+                    unique_keys.add(unique)
+                if reference is not None:
+                    reference_keys.add(reference)
+                    if filename == PR_FILE:
+                        removed_tests[reference] = line
+        for filename, rows in added.items():
+            for i, line in rows:
+                _, unique, reference = self.row(filename, line)
+                if unique is not None:
+                    unique_keys.add(unique)
+                    added_rows[PR_FILE, unique] = (i, line)
+                if reference is not None:
+                    reference_keys.add(reference)
+                    added_rows[filename, reference] = (i, line)
+        return unique_keys, reference_keys, added_rows, removed_tests
+
+    def count_violations(self, unique_keys, reference_keys):
+        """
+        Counts the duplicates of each of the unique keys, and the rows of
+        each referring file with each of the reference keys that aren't in
+        pr-data.csv.
+        """
+
+        duplicates = {
+            key: max(self.unique[key] - 1, 0) for key in unique_keys
+        }
+        dangling = {
+            (filename, key): self.dangling(filename, key)
+            for filename in REFERRING_FILES
+            for key in reference_keys
+        }
+        return duplicates, dangling
+
+    def diff_integrity(
+        self, before, after, added_rows, removed_tests, log, introduced, fixed
+    ):
+        """
+        Compares the duplicated and dangling keys before and after a commit.
+        New duplicates and dangling references are logged at the row that
+        was added, or as a removed test if it was pr-data.csv that changed,
+        in which case they are remembered as removed references.
+        """
+
+        for key, count in after[0].items():
+            difference = count - before[0][key]
+            if difference > 0:
+                i, line = added_rows[PR_FILE, key]
+                log_duplicate(log, i, parse_line(line))
+                introduced["duplicate-test"] += difference
+            elif difference < 0:
+                fixed["duplicate-test"] -= difference
+        for (filename, key), count in after[1].items():
+            difference = count - before[1][filename, key]
+            if difference > 0:
+                if before[1][filename, key] == 0 and key in removed_tests:
+                    fields = parse_line(removed_tests[key])
+                    log_removed(filename, log, fields)
+                    self.removed[filename, key] += difference
+                    introduced["removed-reference"] += difference
+                else:
+                    i, line = added_rows[filename, key]
+                    log_dangling(filename, log, i, parse_line(line))
+                    introduced["dangling-reference"] += difference
+            elif difference < 0:
+                # The references left by removing the test are the last
+                # ones to be fixed
+                left = min(self.removed[filename, key], count)
+                removed = self.removed[filename, key] - left
+                fixed["removed-reference"] += removed
+                fixed["dangling-reference"] -= difference + removed
+                self.removed[filename, key] = left
+        self.removed += Counter()
+
+
+def scan_segment(base, tip):
+    """
+    Scans the commits after base up to tip, returning the number of
+    violations of each rule in base and the report of each commit.
+    """
+
+    state = DatasetState(read_files(base))
+    totals = Counter(state.totals)
+    reports = []
+    for commit, time, subject, hunks in read_commits(base, tip):
+        log, counts, fixed = state.apply(hunks)
+        reports.append(
+            CommitReport(
+                commit,
+                time,
+                subject,
+                log.records,
+                counts,
+                fixed,
+                Counter(state.totals),
+            )
+        )
+    return totals, reports
+
+
+def scan_history(commit_range, jobs=None):
+    """
+    Scans the commits of commit_range (see get_history_range) that changed
+    the dataset files, returning the commit the scan started from, the
+    number of violations of each rule in it and the report of each commit.
+    Long ranges are split into segments scanned by a process per CPU (or
+    per job), each starting from the files as of the commit before it.
+    """
+
+    base, tip = get_history_range(commit_range)
+    commits = list_commits(base, tip)
+    jobs = jobs or os.cpu_count() or 1
+    count = max(1, min(jobs, len(commits) // MIN_SEGMENT))
+    if count == 1:
+        return (base,) + scan_segment(base, tip)
+    bounds = [len(commits) * k // count for k in range(count + 1)]
+    bases = [base] + [commits[start - 1] for start in bounds[1:-1]]
+    tips = [commits[end - 1] for end in bounds[1:]]
+    with ProcessPoolExecutor(count) as executor:
+        segments = list(executor.map(scan_segment, bases, tips))
+    reports = [report for _, segment in segments for report in segment]
+    return base, segments[0][0], reports
+
+
+def describe_counts(counts):
+    """Lists the number of violations of each rule, for the timeline."""
+
+    if not counts:
+        return "none"
+    return ", ".join(
+        rule + " " + str(count) for rule, count in sorted(counts.items())
+    )
+
+
+def format_timeline(base, totals, reports, output_format):
+    """
+    Formats the violations in base and those each commit introduced and
+    fixed as plain text, one commit per line followed by the new
+    violations, or as JSON Lines, one object for base and one per commit.
+    """
+
+    if output_format == "json":
+        lines = [json.dumps({"base": base, "totals": dict(totals)})]
+        for report in reports:
+            lines.append(
+                json.dumps(
+                    {
+                        "commit": report.commit,
+                        "time": datetime.fromtimestamp(
+                            report.time, timezone.utc
+                        ).isoformat(),
+                        "subject": report.subject,
+                        "introduced": [
+                            record.to_dict() for record in report.introduced
+                        ],
+                        "fixed": dict(report.fixed),
+                        "totals": dict(report.totals),
+                    }
+                )
+            )
+        return "".join(line + "\n" for line in lines)
+
+    lines = [
+        "%s: %d violation(s) (%s)"
+        % (
+            "Base " + base if base is not None else "Empty base",
+            sum(totals.values()),
+            describe_counts(totals),
+        )
+    ]
+    for report in reports:
+        date = datetime.fromtimestamp(report.time, timezone.utc)
+        lines.append(
+            "%s %s %s: introduced %s; fixed %s; %d violation(s) left"
+            % (
+                report.commit[:12],
+                date.strftime("%Y-%m-%d"),
+                report.subject,
+                describe_counts(report.counts),
+                describe_counts(report.fixed),
+                sum(report.totals.values()),
+            )
+        )
+        for record in report.introduced:
+            lines.extend("    " + line for line in record.text().split("\n"))
+    return "".join(line + "\n" for line in lines)
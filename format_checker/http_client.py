@@ -0,0 +1,125 @@
+"""
+Implements a minimal asynchronous HTTP/1.1 client on asyncio streams, with
+keep-alive connections pooled per host.
+"""
+
+import ssl
+import asyncio
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+
+Response = namedtuple("Response", ["status", "headers", "body"])
+
+
+async def read_body(reader, headers):
+    """
+    Reads the body of a response, as long as its headers say, returning it
+    and whether the connection can be used again.
+    """
+
+    if "chunked" in headers.get("transfer-encoding", ""):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Trailers, up to an empty line
+                while (await reader.readline()).strip():
+                    pass
+                return b"".join(chunks), True
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    if "content-length" in headers:
+        length = int(headers["content-length"])
+        return await reader.readexactly(length), True
+    return await reader.read(), False
+
+
+async def exchange(reader, writer, request, method):
+    """
+    Sends an HTTP/1.1 request and reads the response to it, which has no
+    body if method is HEAD.
+    """
+
+    writer.write(request)
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("the connection was closed")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+        body, reusable = b"", True
+    else:
+        body, reusable = await read_body(reader, headers)
+    if headers.get("connection", "").lower() == "close":
+        reusable = False
+    return Response(status, headers, body), reusable
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to the host of a URL, opened when every one of
+    them is busy, up to size at once, and reused by later requests.
+    """
+
+    def __init__(self, url, size):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = None
+        if parts.scheme == "https":
+            self.ssl = ssl.create_default_context()
+        self.prefix = parts.path.rstrip("/")
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)
+
+    async def request(self, path, headers, method="GET"):
+        """Sends a request for path, returning its Response."""
+
+        lines = [
+            method + " " + self.prefix + path + " HTTP/1.1",
+            "Host: " + self.host,
+        ]
+        lines += [name + ": " + value for name, value in headers.items()]
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        async with self.slots:
+            while True:
+                reused = bool(self.idle)
+                if reused:
+                    reader, writer = self.idle.pop()
+                else:
+                    reader, writer = await asyncio.open_connection(
+                        self.host, self.port, ssl=self.ssl
+                    )
+                try:
+                    response, reusable = await exchange(
+                        reader, writer, request, method
+                    )
+                except (OSError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused:
+                        # The server closed it while it was idle
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if reusable:
+                    self.idle.append((reader, writer))
+                else:
+                    writer.close()
+                return response
+
+    def close(self):
+        """Closes the idle connections."""
+
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
@@ -0,0 +1,315 @@
+"""
+Implements hash indexes of the tests referred to by the rows of the dataset
+files, used to check that every test is listed once in pr-data.csv and that
+the rows of tic-fic-data.csv and tso-iso-rates.csv refer to tests in it.
+"""
+
+import os
+import re
+import csv
+import mmap
+import hashlib
+import subprocess
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from functools import lru_cache
+from utils import get_cache_dir, git, log_esp_error, prune_cache_files
+from line_index import open_dataset, read_lines
+
+
+PR_FILE = "pr-data.csv"
+REFERRING_FILES = ["tic-fic-data.csv", "tso-iso-rates.csv"]
+
+# Positions of Project URL, SHA Detected, Module Path and Fully-Qualified
+# Test Name, which identify a row of pr-data.csv
+UNIQUE_KEY = (0, 1, 2, 3)
+
+# Names of the persisted keys of git blobs
+BLOB_KEYS = re.compile(r"keys-[0-9a-f]{40,64}-\d+\.bin")
+
+# Positions of the columns a test is referred to by from the other files,
+# which may have detected it at a different SHA
+REFERENCE_KEY = (0, 2, 3)
+
+
+def key_hash(fields, positions):
+    """Hashes the key made of the fields at positions into an integer."""
+
+    return int.from_bytes(
+        hashlib.blake2b(
+            "\0".join(fields[p] for p in positions).encode("utf-8"),
+            digest_size=8,
+        ).digest(),
+        "little",
+    )
+
+
+def describe(fields):
+    """Describes the test a row refers to, for error messages."""
+
+    return fields[3] + " (" + fields[0] + ", module " + fields[2] + ")"
+
+
+def count_keys(rows, positions):
+    """Counts the hashed keys of the rows, skipping the malformed ones."""
+
+    return Counter(
+        key_hash(fields, positions)
+        for fields in rows
+        if len(fields) > max(positions)
+    )
+
+
+class KeyCounts:
+    """
+    Counts how many rows of a file have each key. The counts of the base
+    version of the file come from a sorted array of hashes, which is
+    searched without being loaded, and the changes since then are applied
+    on top of them, so that looking up a key costs O(log n).
+    """
+
+    def __init__(self, base_keys, delta=None):
+        self.base_keys = base_keys
+        self.delta = delta if delta is not None else Counter()
+
+    def __getitem__(self, key):
+        return (
+            bisect_right(self.base_keys, key)
+            - bisect_left(self.base_keys, key)
+            + self.delta[key]
+        )
+
+
+@lru_cache(maxsize=None)
+def get_blob_ids(base):
+    """Maps each dataset file to the id of its blob in base, if any."""
+
+    listing = git("ls-tree", base, "--", PR_FILE, *REFERRING_FILES)
+    blobs = {}
+    for entry in listing.splitlines():
+        info, path = entry.split("\t", 1)
+        blobs[path] = info.split()[2]
+    return blobs
+
+
+def get_keys_path(blob, positions):
+    """Returns the path where the keys of a blob are persisted."""
+
+    return os.path.join(
+        get_cache_dir(),
+        "keys-" + blob + "-" + "".join(map(str, positions)) + ".bin",
+    )
+
+
+def build_blob_keys(blob, positions):
+    """Streams a blob through the csv module, hashing the key of each row."""
+
+    with subprocess.Popen(
+        ("git", "cat-file", "blob", blob), stdout=subprocess.PIPE
+    ) as process:
+        lines = (line.decode("utf-8") for line in process.stdout)
+        rows = csv.reader(lines)
+        next(rows, None)
+        keys = array(
+            "Q",
+            sorted(
+                key_hash(fields, positions)
+                for fields in rows
+                if len(fields) > max(positions)
+            ),
+        )
+    return keys
+
+
+def load_blob_keys(blob, positions):
+    """
+    Returns the sorted key hashes of a blob. Blobs never change, so they
+    are hashed once and then persisted, and mapped into memory on reuse.
+    Only the keys of the MAX_BLOB_FILES most recently used blobs are kept.
+    """
+
+    path = get_keys_path(blob, positions)
+    try:
+        with open(path, "rb") as keys_file:
+            keys = mmap.mmap(keys_file.fileno(), 0, access=mmap.ACCESS_READ)
+        os.utime(path)
+        return memoryview(keys).cast("Q")
+    except (OSError, ValueError):
+        pass
+    keys = build_blob_keys(blob, positions)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as keys_file:
+            keys_file.write(keys.tobytes())
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+    prune_cache_files(BLOB_KEYS)
+    return keys
+
+
+def get_key_counts(filename, change, positions):
+    """
+    Counts the keys of the current version of filename, given its changes
+    since their base: the keys of the base blob, minus those of the removed
+    lines, plus those of the changed ones.
+    """
+
+    blob = get_blob_ids(change["base"]).get(filename)
+    base_keys = array("Q") if blob is None else load_blob_keys(blob, positions)
+    delta = count_keys(
+        (fields for _, fields in read_changed(filename, change)), positions
+    )
+    delta.subtract(
+        count_keys(
+            (
+                next(csv.reader([text]), [])
+                for line, text in change["removed"]
+                if line > 1
+            ),
+            positions,
+        )
+    )
+    return KeyCounts(base_keys, delta)
+
+
+def check_changed_integrity(log, changes):
+    """
+    Checks that the changed rows of pr-data.csv are unique, that the
+    changed rows of the other files refer to tests in pr-data.csv, and that
+    no test that is still referred to was removed from pr-data.csv.
+    """
+
+    pr_change = changes[PR_FILE]
+    unique_counts = get_key_counts(PR_FILE, pr_change, UNIQUE_KEY)
+    pr_counts = get_key_counts(PR_FILE, pr_change, REFERENCE_KEY)
+    for i, fields in read_changed(PR_FILE, pr_change):
+        if unique_counts[key_hash(fields, UNIQUE_KEY)] > 1:
+            log_duplicate(log, i, fields)
+
+    for filename in REFERRING_FILES:
+        for i, fields in read_changed(filename, changes[filename]):
+            if pr_counts[key_hash(fields, REFERENCE_KEY)] <= 0:
+                log_dangling(filename, log, i, fields)
+
+    removed = {}
+    for line, text in pr_change["removed"]:
+        fields = next(csv.reader([text]), [])
+        if line > 1 and len(fields) > max(REFERENCE_KEY):
+            key = key_hash(fields, REFERENCE_KEY)
+            if pr_counts[key] <= 0:
+                removed[key] = fields
+    if not removed:
+        return
+    for filename in REFERRING_FILES:
+        counts = get_key_counts(filename, changes[filename], REFERENCE_KEY)
+        for key, fields in removed.items():
+            if counts[key] > 0:
+                log_removed(filename, log, fields)
+
+
+def read_changed(filename, change):
+    """Yields the number and fields of the well-formed changed rows."""
+
+    if not change["changed"]:
+        return
+    data, index = open_dataset(filename)
+    for i, fields in read_lines(data, index, change["changed"]):
+        if i > 1 and len(fields) > max(UNIQUE_KEY):
+            yield i, fields
+
+
+def read_all(filename):
+    """Yields the number and fields of every well-formed row of filename."""
+
+    data, index = open_dataset(filename)
+    for i, fields in read_lines(data, index, [(2, len(index))]):
+        if len(fields) > max(UNIQUE_KEY):
+            yield i, fields
+
+
+def check_all_integrity(log):
+    """
+    Checks that every row of pr-data.csv is unique and that every row of
+    the other files refers to a test in pr-data.csv, in one pass per file.
+    """
+
+    first_rows = {}
+    references = set()
+    for i, fields in read_all(PR_FILE):
+        key = key_hash(fields, UNIQUE_KEY)
+        if key in first_rows:
+            log_duplicate(log, i, fields)
+        else:
+            first_rows[key] = i
+        references.add(key_hash(fields, REFERENCE_KEY))
+    for filename in REFERRING_FILES:
+        for i, fields in read_all(filename):
+            if key_hash(fields, REFERENCE_KEY) not in references:
+                log_dangling(filename, log, i, fields)
+
+
+def log_duplicate(log, i, fields):
+    """Logs that row i of pr-data.csv lists a test more than once."""
+
+    log_esp_error(
+        PR_FILE,
+        log,
+        "On row "
+        + str(i)
+        + ", the test "
+        + describe(fields)
+        + " detected at "
+        + fields[1]
+        + " is listed more than once",
+        "duplicate-test",
+        i,
+    )
+
+
+def log_dangling(filename, log, i, fields):
+    """Logs that row i of filename refers to a test not in pr-data.csv."""
+
+    log_esp_error(
+        filename,
+        log,
+        "On row "
+        + str(i)
+        + ", the test "
+        + describe(fields)
+        + " is not in "
+        + PR_FILE,
+        "dangling-reference",
+        i,
+    )
+
+
+def log_removed(filename, log, fields):
+    """Logs that a test removed from pr-data.csv is still in filename."""
+
+    log_esp_error(
+        PR_FILE,
+        log,
+        "The test "
+        + describe(fields)
+        + " was removed, but "
+        + filename
+        + " still refers to it",
+        "removed-reference",
+    )
+
+
+def run_checks_integrity(log, changes):
+    """
+    Checks the uniqueness of the tests in pr-data.csv and that the other
+    dataset files refer to them.
+    """
+
+    if all(change is None for change in changes.values()):
+        check_all_integrity(log)
+    elif any(
+        changes[filename]["changed"] or changes[filename]["removed"]
+        for filename in [PR_FILE] + REFERRING_FILES
+    ):
+        check_changed_integrity(log, changes)
@@ -0,0 +1,211 @@
+"""
+Implements a line-offset index of the dataset files, so that changed rows can
+be read and parsed without going through the rest of the file.
+"""
+
+import os
+import re
+import csv
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from utils import get_cache_dir, prune_cache_files
+
+
+NEWLINE = re.compile(b"\n")
+
+# Size and modification time of the indexed file, stored before the offsets
+INDEX_HEADER = struct.Struct("<qq")
+
+# Names of the persisted indexes of git blobs
+BLOB_INDEX = re.compile(r"index-[0-9a-f]{40,64}\.bin")
+
+
+def merge_ranges(ranges):
+    """
+    Normalizes an iterable of (first, last) line ranges into a sorted list
+    of disjoint, non-adjacent ranges.
+    """
+
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def split_lines(data):
+    """
+    Splits data into its lines as git sees them, without their newline.
+    The last line keeps a newline if it had none, to tell both apart.
+    """
+
+    lines = data.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    else:
+        lines[-1] += b"\n"
+    return lines
+
+
+def in_ranges(ranges, line):
+    """Checks whether line is contained in the sorted list of ranges."""
+
+    i = bisect_left(ranges, (line + 1,)) - 1
+    return i >= 0 and ranges[i][1] >= line
+
+
+def build_line_index(data):
+    """
+    Computes the offset at which each line of data starts. The offset of
+    line i (counting from 1) is stored at position i - 1.
+    """
+
+    index = array("q", [0])
+    index.extend(match.end() for match in NEWLINE.finditer(data))
+    if len(index) > 1 and index[-1] == len(data):
+        index.pop()
+    elif len(data) == 0:
+        index.pop()
+    return index
+
+
+def get_index_path(filename):
+    """Returns the path where the index of filename is persisted."""
+
+    return os.path.join(
+        get_cache_dir(), "index-" + os.path.basename(filename) + ".bin"
+    )
+
+
+def load_line_index(filename, stat):
+    """
+    Maps the persisted index of filename into memory, if it is still up to
+    date, so that only the offsets that are looked up are ever read.
+    """
+
+    try:
+        with open(get_index_path(filename), "rb") as index_file:
+            index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if index[: INDEX_HEADER.size] != INDEX_HEADER.pack(
+        stat.st_size, stat.st_mtime_ns
+    ):
+        return None
+    return memoryview(index)[INDEX_HEADER.size :].cast("q")
+
+
+def save_line_index(filename, stat, index):
+    """Persists the index of filename, ignoring unwritable cache dirs."""
+
+    path = get_index_path(filename)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as index_file:
+            index_file.write(INDEX_HEADER.pack(stat.st_size, stat.st_mtime_ns))
+            index_file.write(index.tobytes())
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+
+def get_line_index(filename, data):
+    """
+    Returns the line index of filename, whose contents are data. The index
+    is built once and reused across runs for as long as the file is
+    unchanged.
+    """
+
+    stat = os.stat(filename)
+    index = load_line_index(filename, stat)
+    if index is None:
+        index = build_line_index(data)
+        save_line_index(filename, stat, index)
+    return index
+
+
+def get_blob_line_index(blob, data):
+    """
+    Returns the line index of a git blob, whose contents are data. Blobs
+    never change, so their index is persisted under their id, and only the
+    indexes of the MAX_BLOB_FILES most recently used blobs are kept.
+    """
+
+    path = os.path.join(get_cache_dir(), "index-" + blob + ".bin")
+    try:
+        with open(path, "rb") as index_file:
+            index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        os.utime(path)
+        return memoryview(index).cast("q")
+    except (OSError, ValueError):
+        pass
+    index = build_line_index(data)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as index_file:
+            index_file.write(index.tobytes())
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+    prune_cache_files(BLOB_INDEX)
+    return index
+
+
+def get_line(data, index, i):
+    """Returns the raw bytes of line i (counting from 1) of data."""
+
+    end = index[i] if i < len(index) else len(data)
+    return data[index[i - 1] : end]
+
+
+def read_raw_lines(data, index, ranges):
+    """
+    Yields the number and the raw bytes of every line of data that is
+    contained in ranges, seeking straight to each of them.
+    """
+
+    for first, last in ranges:
+        for i in range(max(first, 1), min(last, len(index)) + 1):
+            yield i, get_line(data, index, i)
+
+
+def parse_line(line):
+    """Parses the raw bytes of a line into its fields."""
+
+    return next(csv.reader([line.decode("utf-8")]), [])
+
+
+def read_lines(data, index, ranges):
+    """
+    Yields the number and the parsed fields of every line of data that is
+    contained in ranges, seeking straight to each of them.
+    """
+
+    for i, line in read_raw_lines(data, index, ranges):
+        yield i, parse_line(line)
+
+
+def open_dataset(filename):
+    """
+    Maps filename into memory, returning its contents and line index. Empty
+    files are returned as empty bytes. If open_dataset.staged maps filename
+    to the id and contents of a blob, those are returned instead, so that
+    what is about to be committed is checked rather than the working tree.
+    """
+
+    staged = getattr(open_dataset, "staged", None)
+    if staged is not None and filename in staged:
+        blob, data = staged[filename]
+        if not data:
+            return b"", array("q")
+        return data, get_blob_line_index(blob, data)
+    with open(filename, "rb") as dataset:
+        if os.fstat(dataset.fileno()).st_size == 0:
+            return b"", array("q")
+        data = mmap.mmap(dataset.fileno(), 0, access=mmap.ACCESS_READ)
+    return data, get_line_index(filename, data)
@@ -0,0 +1,199 @@
+"""
+Implements the optional online rule, which checks that the Project URL, PR
+Link and Notes of the rows of pr-data.csv lead to pages that exist. Links
+are probed concurrently in a background thread, while the offline checks
+run, and what was found is cached on disk for LINK_TTL seconds, so that
+repeated runs only probe new links.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+from common_checks import common_data
+from http_client import ConnectionPool
+from key_index import PR_FILE
+from line_index import open_dataset, read_lines
+from pr_checker import NOTES, PR_LINK, PROJECT_URL, pr_data
+from utils import (
+    checked_ranges,
+    get_cache_dir,
+    load_cache,
+    log_info,
+    log_warning,
+    save_cache,
+)
+
+
+# Columns holding links, by position, with the pattern of their links:
+# those that don't match it are already reported by the offline checks
+LINK_COLUMNS = {
+    PROJECT_URL: ("Project URL", common_data["Project URL"]),
+    PR_LINK: ("PR Link", pr_data["PR Link"]),
+    NOTES: ("Notes", pr_data["Notes"]),
+}
+
+# Seconds for which what was found about a link is trusted
+LINK_TTL = 7 * 24 * 3600
+
+# Links probed at once, and connections kept to each host
+CONCURRENCY = 16
+HOST_CONNECTIONS = 4
+
+# Seconds a probe may take
+TIMEOUT = 10.0
+
+# Seconds the probes may still take once the offline checks are done,
+# after which the links that weren't probed are left for the next run
+DEADLINE = 30.0
+
+# Statuses of links that don't exist; any other error is inconclusive
+DEAD = (404, 410)
+
+HEADERS = {"User-Agent": "idoft-format-checker", "Accept": "*/*"}
+
+
+def get_links_path():
+    """Returns the path of the cache of the links that were probed."""
+
+    return os.path.join(get_cache_dir(), "links.json")
+
+
+def collect_links(change):
+    """
+    Maps every valid link in the rows of pr-data.csv to be checked (every
+    row if change is None) to the rows and columns it is in.
+    """
+
+    data, index = open_dataset(PR_FILE)
+    ranges = [(2, len(index))] if change is None else checked_ranges(change)
+    links = {}
+    for i, fields in read_lines(data, index, ranges):
+        if i == 1:
+            continue
+        for position, (column, pattern) in LINK_COLUMNS.items():
+            if position < len(fields) and pattern.fullmatch(fields[position]):
+                links.setdefault(fields[position], []).append((i, column))
+    return links
+
+
+async def probe(pools, link):
+    """
+    Requests the head of a link (or all of it, if the server doesn't
+    answer HEAD requests), returning its status, or None if there was no
+    answer.
+    """
+
+    parts = urlsplit(link)
+    origin = probe_links.origin or parts.scheme + "://" + parts.netloc
+    if origin not in pools:
+        pools[origin] = ConnectionPool(origin, HOST_CONNECTIONS)
+    path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+    try:
+        for method in ("HEAD", "GET"):
+            response = await asyncio.wait_for(
+                pools[origin].request(path, HEADERS, method), TIMEOUT
+            )
+            if response.status not in (405, 501):
+                return response.status
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return None
+    return response.status
+
+
+async def probe_links(links, results):
+    """
+    Probes every link, at most CONCURRENCY at once, storing the status of
+    each one in results as soon as it is known.
+    """
+
+    pools = {}
+    slots = asyncio.Semaphore(CONCURRENCY)
+
+    async def probe_one(link):
+        async with slots:
+            results[link] = await probe(pools, link)
+
+    try:
+        await asyncio.gather(*(probe_one(link) for link in links))
+    finally:
+        for pool in pools.values():
+            pool.close()
+
+
+# Server every probe is sent to instead of the host of its link, if set,
+# e.g. a local stub server when testing
+probe_links.origin = None
+
+
+class LinkCheck:
+    """
+    Probes the links of the rows to be checked in a background thread,
+    which is started when the check is created, skipping those that are
+    in the cache and haven't expired.
+    """
+
+    def __init__(self, change):
+        self.links = collect_links(change)
+        self.cache_path = get_links_path()
+        self.cache = load_cache(self.cache_path)
+        self.now = time.time()
+        self.pending = [
+            link
+            for link in self.links
+            if link not in self.cache
+            or self.now - self.cache[link]["checked"] > LINK_TTL
+        ]
+        self.results = {}
+        self.thread = threading.Thread(
+            target=asyncio.run,
+            args=(probe_links(self.pending, self.results),),
+            daemon=True,
+        )
+        self.thread.start()
+
+    def report(self, log):
+        """
+        Waits for the probes until the deadline, caches what they found and
+        logs the links that don't exist.
+        """
+
+        self.thread.join(DEADLINE)
+        results = self.results.copy()
+        for link, status in results.items():
+            if status is not None and (status < 400 or status in DEAD):
+                self.cache[link] = {"checked": self.now, "status": status}
+        save_cache(self.cache_path, self.cache)
+
+        dead = []
+        for link, places in self.links.items():
+            entry = self.cache.get(link)
+            if entry is not None and entry["status"] in DEAD:
+                for i, column in places:
+                    dead.append((i, column, link, entry["status"]))
+        for i, column, link, status in sorted(dead):
+            log_warning(
+                PR_FILE,
+                log,
+                i,
+                "The "
+                + column
+                + " "
+                + link
+                + " doesn't exist (HTTP "
+                + str(status)
+                + ")",
+                "dead-link",
+            )
+        unchecked = sum(
+            1
+            for link in self.pending
+            if link not in results or results[link] is None
+        )
+        if unchecked:
+            log_info(
+                PR_FILE,
+                log,
+                str(unchecked) + " link(s) couldn't be checked this time",
+            )
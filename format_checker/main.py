@@ -1,42 +1,306 @@
 """Runs the checkers and handles related errors and warnings."""
 
-import sys
-import logging
-import errorhandler
-from tso_iso_checker import run_checks_tso_iso
-from tic_fic_checker import run_checks_tic_fic
-from pr_checker import run_checks_pr
-from utils import log_std_error, log_esp_error, log_warning
+import time
 
-if __name__ == "__main__":
-    error_handler = errorhandler.ErrorHandler()
-    stream_handler = logging.StreamHandler(stream=sys.stderr)
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    logger.addHandler(stream_handler)
-    log_std_error.tracker = 0
-    log_esp_error.tracker = 0
-    log_warning.tracker = 0
-    commit_range = sys.argv[1:]
-    checks = [run_checks_pr, run_checks_tic_fic, run_checks_tso_iso]
-    for check in checks:
-        check(logger, sys.argv[1:])
-    ERROR_COUNT = str(log_std_error.tracker + log_esp_error.tracker)
-
-    if error_handler.fired:
-        logger.critical(
-            "Failure: Exiting with code 1 due to %s logged %s",
-            ERROR_COUNT,
-            ("error" if ERROR_COUNT == "1" else "errors"),
+# Taken before anything else is imported, to measure the startup time
+START = time.perf_counter()
+
+import sys  # noqa: E402
+import argparse  # noqa: E402
+import importlib.util  # noqa: E402
+from functools import partial  # noqa: E402
+import profiling  # noqa: E402
+from diagnostics import (  # noqa: E402
+    ERROR,
+    FORMATS,
+    WARNING,
+    Diagnostics,
+    write_output,
+)
+from profiling import Profile, timed  # noqa: E402
+from utils import (  # noqa: E402
+    CatFile,
+    get_changed_lines,
+    get_staged_lines,
+    log_info,
+    read_staged,
+)
+
+# Module and function that check each dataset file, which are only imported
+# when the file has changes to be checked
+CHECKERS = {
+    "pr-data.csv": ("pr_checker", "run_checks_pr"),
+    "tic-fic-data.csv": ("tic_fic_checker", "run_checks_tic_fic"),
+    "tso-iso-rates.csv": ("tso_iso_checker", "run_checks_tso_iso"),
+}
+
+# Dataset files checked by the tool
+DATASET_FILES = list(CHECKERS)
+
+
+def parse_args(argv):
+    """Parses the command line arguments of the tool."""
+
+    parser = argparse.ArgumentParser(
+        description="Checks the format of the dataset files."
+    )
+    parser.add_argument(
+        "commit_range",
+        nargs="*",
+        help="commits of the push/PR whose changes are checked",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="check every row of every dataset file, not just changed ones",
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="check whole columns at once with pandas (needs --all)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="check every row again, even if it is known to be valid",
+    )
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="text",
+        help="format in which errors and warnings are written",
+    )
+    parser.add_argument(
+        "--output",
+        help="file errors and warnings are written to, instead of stderr "
+        "for text and stdout for the other formats",
+    )
+    parser.add_argument(
+        "--fix",
+        action="store_true",
+        help="fix trivially fixable values and the order of pr-data.csv in "
+        "place before checking",
+    )
+    parser.add_argument(
+        "--staged",
+        action="store_true",
+        help="check the staged changes, i.e. the commit about to be made, "
+        "as a pre-commit hook",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running, and check the changed rows again whenever a "
+        "dataset file is saved",
+    )
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="replay the commits of the range (base..tip, or base and tip) "
+        "that changed the dataset and list the violations each introduced "
+        "and fixed",
+    )
+    parser.add_argument(
+        "--check-links",
+        action="store_true",
+        help="also check that the links of the checked rows of pr-data.csv "
+        "exist, probing them while the offline checks run",
+    )
+    parser.add_argument(
+        "--mirrors",
+        metavar="DIR",
+        help="also check that the SHAs of the checked rows are commits of "
+        "their project, in the bare mirror clones in DIR (e.g. "
+        "DIR/owner/repository.git)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="write how long change detection, parsing and each rule took "
+        "to stderr",
+    )
+    args = parser.parse_args(argv)
+    if args.columnar and not args.all:
+        parser.error("--columnar can only be used with --all")
+    if args.columnar and importlib.util.find_spec("pandas") is None:
+        parser.error("--columnar requires pandas to be installed")
+    if args.watch and args.all:
+        parser.error("--watch can't be used with --all")
+    if args.staged and (args.all or args.watch or args.commit_range):
+        parser.error("--staged can't be used with --all, --watch or commits")
+    if args.fix and (args.staged or args.watch or args.history):
+        parser.error("--fix can't be used with --staged, --watch or --history")
+    if args.history and (args.all or args.watch or args.staged):
+        parser.error("--history can't be used with --all, --watch or --staged")
+    if args.history and args.format not in ("text", "json"):
+        parser.error("--history can only be written as text or json")
+    if args.history and len(args.commit_range) > 2:
+        parser.error("--history takes at most a base and a tip")
+    if args.check_links and (args.watch or args.history):
+        parser.error("--check-links can't be used with --watch or --history")
+    if args.mirrors and (args.watch or args.history):
+        parser.error("--mirrors can't be used with --watch or --history")
+    return args
+
+
+def summarize(diagnostics):
+    """Describes the outcome of a run, as the last lines of its output."""
+
+    error_count = diagnostics.count(ERROR)
+    if error_count:
+        return (
+            "Failure: Exiting with code 1 due to "
+            + str(error_count)
+            + " logged "
+            + ("error" if error_count == 1 else "errors")
+            + "\n"
         )
-        raise SystemExit(1)
+    summary = ""
+    warning_count = diagnostics.count(WARNING)
+    if warning_count:
+        summary += (
+            str(warning_count)
+            + (" warnings" if warning_count != 1 else " warning")
+            + " generated\n"
+        )
+    return summary + "Success: Exiting with code 0 due to no logged errors\n"
+
+
+def load_check(module, function):
+    """Imports a check, which is only done right before it runs."""
+
+    return getattr(importlib.import_module(module), function)
+
 
-    if log_warning.tracker != 0:
-        logger.info(
-            "%s %s",
-            str(log_warning.tracker),
-            " warnings generated"
-            if log_warning.tracker != 1
-            else " warning generated",
+def is_affected(change):
+    """Tells whether a file has to be checked, given its changes."""
+
+    return change is None or any(
+        change[kind] for kind in ("changed", "deleted", "removed")
+    )
+
+
+def report_watch(args, diagnostics, checked, seconds):
+    """Writes the outcome of a check made by the watch mode."""
+
+    if checked is None:
+        summary = "Checked the changes in %.0f ms" % (seconds * 1000)
+    else:
+        summary = "Checked %d edited rows in %.1f ms" % (
+            checked,
+            seconds * 1000,
         )
-    logger.info("Success: Exiting with code 0 due to no logged errors")
+    summary += ": %d error(s), %d warning(s), watching for changes " % (
+        diagnostics.count(ERROR),
+        diagnostics.count(WARNING),
+    )
+    write_output(
+        diagnostics, args.format, args.output, summary + "(Ctrl+C to stop)\n"
+    )
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.watch:
+        from watch import watch
+
+        watch(args.commit_range, partial(report_watch, args))
+        raise SystemExit(0)
+    if args.profile:
+        profiling.active = Profile()
+        profiling.record("startup", time.perf_counter() - START)
+    if args.history:
+        from history import format_timeline, scan_history
+
+        with timed("history scan") as timer:
+            base, totals, reports = scan_history(args.commit_range)
+            timer.rows = len(reports)
+        timeline = format_timeline(base, totals, reports, args.format)
+        if args.output is not None:
+            with open(args.output, "w", encoding="utf-8") as output:
+                output.write(timeline)
+        else:
+            sys.stdout.write(timeline)
+        if args.profile:
+            sys.stderr.write(profiling.active.report())
+        raise SystemExit(0)
+    diagnostics = Diagnostics()
+    if args.fix:
+        from fix import fix_dataset
+
+        with timed("fix"):
+            fix_dataset(DATASET_FILES, diagnostics)
+    if args.all:
+        changes = {filename: None for filename in DATASET_FILES}
+    elif args.staged:
+        from line_index import open_dataset
+
+        with timed("change detection"), CatFile() as cat_file:
+            changes = get_staged_lines(DATASET_FILES, cat_file)
+            open_dataset.staged = read_staged(DATASET_FILES, cat_file)
+    else:
+        with timed("change detection") as timer:
+            changes = get_changed_lines(DATASET_FILES, args.commit_range)
+            timer.rows = sum(
+                last - first + 1
+                for change in changes.values()
+                for first, last in change["changed"]
+            )
+    if not args.all and any(
+        change["removed"] and change["changed"] for change in changes.values()
+    ):
+        # Rows that only moved are told apart from those that changed
+        from row_diff import apply_row_diffs
+
+        with timed("row diff"):
+            apply_row_diffs(changes, diagnostics)
+    link_check = None
+    if args.check_links:
+        from link_checks import LinkCheck
+
+        link_check = LinkCheck(changes["pr-data.csv"])
+    sha_check = None
+    if args.mirrors:
+        from sha_checks import ShaCheck
+
+        sha_check = ShaCheck(changes, args.mirrors)
+    # Only the checkers of the files that were affected are imported, so
+    # that a push that doesn't touch the dataset is done in milliseconds
+    affected = [
+        filename
+        for filename in DATASET_FILES
+        if is_affected(changes[filename])
+    ]
+    if affected:
+        from common_checks import audit_checks, run_checks
+        from validation_cache import ValidationCache
+
+        audit_checks.columnar = args.columnar
+        run_checks.cache = None if args.no_cache else ValidationCache()
+    for filename in DATASET_FILES:
+        if filename not in affected:
+            log_info(
+                filename, diagnostics, "There are no changes to be checked"
+            )
+            continue
+        module, function = CHECKERS[filename]
+        with timed(function):
+            load_check(module, function)(diagnostics, changes)
+    if affected:
+        with timed("run_checks_integrity"):
+            load_check("key_index", "run_checks_integrity")(
+                diagnostics, changes
+            )
+    if link_check is not None:
+        with timed("link checks"):
+            link_check.report(diagnostics)
+    if sha_check is not None:
+        with timed("SHA checks"):
+            sha_check.report(diagnostics)
+    write_output(
+        diagnostics, args.format, args.output, summarize(diagnostics)
+    )
+    if args.profile:
+        sys.stderr.write(profiling.active.report())
+    if diagnostics.count(ERROR):
+        raise SystemExit(1)
@@ -3,11 +3,12 @@
 import re
 from utils import log_std_error, log_warning
 from common_checks import (
-    check_common_rules,
-    check_row_length,
+    column_positions,
+    common_rules,
+    compile_validator,
+    in_values,
     check_sort,
     run_checks,
-    run_test,
 )
 
 
@@ -54,99 +55,99 @@ pr_data = {
     ),
 }
 
+# Matches the pull request suffix of a PR Link
+PULL_SUFFIX = re.compile(r"\/pull\/\d+")
 
-def check_category(filename, row, i, log):
-    """Check validity of Category."""
-
-    if not re.fullmatch(r"(\w+|-|\;)*\w+", row["Category"]) or not all(
-        x in pr_data["Category"] for x in row["Category"].split(";")
-    ):
-        log_std_error(filename, log, i, row, "Category")
-
-
-def check_status(filename, row, i, log):
-    """Check validity of Status."""
-
-    if not row["Status"] in pr_data["Status"]:
-        log_std_error(filename, log, i, row, "Status")
+# Positions of the columns read by the cross-field rules
+PROJECT_URL, STATUS, PR_LINK, NOTES = column_positions(
+    pr_data, "Project URL", "Status", "PR Link", "Notes"
+)
 
 
-def check_status_consistency(filename, row, i, log):
+def check_status_consistency(filename, fields, i, log):
     """Check that the status is consistent with the requirements."""
 
     # Checks if Status is one of Accepted, Opened, Rejected
     # and checks for required information if so
-    if row["Status"] in ["Accepted", "Opened", "Rejected"]:
+    if fields[STATUS] in ["Accepted", "Opened", "Rejected"]:
 
         # The project apache/incubator-dubbo was renamed to apache/dubbo,
         # so the Project URL name (old) doesn't match the PR Link name
         # (new), despite them being the same project. This if statement is
         # a workaround for that issue.
         if (
-            row["Project URL"] == "https://github.com/apache/incubator-dubbo"
-            and re.sub(r"\/pull\/\d+", "", row["PR Link"]).casefold()
+            fields[PROJECT_URL] == "https://github.com/apache/incubator-dubbo"
+            and PULL_SUFFIX.sub("", fields[PR_LINK]).casefold()
             == "https://github.com/apache/dubbo"
         ):
             pass
         else:
-            check_pr_link(filename, row, i, log)
+            check_pr_link(filename, fields, i, log)
 
-    if row["Status"] in ["InspiredAFix", "Skipped", "MovedOrRenamed"]:
+    if fields[STATUS] in ["InspiredAFix", "Skipped", "MovedOrRenamed"]:
 
         # Should contain a note
-        if row["Notes"] == "":
+        if fields[NOTES] == "":
             log_warning(
                 filename,
                 log,
                 i,
-                "Status " + row["Status"] + " should contain a note",
+                "Status " + fields[STATUS] + " should contain a note",
+                "status-note",
             )
         # If it contains a note, it should be a valid link
         else:
-            check_notes(filename, row, i, log)
+            check_notes(filename, fields, i, log)
 
         # Should contain a PR Link
-        if row["Status"] == "InspiredAFix":
-            if row["PR Link"] == "":
+        if fields[STATUS] == "InspiredAFix":
+            if fields[PR_LINK] == "":
                 log_warning(
                     filename,
                     log,
                     i,
-                    "Status " + row["Status"] + " should have a PR Link",
+                    "Status " + fields[STATUS] + " should have a PR Link",
+                    "status-pr-link",
                 )
             # If it contains a PR link, it should be a valid one
             else:
-                check_pr_link(filename, row, i, log)
+                check_pr_link(filename, fields, i, log)
 
 
-def check_notes(filename, row, i, log):
+def check_notes(filename, fields, i, log):
     """Checks validity of Notes."""
 
-    if not pr_data["Notes"].fullmatch(row["Notes"]):
-        log_std_error(filename, log, i, row, "Notes")
+    if not pr_data["Notes"].fullmatch(fields[NOTES]):
+        log_std_error(filename, log, i, fields[NOTES], "Notes")
 
 
-def check_pr_link(filename, row, i, log):
+def check_pr_link(filename, fields, i, log):
     """Checks validity of the PR Link."""
 
-    if not pr_data["PR Link"].fullmatch(row["PR Link"]) or (
-        re.sub(r"\/pull\/\d+", "", row["PR Link"]).casefold()
-        != row["Project URL"].casefold()
+    if not pr_data["PR Link"].fullmatch(fields[PR_LINK]) or (
+        PULL_SUFFIX.sub("", fields[PR_LINK]).casefold()
+        != fields[PROJECT_URL].casefold()
     ):
-        log_std_error(filename, log, i, row, "PR Link")
+        log_std_error(filename, log, i, fields[PR_LINK], "PR Link")
+
+
+# Rules of each column of pr-data.csv, checked in this order
+pr_data["rules"] = {
+    **common_rules,
+    "Category": in_values(pr_data["Category"], ";"),
+    "Status": pr_data["Status"],
+}
+pr_data["cross_rules"] = [check_status_consistency]
+
+# Columns whose values repeat across rows, shared by the rows kept in memory
+pr_data["interned"] = ["Project URL", "Module Path", "Category", "Status"]
+
+validate_pr = compile_validator(pr_data)
 
 
-def run_checks_pr(log, commit_range):
+def run_checks_pr(log, changes):
     """Checks that pr-data.csv is properly formatted."""
 
     filename = "pr-data.csv"
-    checks = [
-        check_row_length,
-        check_common_rules,
-        check_category,
-        check_status,
-        check_status_consistency,
-        run_test,
-    ]
-    run_checks(filename, pr_data, log, commit_range, checks)
-    check_sort(filename, log)
+    run_checks(filename, pr_data, log, changes[filename], validate_pr)
+    check_sort(filename, log, changes[filename])
@@ -0,0 +1,146 @@
+"""
+Implements the measurement of how long each phase of a run takes: change
+detection, parsing, each rule of each file and the sort check. Nothing is
+measured unless a profile is active or a hook is registered.
+"""
+
+import time
+from functools import partial
+
+
+# Profile that is being filled in, if any
+active = None
+
+# Functions called as hook(phase, seconds, calls, rows) for every measurement
+hooks = []
+
+
+def add_hook(hook):
+    """Registers a function that receives every measurement."""
+
+    hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Unregisters a function added with add_hook."""
+
+    hooks.remove(hook)
+
+
+def enabled():
+    """Tells whether anything is interested in measurements."""
+
+    return active is not None or bool(hooks)
+
+
+def record(phase, seconds, calls=1, rows=0):
+    """Reports a measurement to the active profile and to the hooks."""
+
+    if active is not None:
+        active.add(phase, seconds, calls, rows)
+    for hook in hooks:
+        hook(phase, seconds, calls, rows)
+
+
+class Profile:
+    """Accumulates the wall time, calls and rows of each phase of a run."""
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, phase, seconds, calls=1, rows=0):
+        """Adds a measurement of phase."""
+
+        stats = self.phases.setdefault(phase, [0, 0.0, 0])
+        stats[0] += calls
+        stats[1] += seconds
+        stats[2] += rows
+
+    def report(self):
+        """Formats every phase as a row of a table, slowest first."""
+
+        width = max([len("Phase")] + [len(phase) for phase in self.phases])
+        lines = [
+            "%-*s %8s %10s %10s %12s"
+            % (width, "Phase", "Calls", "Time (ms)", "Rows", "Rows/s")
+        ]
+        for phase, (calls, seconds, rows) in sorted(
+            self.phases.items(), key=lambda item: -item[1][1]
+        ):
+            rate = "%.0f" % (rows / seconds) if rows and seconds else "-"
+            lines.append(
+                "%-*s %8d %10.2f %10s %12s"
+                % (width, phase, calls, seconds * 1000, rows or "-", rate)
+            )
+        return "\n".join(lines) + "\n"
+
+
+class timed:
+    """
+    Measures the wall time of a block as phase, if anything is interested.
+    The number of rows it processed can be set on it before it ends.
+    """
+
+    __slots__ = ("phase", "rows", "start")
+
+    def __init__(self, phase, rows=0):
+        self.phase = phase
+        self.rows = rows
+        self.start = None
+
+    def __enter__(self):
+        if enabled():
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            record(
+                self.phase,
+                time.perf_counter() - self.start,
+                rows=self.rows,
+            )
+
+
+def call_timed(stats, function, *args):
+    """Calls function, adding its call and wall time to stats."""
+
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+
+
+class Tally:
+    """
+    Accumulates the calls and wall time of the functions of a hot loop,
+    which are only reported when flushed, so that measuring each row
+    doesn't call the hooks each time.
+    """
+
+    def __init__(self):
+        self.phases = {}
+
+    def wrap(self, phase, function):
+        """Returns function, timed as phase (one row per call)."""
+
+        stats = self.phases.setdefault(phase, [0, 0.0])
+        return partial(call_timed, stats, function)
+
+    def merge(self, other):
+        """Adds the measurements of another tally, e.g. of a worker."""
+
+        for phase, (calls, seconds) in other.phases.items():
+            stats = self.phases.setdefault(phase, [0, 0.0])
+            stats[0] += calls
+            stats[1] += seconds
+
+    def flush(self):
+        """Reports and forgets every measurement."""
+
+        for phase, (calls, seconds) in self.phases.items():
+            if calls:
+                record(phase, seconds, calls, calls)
+        self.phases = {}
@@ -0,0 +1,353 @@
+"""
+Refreshes the Status of the rows of pr-data.csv whose pull request is still
+Opened, asking the GitHub API for the state of all of them concurrently over
+a few pooled connections. Responses are cached on disk with their ETags, so
+that pull requests that haven't changed since the previous run are answered
+with 304 Not Modified, and only the Status cells that changed are rewritten.
+
+Run it from the root directory, with a token to get a higher rate limit:
+
+    $ GITHUB_TOKEN=... python format_checker/refresh_statuses.py
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from common_checks import RAW_FIELD, column_positions
+from diagnostics import ERROR, FORMATS, Diagnostics, write_output
+from http_client import ConnectionPool
+from key_index import PR_FILE
+from line_index import parse_line
+from pr_checker import pr_data
+from utils import (
+    get_cache_dir,
+    load_cache,
+    log_esp_error,
+    log_warning,
+    replace_atomically,
+    save_cache,
+)
+
+
+API_URL = "https://api.github.com"
+
+# Tests whose status is never refreshed, listed under a "name" header
+IGNORE_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "auto-update-dataset",
+    "ignore.csv",
+)
+
+# Requests in flight at once, each on a connection of its own
+CONCURRENCY = 8
+
+# Attempts made for each pull request, waiting twice as long each time,
+# starting from BACKOFF seconds
+MAX_ATTEMPTS = 5
+BACKOFF = 1.0
+
+# Longest wait for the rate limit to be reset, in seconds, over which the
+# remaining pull requests are left as they are
+MAX_WAIT = 900.0
+
+# Seconds a request may take
+TIMEOUT = 30.0
+
+PULL_REQUEST = re.compile(
+    r"https://github\.com/([\w.-]+)/([\w.-]+)/pull/(\d+)", re.IGNORECASE
+)
+
+TEST_NAME, STATUS, PR_LINK = column_positions(
+    pr_data,
+    "Fully-Qualified Test Name (packageName.ClassName.methodName)",
+    "Status",
+    "PR Link",
+)
+
+
+class RefreshError(Exception):
+    """Raised when the state of a pull request can't be found."""
+
+
+def get_status(pull):
+    """Turns a pull request of the GitHub API into a Status."""
+
+    if pull.get("merged") or pull.get("merged_at"):
+        return "Accepted"
+    if pull.get("state") == "open":
+        return "Opened"
+    return "Rejected"
+
+
+def read_ignored(path):
+    """Reads the names of the tests whose status isn't refreshed."""
+
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8-sig") as ignored:
+        return {line.strip() for line in list(ignored)[1:] if line.strip()}
+
+
+def find_opened(filename, ignored):
+    """
+    Maps the PR Link of every Opened row of filename whose test isn't
+    ignored to the numbers of the rows that have it.
+    """
+
+    opened = {}
+    with open(filename, "rb") as dataset:
+        for i, line in enumerate(dataset, 1):
+            if i == 1 or b"Opened" not in line:
+                continue
+            fields = parse_line(line)
+            if (
+                len(fields) > PR_LINK
+                and fields[STATUS] == "Opened"
+                and fields[TEST_NAME] not in ignored
+                and PULL_REQUEST.fullmatch(fields[PR_LINK])
+            ):
+                opened.setdefault(fields[PR_LINK], []).append(i)
+    return opened
+
+
+def get_cache_path():
+    """Returns the path of the cache of the responses of the API."""
+
+    return os.path.join(get_cache_dir(), "pr-statuses.json")
+
+
+class RateLimit:
+    """
+    The time before which no request is sent, shared by every request, which
+    is pushed back when the API says the rate limit is exhausted.
+    """
+
+    def __init__(self):
+        self.resume = 0.0
+
+    def update(self, response):
+        """Takes note of the rate limit a response reports."""
+
+        headers = response.headers
+        if "retry-after" in headers:
+            self.resume = max(
+                self.resume, time.time() + float(headers["retry-after"])
+            )
+        elif headers.get("x-ratelimit-remaining") == "0":
+            reset = float(headers.get("x-ratelimit-reset", 0))
+            self.resume = max(self.resume, reset)
+
+    async def wait(self):
+        """Waits until requests can be sent, unless that takes too long."""
+
+        delay = self.resume - time.time()
+        if delay > MAX_WAIT:
+            raise RefreshError(
+                "the rate limit is exhausted for %.0f more seconds" % delay
+            )
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def fetch_status(pool, limit, cache, link, headers):
+    """
+    Finds the Status of the pull request at link, asking only whether it
+    changed if it is in the cache. Failed requests are retried with
+    exponential backoff, and rate limited ones once the limit is reset.
+    Returns the Status and whether it came from the cache.
+    """
+
+    owner, repository, number = PULL_REQUEST.fullmatch(link).groups()
+    path = "/repos/%s/%s/pulls/%s" % (owner, repository, number)
+    cached = cache.get(link)
+    if cached is not None:
+        headers = {**headers, "If-None-Match": cached["etag"]}
+    problem = None
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            # Jittered, so that failed requests aren't all retried at once
+            delay = BACKOFF * 2 ** (attempt - 1)
+            await asyncio.sleep(delay * random.uniform(1, 1.5))
+        await limit.wait()
+        try:
+            response = await asyncio.wait_for(
+                pool.request(path, headers), TIMEOUT
+            )
+        except (
+            OSError,
+            asyncio.IncompleteReadError,
+            asyncio.TimeoutError,
+        ) as error:
+            problem = str(error) or type(error).__name__
+            continue
+        limit.update(response)
+        if response.status == 304 and cached is not None:
+            return cached["status"], True
+        if response.status == 200:
+            status = get_status(json.loads(response.body))
+            if "etag" in response.headers:
+                cache[link] = {
+                    "etag": response.headers["etag"],
+                    "status": status,
+                }
+            return status, False
+        problem = "HTTP " + str(response.status)
+        if response.status not in (403, 429) and response.status < 500:
+            break
+    raise RefreshError(link + ": " + problem)
+
+
+async def fetch_statuses(links, cache, api_url, token, concurrency):
+    """
+    Finds the Status of every pull request at links concurrently, mapping
+    each link to its Status and whether it was cached, or to the
+    RefreshError it failed with.
+    """
+
+    headers = {
+        "Accept": "application/vnd.github+json",
+        "User-Agent": "idoft-status-refresher",
+    }
+    if token:
+        headers["Authorization"] = "Bearer " + token
+    pool = ConnectionPool(api_url, concurrency)
+    limit = RateLimit()
+    try:
+        results = await asyncio.gather(
+            *(
+                fetch_status(pool, limit, cache, link, headers)
+                for link in links
+            ),
+            return_exceptions=True,
+        )
+    finally:
+        pool.close()
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(
+            result, RefreshError
+        ):
+            raise result
+    return dict(zip(links, results))
+
+
+def set_field(line, position, value):
+    """
+    Replaces the field at position of a raw line with value, leaving the
+    rest of the line as it was.
+    """
+
+    start = 0
+    for _ in range(position):
+        start = RAW_FIELD.match(line, start).end() + 1
+    end = RAW_FIELD.match(line, start).end()
+    return line[:start] + value.encode("utf-8") + line[end:]
+
+
+def rewrite_statuses(filename, updates):
+    """
+    Rewrites the Status of the rows of filename given by updates, which
+    maps row numbers to their new Status, in a single streaming pass.
+    """
+
+    def write(output, directory):
+        with open(filename, "rb") as dataset:
+            for i, line in enumerate(dataset, 1):
+                if i in updates:
+                    line = set_field(line, STATUS, updates[i])
+                output.write(line)
+        return True
+
+    replace_atomically(filename, write)
+
+
+def main(argv):
+    """Refreshes the statuses, returning 1 if some couldn't be found."""
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--file", default=PR_FILE)
+    parser.add_argument("--ignore", default=IGNORE_FILE)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--cache", help="file the responses are cached in")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="list the statuses that changed without rewriting the file",
+    )
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="text",
+        help="format in which the changed statuses and failures are written",
+    )
+    parser.add_argument(
+        "--output",
+        help="file the changed statuses and failures are written to, "
+        "instead of stderr for text and stdout for the other formats",
+    )
+    args = parser.parse_args(argv)
+
+    opened = find_opened(args.file, read_ignored(args.ignore))
+    cache_path = args.cache or get_cache_path()
+    cache = load_cache(cache_path)
+    start = time.perf_counter()
+    results = asyncio.run(
+        fetch_statuses(
+            list(opened),
+            cache,
+            args.api_url,
+            os.environ.get("GITHUB_TOKEN"),
+            args.concurrency,
+        )
+    )
+    save_cache(cache_path, cache)
+
+    log = Diagnostics()
+    updates = {}
+    cached = 0
+    for link, result in results.items():
+        if isinstance(result, RefreshError):
+            log_esp_error(
+                args.file,
+                log,
+                "Couldn't refresh " + str(result),
+                "refresh-failed",
+                opened[link][0],
+            )
+            continue
+        status, from_cache = result
+        cached += from_cache
+        if status != "Opened":
+            for i in opened[link]:
+                updates[i] = status
+                log_warning(
+                    args.file,
+                    log,
+                    i,
+                    "Status Opened -> " + status + " (" + link + ")",
+                    "stale-status",
+                )
+    if updates and not args.dry_run:
+        rewrite_statuses(args.file, updates)
+    summary = (
+        "Checked %d pull requests (%d unchanged since cached, %d failed) in "
+        "%.1fs, %d rows updated\n"
+        % (
+            len(results),
+            cached,
+            log.count(ERROR),
+            time.perf_counter() - start,
+            0 if args.dry_run else len(updates),
+        )
+    )
+    write_output(log, args.format, args.output, summary)
+    return 1 if log.count(ERROR) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,197 @@
+"""
+Implements a diff of the rows of the dataset files by their key (Project
+URL, SHA Detected, Module Path and test name) rather than by their line, so
+that rows that only moved, e.g. because the file was re-sorted or a block
+was inserted above them, aren't checked again.
+"""
+
+from array import array
+from collections import namedtuple
+from key_index import UNIQUE_KEY
+from line_index import get_line, merge_ranges, open_dataset, parse_line
+from utils import log_info
+
+
+# Most removed rows joined at once, over which the join is split into passes
+# over disjoint parts of the keys, so that its memory stays bounded
+JOIN_ROWS = 1 << 18
+
+# Number of fields the key of a row is made of, which come first
+KEY_FIELDS = len(UNIQUE_KEY)
+
+# Rows added (head lines), removed (base lines), modified ((head line, base
+# line, positions of the fields that changed)) and moved ((head line, base
+# line)) between the base and the head of a file
+RowDiff = namedtuple("RowDiff", ["added", "removed", "modified", "moved"])
+
+
+def row_key(raw):
+    """
+    Hashes the key of a raw row, the fields in UNIQUE_KEY, or returns None
+    if it has no key. Rows without quotes are split without going through
+    the csv module. The hashes are only compared within a run, so the
+    built-in hash is used.
+    """
+
+    if b'"' in raw:
+        fields = [field.encode("utf-8") for field in parse_line(raw)]
+    else:
+        fields = raw.split(b",", KEY_FIELDS)
+    if len(fields) <= KEY_FIELDS:
+        return None
+    return hash(tuple(fields[:KEY_FIELDS]))
+
+
+def hash_rows(rows):
+    """
+    Hashes the key of every (line, raw bytes) row, returning an array of
+    hashes and one of their lines, and the lines of the rows without a key.
+    """
+
+    keys = array("q")
+    lines = array("q")
+    keyless = []
+    for line, raw in rows:
+        key = row_key(raw)
+        if key is None:
+            keyless.append(line)
+        else:
+            keys.append(key)
+            lines.append(line)
+    return keys, lines, keyless
+
+
+def match_rows(base, head):
+    """
+    Pairs the lines of the (hashes, lines) arrays of base with those of
+    head that have the same hash, in as many passes over disjoint parts of
+    the hashes as it takes to hold at most JOIN_ROWS lines of base at once.
+    Returns the (head line, base line) pairs and the lines of base and of
+    head that were left unpaired.
+    """
+
+    pairs = []
+    unpaired_base = []
+    unpaired_head = []
+    passes = max(1, -(-len(base[0]) // JOIN_ROWS))
+    for part in range(passes):
+        lines = {}
+        for value, line in zip(*base):
+            if value % passes == part:
+                lines.setdefault(value, []).append(line)
+        for value, line in zip(*head):
+            if value % passes != part:
+                continue
+            candidates = lines.get(value)
+            if candidates:
+                pairs.append((line, candidates.pop(0)))
+            else:
+                unpaired_head.append(line)
+        for candidates in lines.values():
+            unpaired_base.extend(candidates)
+    return pairs, unpaired_base, unpaired_head
+
+
+def diff_rows(data, index, change):
+    """
+    Diffs the rows that were removed from the base of a file with those
+    that were added to or changed in its head, whose contents and index are
+    data and index. Rows with the same contents in both only moved. The
+    rest are joined on their key: those whose key is in both were
+    modified, and the others were added or removed. The header is always
+    added.
+    """
+
+    removed = {
+        line: text.rstrip("\r").encode("utf-8")
+        for line, text in change["removed"]
+        if line > 1
+    }
+    changed = [
+        i
+        for first, last in merge_ranges(change["changed"])
+        for i in range(max(first, 2), min(last, len(index)) + 1)
+    ]
+
+    def head_rows(lines):
+        return (
+            (i, get_line(data, index, i).rstrip(b"\r\n")) for i in lines
+        )
+
+    pairs, base_left, head_left = match_rows(
+        (array("q", map(hash, removed.values())), array("q", removed)),
+        (
+            array("q", (hash(raw) for _, raw in head_rows(changed))),
+            array("q", changed),
+        ),
+    )
+    rows = RowDiff([], [], [], [])
+    for line, base_line in pairs:
+        if get_line(data, index, line).rstrip(b"\r\n") == removed[base_line]:
+            rows.moved.append((line, base_line))
+        else:
+            # Rows with different contents but the same hash
+            base_left.append(base_line)
+            head_left.append(line)
+
+    base_keys = hash_rows((line, removed[line]) for line in base_left)
+    head_keys = hash_rows(head_rows(head_left))
+    pairs, removed_lines, added_lines = match_rows(
+        base_keys[:2], head_keys[:2]
+    )
+    rows.removed.extend(removed_lines + base_keys[2])
+    rows.added.extend(added_lines + head_keys[2])
+    if any(first == 1 for first, _ in change["changed"]):
+        rows.added.append(1)
+    for line, base_line in pairs:
+        fields = parse_line(get_line(data, index, line))
+        base_fields = parse_line(removed[base_line])
+        columns = [
+            p
+            for p in range(max(len(fields), len(base_fields)))
+            if fields[p : p + 1] != base_fields[p : p + 1]
+        ]
+        rows.modified.append((line, base_line, columns))
+    for lines in rows:
+        lines.sort()
+    return rows
+
+
+def apply_row_diff(filename, change, data, index, log):
+    """
+    Diffs the rows of a file that had lines removed or modified, whose
+    contents and index are data and index, and narrows the lines that have
+    to be checked ("checked") to those of the rows that were added or
+    modified, keeping the rest of the changes for the checks that compare
+    rows with each other. The row diff is kept in the changes as "rows".
+    """
+
+    rows = diff_rows(data, index, change)
+    change["rows"] = rows
+    change["checked"] = merge_ranges(
+        [(line, line) for line in rows.added]
+        + [(line, line) for line, _, _ in rows.modified]
+    )
+    if rows.moved:
+        log_info(
+            filename,
+            log,
+            "%d row(s) only moved and weren't checked again; %d added, "
+            "%d modified and %d removed"
+            % (
+                len(rows.moved),
+                len(rows.added),
+                len(rows.modified),
+                len(rows.removed),
+            ),
+        )
+
+
+def apply_row_diffs(changes, log):
+    """Applies apply_row_diff to every file that needs it."""
+
+    for filename, change in changes.items():
+        if change is None or not (change["removed"] and change["changed"]):
+            continue
+        data, index = open_dataset(filename)
+        apply_row_diff(filename, change, data, index, log)
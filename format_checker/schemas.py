@@ -0,0 +1,13 @@
+"""Maps each dataset file to its schema and the validator compiled from it."""
+
+from pr_checker import pr_data, validate_pr
+from tic_fic_checker import tic_fic_data, validate_tic_fic
+from tso_iso_checker import tso_iso_rates, validate_tso_iso
+
+
+# Schema and validator of each dataset file
+SCHEMAS = {
+    "pr-data.csv": (pr_data, validate_pr),
+    "tic-fic-data.csv": (tic_fic_data, validate_tic_fic),
+    "tso-iso-rates.csv": (tso_iso_rates, validate_tso_iso),
+}
@@ -0,0 +1,229 @@
+"""
+Implements the optional rule that checks, against local bare mirror clones
+of the projects, that the SHAs of the checked rows are commits that exist.
+The SHAs of each project are looked up by a single git cat-file
+--batch-check process, and the processes of the projects run in parallel
+in a pool, while the offline checks run. The (project, SHA) pairs that were
+found are cached on disk, since a commit never stops being one, so repeated
+runs only look up new SHAs.
+"""
+
+import os
+import subprocess
+from urllib.parse import urlsplit
+from common_checks import column_positions, common_data
+from line_index import open_dataset, read_lines
+from pr_checker import pr_data
+from tic_fic_checker import tic_fic_data
+from tso_iso_checker import tso_iso_rates
+from utils import (
+    checked_ranges,
+    get_cache_dir,
+    load_cache,
+    log_info,
+    log_warning,
+    save_cache,
+)
+
+
+# Columns holding SHAs in each dataset file, by position
+SHA_COLUMNS = {
+    filename: dict(zip(column_positions(data_dict, *columns), columns))
+    for filename, data_dict, columns in (
+        ("pr-data.csv", pr_data, ["SHA Detected"]),
+        (
+            "tic-fic-data.csv",
+            tic_fic_data,
+            [
+                "SHA Detected",
+                "Test-Introducing Commit SHA",
+                "Flakiness-Introducing Commit SHA",
+            ],
+        ),
+        ("tso-iso-rates.csv", tso_iso_rates, ["SHA Detected"]),
+    )
+}
+
+PROJECT_URL = 0
+
+# Most git processes run at once
+MAX_WORKERS = 8
+
+
+def get_shas_path():
+    """Returns the path of the cache of the SHAs that were found."""
+
+    return os.path.join(get_cache_dir(), "shas.json")
+
+
+def find_mirror(mirrors, project_url):
+    """
+    Returns the bare clone of a project in the directory mirrors, which is
+    <owner>/<repository>.git (as made by git clone --mirror) or
+    <owner>/<repository>, or None if there is none.
+    """
+
+    path = urlsplit(project_url).path.strip("/")
+    if path.endswith(".git"):
+        path = path[: -len(".git")]
+    for candidate in (path + ".git", path):
+        git_dir = os.path.join(mirrors, *candidate.split("/"))
+        if os.path.isdir(git_dir):
+            return git_dir
+    return None
+
+
+def collect_shas(changes):
+    """
+    Maps every project to its valid SHAs in the rows of the dataset files
+    to be checked (every row of the files whose changes are None), and
+    each (project, SHA) pair to the files, rows and columns it is in.
+    """
+
+    projects = {}
+    places = {}
+    for filename, positions in SHA_COLUMNS.items():
+        change = changes[filename]
+        data, index = open_dataset(filename)
+        if change is None:
+            ranges = [(2, len(index))]
+        else:
+            ranges = checked_ranges(change)
+        for i, fields in read_lines(data, index, ranges):
+            if i == 1 or len(fields) <= PROJECT_URL:
+                continue
+            project = fields[PROJECT_URL]
+            if not common_data["Project URL"].fullmatch(project):
+                continue
+            for position, column in positions.items():
+                if position >= len(fields):
+                    continue
+                sha = fields[position]
+                if common_data["SHA"].fullmatch(sha):
+                    projects.setdefault(project, set()).add(sha)
+                    places.setdefault((project, sha), []).append(
+                        (filename, i, column)
+                    )
+    return projects, places
+
+
+def find_commits(git_dir, shas):
+    """
+    Looks up the SHAs in the repository at git_dir with a single git
+    cat-file --batch-check process, returning those that are commits, or
+    None if the repository couldn't be read.
+    """
+
+    try:
+        output = subprocess.run(
+            ("git", "--git-dir=" + git_dir, "cat-file", "--batch-check"),
+            input="".join(sha + "\n" for sha in shas).encode("ascii"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    commits = []
+    for line in output.decode("ascii", "replace").splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[1] == "commit":
+            commits.append(fields[0])
+    return commits
+
+
+class ShaCheck:
+    """
+    Looks up the SHAs of the rows to be checked in the mirrors of their
+    projects, in a pool of processes that is started when the check is
+    created, skipping the SHAs that are in the cache.
+    """
+
+    def __init__(self, changes, mirrors):
+        self.mirrors = mirrors
+        self.projects, self.places = collect_shas(changes)
+        self.cache_path = get_shas_path()
+        self.cache = {
+            project: set(shas)
+            for project, shas in load_cache(self.cache_path).items()
+        }
+        self.git_dirs = {}
+        self.pending = {}
+        for project, shas in self.projects.items():
+            git_dir = find_mirror(mirrors, project)
+            if git_dir is None:
+                continue
+            self.git_dirs[project] = git_dir
+            new = sorted(shas - self.cache.get(project, set()))
+            if new:
+                self.pending[project] = new
+        self.executor = None
+        self.futures = {}
+        if self.pending:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self.executor = ProcessPoolExecutor(
+                min(len(self.pending), MAX_WORKERS)
+            )
+            for project, shas in self.pending.items():
+                self.futures[project] = self.executor.submit(
+                    find_commits, self.git_dirs[project], shas
+                )
+
+    def report(self, log):
+        """
+        Waits for the lookups, caches the SHAs that were found and logs the
+        ones that aren't commits of their project.
+        """
+
+        unreadable = []
+        for project, future in self.futures.items():
+            commits = future.result()
+            if commits is None:
+                unreadable.append(project)
+            else:
+                self.cache.setdefault(project, set()).update(commits)
+        if self.executor is not None:
+            self.executor.shutdown()
+            save_cache(
+                self.cache_path,
+                {
+                    project: sorted(shas)
+                    for project, shas in self.cache.items()
+                },
+            )
+
+        missing = {}
+        unchecked = {}
+        for (project, sha), places in self.places.items():
+            if project not in self.git_dirs or project in unreadable:
+                for filename, _, _ in places:
+                    unchecked[filename] = unchecked.get(filename, 0) + 1
+            elif sha not in self.cache.get(project, ()):
+                for filename, i, column in places:
+                    missing.setdefault(filename, []).append(
+                        (i, column, sha, project)
+                    )
+        for filename in SHA_COLUMNS:
+            for i, column, sha, project in sorted(missing.get(filename, [])):
+                log_warning(
+                    filename,
+                    log,
+                    i,
+                    "The "
+                    + column
+                    + " "
+                    + sha
+                    + " isn't a commit of "
+                    + project,
+                    "unknown-sha",
+                )
+            if unchecked.get(filename):
+                log_info(
+                    filename,
+                    log,
+                    str(unchecked[filename])
+                    + " SHA(s) couldn't be checked, since their project has "
+                    "no readable mirror in "
+                    + self.mirrors,
+                )
@@ -0,0 +1,85 @@
+"""
+Makes the checker modules importable by the tests like main.py imports
+them, from their directory, together with the benchmark tools.
+"""
+
+import os
+import sys
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer
+import pytest
+
+CHECKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CHECKER_DIR)
+sys.path.insert(0, os.path.join(CHECKER_DIR, "benchmarks"))
+
+MAIN = os.path.join(CHECKER_DIR, "main.py")
+
+
+@pytest.fixture
+def run_main():
+    """
+    Returns a function that runs the tool in a directory with the given
+    arguments, returning its exit code and stderr.
+    """
+
+    def run(directory, *args):
+        result = subprocess.run(
+            (sys.executable, MAIN) + args,
+            cwd=directory,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env={
+                **os.environ,
+                "IDOFT_CACHE_DIR": os.path.join(directory, ".c"),
+            },
+        )
+        return result.returncode, result.stderr.decode("utf-8")
+
+    return run
+
+
+@pytest.fixture
+def commit_lines():
+    """
+    Returns a function that rewrites the lines of a dataset file in a
+    repository with edit, commits them and returns the new commit.
+    """
+
+    from synthetic import PR_FILE, git_in
+
+    def commit(directory, edit, filename=PR_FILE):
+        path = os.path.join(directory, filename)
+        with open(path, encoding="utf-8") as dataset:
+            lines = dataset.read().splitlines()
+        edit(lines)
+        with open(path, "w", encoding="utf-8", newline="") as dataset:
+            dataset.write("\n".join(lines) + "\n")
+        git_in(directory, "commit", "-q", "-am", "Edit")
+        return git_in(directory, "rev-parse", "HEAD").strip()
+
+    return commit
+
+
+@pytest.fixture
+def serve_http():
+    """
+    Returns a function that serves requests with a handler class on a free
+    port of 127.0.0.1, in a thread, returning its URL. Servers are stopped
+    once the test is done.
+    """
+
+    servers = []
+
+    def serve(handler):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return "http://127.0.0.1:%d" % server.server_address[1]
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,68 @@
+"""Tests that a push or pull request is checked only for its own changes."""
+
+import os
+from synthetic import PR_FILE, build_history, git_in
+
+
+def set_status(lines, line, status):
+    """Replaces the Status of the row at line (1-based)."""
+
+    fields = lines[line - 1].split(",")
+    fields[5] = status
+    lines[line - 1] = ",".join(fields)
+
+
+def make_branches(tmp_path, commit_lines):
+    """
+    Creates a repository whose master commits an invalid Status on row 7
+    after feature forked from it, and feature appends a valid row. Returns
+    the repository and the commits of master and feature.
+    """
+
+    directory = str(tmp_path)
+    build_history(directory, 40, 0)
+    with open(os.path.join(directory, PR_FILE), encoding="utf-8") as dataset:
+        last = dataset.read().splitlines()[-1]
+    commit_lines(directory, lambda lines: lines.pop())
+    git_in(directory, "branch", "-M", "master")
+    git_in(directory, "checkout", "-q", "-b", "feature")
+    feature = commit_lines(directory, lambda lines: lines.append(last))
+    git_in(directory, "checkout", "-q", "master")
+    master = commit_lines(
+        directory, lambda lines: set_status(lines, 7, "Bogus")
+    )
+    return directory, master, feature
+
+
+def test_pull_request_merge_checkout(tmp_path, run_main, commit_lines):
+    directory, master, feature = make_branches(tmp_path, commit_lines)
+    # Pull requests are checked out as their merge into the base branch
+    git_in(directory, "checkout", "-q", "--detach", master)
+    git_in(directory, "merge", "-q", "--no-ff", "-m", "Merge", feature)
+
+    code, output = run_main(directory, master, feature)
+    assert code == 0, output
+    assert "Bogus" not in output
+
+
+def test_push(tmp_path, run_main, commit_lines):
+    directory, master, feature = make_branches(tmp_path, commit_lines)
+    before = git_in(directory, "rev-parse", "HEAD~1").strip()
+
+    code, output = run_main(directory, before, master)
+    assert code == 1
+    assert "Bogus" in output
+
+
+def test_force_push(tmp_path, run_main, commit_lines):
+    directory, master, feature = make_branches(tmp_path, commit_lines)
+    # feature is rewritten, so the commit it pointed to isn't an ancestor
+    git_in(directory, "checkout", "-q", "feature")
+    git_in(directory, "reset", "-q", "--hard", "HEAD~1")
+    rewritten = commit_lines(
+        directory, lambda lines: set_status(lines, 9, "Bogus")
+    )
+
+    code, output = run_main(directory, feature, rewritten)
+    assert code == 1
+    assert "Bogus" in output
@@ -0,0 +1,54 @@
+"""Tests that incremental exports of the dataset match full ones."""
+
+import os
+import random
+import sqlite3
+from export import DATASET_FILES, export_commit, query_rows
+from synthetic import build_history, git_in
+
+
+def edit_lines(lines, rng):
+    """Moves, deletes, copies and modifies some rows, keeping the header."""
+
+    for _ in range(rng.randint(1, 6)):
+        kind = rng.choice(["move", "delete", "copy", "modify"])
+        i = rng.randrange(1, len(lines))
+        if kind == "move":
+            lines.insert(rng.randrange(1, len(lines)), lines.pop(i))
+        elif kind == "delete" and len(lines) > 2:
+            del lines[i]
+        elif kind == "copy":
+            lines.insert(rng.randrange(1, len(lines) + 1), lines[i])
+        else:
+            lines[i] = lines[i].replace(",", ",x", 1)
+
+
+def test_incremental_export_keeps_file_order(
+    tmp_path, monkeypatch, commit_lines
+):
+    directory = str(tmp_path)
+    build_history(directory, 300, 0)
+    monkeypatch.chdir(directory)
+    monkeypatch.setenv("IDOFT_CACHE_DIR", os.path.join(directory, ".c"))
+    incremental = sqlite3.connect(os.path.join(directory, "incremental.db"))
+    full = sqlite3.connect(os.path.join(directory, "full.db"))
+
+    rng = random.Random(0)
+    export_commit(incremental, git_in(directory, "rev-parse", "HEAD").strip())
+    for _ in range(8):
+        filename = rng.choice(DATASET_FILES)
+        commit = commit_lines(
+            directory, lambda lines: edit_lines(lines, rng), filename
+        )
+        counts = export_commit(incremental, commit)
+        # Only the rows that changed are inserted
+        assert counts[filename][0] < 20
+    export_commit(full, commit, full=True)
+
+    for filename in DATASET_FILES:
+        rows = query_rows(incremental, filename, {})
+        assert rows == query_rows(full, filename, {})
+        with open(filename, encoding="utf-8") as dataset:
+            assert rows == dataset.read().splitlines()[1:]
+    incremental.close()
+    full.close()
@@ -0,0 +1,92 @@
+"""Tests that --fix rewrites the dataset files as the checks expect them."""
+
+import io
+import os
+import random
+from fix import MAX_MERGE, fix_file, sort_lines
+from pr_checker import pr_data
+from synthetic import PR_FILE, write_dataset
+
+
+def break_rows(directory):
+    """
+    Makes fixable mistakes in pr-data.csv of a synthetic dataset: a
+    trailing semicolon, stray whitespace, a blank line and rows out of
+    order. Also quotes a test name with a comma, which needs no fixing.
+    Returns the header and the quoted row.
+    """
+
+    path = os.path.join(directory, PR_FILE)
+    with open(path, encoding="utf-8") as dataset:
+        header, *lines = dataset.read().splitlines()
+    rows = [line.split(",") for line in lines]
+    rows[3][5] = "Opened;"
+    rows[3][6] = rows[3][0] + "/pull/1"
+    rows[5][4] = " " + rows[5][4] + " "
+    rows[7][3] = '"' + rows[7][3] + '[1, 2]"'
+    quoted = ",".join(rows[7])
+    lines = [",".join(fields) for fields in rows]
+    lines[10], lines[20] = lines[20], lines[10]
+    lines.insert(12, "")
+    with open(path, "w", encoding="utf-8", newline="") as dataset:
+        dataset.write("\n".join([header] + lines) + "\n")
+    return header, quoted
+
+
+def test_fix_is_idempotent(tmp_path, run_main):
+    directory = str(tmp_path)
+    write_dataset(directory, 200)
+    header, quoted = break_rows(directory)
+
+    code, output = run_main(directory, "--all")
+    assert code == 1
+    code, output = run_main(directory, "--fix", "--all")
+    assert code == 0, output
+    assert (
+        "Fixed 2 value(s), removed 1 blank line(s), sorted the rows" in output
+    )
+    path = os.path.join(directory, PR_FILE)
+    with open(path, encoding="utf-8") as dataset:
+        fixed = dataset.read()
+    assert fixed.startswith(header + "\n")
+    assert "\n" + quoted + "\n" in fixed
+    assert "Opened;" not in fixed
+
+    code, output = run_main(directory, "--fix", "--all")
+    assert code == 0, output
+    assert "Fixed" not in output
+    with open(path, encoding="utf-8") as dataset:
+        assert dataset.read() == fixed
+
+
+def test_external_merge_sort(tmp_path):
+    directory = str(tmp_path)
+    write_dataset(directory, 2000)
+    break_rows(directory)
+    path = os.path.join(directory, PR_FILE)
+    with open(path, "rb") as dataset:
+        lines = dataset.readlines()[1:]
+    random.Random(0).shuffle(lines)
+
+    in_memory = io.BytesIO()
+    sort_lines(lines, in_memory, directory)
+    merged = io.BytesIO()
+    # Each run holds a few rows, so they are merged in more than one pass
+    buffer_size = 400
+    assert sum(map(len, lines)) // buffer_size > MAX_MERGE
+    sort_lines(lines, merged, directory, buffer_size)
+    assert merged.getvalue() == in_memory.getvalue()
+    assert sorted(os.listdir(directory)) == sorted(
+        ["pr-data.csv", "tic-fic-data.csv", "tso-iso-rates.csv"]
+    )
+
+    with open(path, "rb") as dataset:
+        original = dataset.read()
+    fix_file(path, pr_data, True)
+    with open(path, "rb") as dataset:
+        expected = dataset.read()
+    with open(path, "wb") as dataset:
+        dataset.write(original)
+    fix_file(path, pr_data, True, buffer_size)
+    with open(path, "rb") as dataset:
+        assert dataset.read() == expected
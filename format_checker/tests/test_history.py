@@ -0,0 +1,26 @@
+"""Tests the timeline of the violations introduced and fixed by commits."""
+
+from synthetic import build_history, git_in
+from history import scan_history
+
+
+def test_removed_reference_counts(tmp_path, monkeypatch, commit_lines):
+    directory = str(tmp_path)
+    build_history(directory, 40, 0)
+    monkeypatch.chdir(directory)
+    base = git_in(directory, "rev-parse", "HEAD").strip()
+    # Test 8 is referred to by tic-fic-data.csv, and is on line 10
+    removed = []
+    commit_lines(directory, lambda lines: removed.append(lines.pop(9)))
+    commit_lines(directory, lambda lines: lines.insert(9, removed[0]))
+
+    _, totals, reports = scan_history([base, "HEAD"], jobs=1)
+    assert not totals
+    removal, restore = reports
+    assert [record.rule for record in removal.introduced] == [
+        "removed-reference"
+    ]
+    assert removal.counts == {"removed-reference": 1}
+    assert removal.totals == {"removed-reference": 1}
+    assert restore.fixed == {"removed-reference": 1}
+    assert not restore.totals
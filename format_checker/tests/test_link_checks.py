@@ -0,0 +1,70 @@
+"""Tests the online check of the links of pr-data.csv on a stub server."""
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+import link_checks
+from diagnostics import Diagnostics
+from link_checks import LinkCheck
+from synthetic import write_dataset
+
+# Project whose URL doesn't exist, and one whose server doesn't answer HEAD
+DEAD = "/org0000001/project0000001"
+NO_HEAD = "/org0000000/project0000000"
+
+
+class StubServer(BaseHTTPRequestHandler):
+    """Answers with the status of every link, without a body."""
+
+    protocol_version = "HTTP/1.1"
+    requests = Counter()
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.requests[self.command] += 1
+        if self.path == NO_HEAD:
+            return self.answer(405)
+        self.answer(404 if self.path == DEAD else 200)
+
+    def do_GET(self):
+        self.requests[self.command] += 1
+        self.answer(200)
+
+    def answer(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def test_dead_links_are_cached(tmp_path, serve_http, monkeypatch):
+    directory = str(tmp_path)
+    write_dataset(directory, 100)
+    monkeypatch.chdir(directory)
+    monkeypatch.setenv("IDOFT_CACHE_DIR", str(tmp_path / ".c"))
+    origin = serve_http(StubServer)
+    monkeypatch.setattr(link_checks.probe_links, "origin", origin)
+    StubServer.requests = Counter()
+
+    check = LinkCheck(None)
+    log = Diagnostics()
+    check.report(log)
+    links = len(check.links)
+    assert StubServer.requests == {"HEAD": links, "GET": 1}
+    # Tests 50 to 99, on rows 52 to 101, are of the dead project
+    assert [(record.row, record.rule) for record in log.records] == [
+        (i, "dead-link") for i in range(52, 102)
+    ]
+    assert log.records[0].message() == (
+        "The Project URL https://github.com" + DEAD + " doesn't exist "
+        "(HTTP 404)"
+    )
+
+    check = LinkCheck(None)
+    assert check.pending == []
+    cached = Diagnostics()
+    check.report(cached)
+    assert StubServer.requests == {"HEAD": links, "GET": 1}
+    assert [record.text() for record in cached.records] == [
+        record.text() for record in log.records
+    ]
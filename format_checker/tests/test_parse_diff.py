@@ -0,0 +1,83 @@
+"""Tests the parsing of the line ranges changed by a git diff -U0."""
+
+from utils import parse_diff
+
+
+def diff_of(*lines):
+    """Returns a diff of pr-data.csv made of the given lines."""
+
+    return "\n".join(
+        (
+            "diff --git a/pr-data.csv b/pr-data.csv",
+            "index 0000000..1111111 100644",
+            "--- a/pr-data.csv",
+            "+++ b/pr-data.csv",
+        )
+        + lines
+    )
+
+
+def test_pure_deletion():
+    changes = parse_diff(diff_of("@@ -5,2 +4,0 @@", "-old 5", "-old 6"), "B")
+    assert changes["pr-data.csv"] == {
+        "base": "B",
+        "changed": [],
+        "deleted": [(4, 2)],
+        "removed": [(5, "old 5"), (6, "old 6")],
+        "hunks": [(5, 2, 4, 0)],
+    }
+
+
+def test_single_line_hunks():
+    changes = parse_diff(
+        diff_of("@@ -3 +3 @@", "-old 3", "+new 3", "@@ -8,0 +9 @@", "+new 9"),
+        "B",
+    )
+    change = changes["pr-data.csv"]
+    assert change["changed"] == [(3, 3), (9, 9)]
+    assert change["deleted"] == []
+    assert change["removed"] == [(3, "old 3")]
+    assert change["hunks"] == [(3, 1, 3, 1), (8, 0, 9, 1)]
+
+
+def test_body_lines_that_look_like_headers():
+    # Rows starting with "++ " or "-- " make hunk lines like file headers
+    changes = parse_diff(
+        diff_of(
+            "@@ -2,2 +2,2 @@",
+            "--- a/tic-fic-data.csv",
+            "-old 3",
+            "+++ b/tic-fic-data.csv",
+            "+new 3",
+            "@@ -7 +7 @@",
+            "-old 7",
+            "+new 7",
+        ),
+        "B",
+    )
+    assert list(changes) == ["pr-data.csv"]
+    change = changes["pr-data.csv"]
+    assert change["changed"] == [(2, 3), (7, 7)]
+    assert change["removed"] == [
+        (2, "-- a/tic-fic-data.csv"),
+        (3, "old 3"),
+        (7, "old 7"),
+    ]
+
+
+def test_deleted_file():
+    diff = "\n".join(
+        (
+            "diff --git a/tso-iso-rates.csv b/tso-iso-rates.csv",
+            "deleted file mode 100644",
+            "index 1111111..0000000",
+            "--- a/tso-iso-rates.csv",
+            "+++ /dev/null",
+            "@@ -1,2 +0,0 @@",
+            "-header",
+            "-row",
+        )
+    )
+    changes = parse_diff(diff + "\n" + diff_of("@@ -4 +4 @@", "-a", "+b"), "B")
+    assert list(changes) == ["pr-data.csv"]
+    assert changes["pr-data.csv"]["changed"] == [(4, 4)]
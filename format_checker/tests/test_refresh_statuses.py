@@ -0,0 +1,131 @@
+"""Tests the refresher of the Status of Opened pull requests on a stub API."""
+
+import json
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+import refresh_statuses
+from pr_checker import pr_data
+
+# State of each stub pull request, by number: 4 doesn't exist and 5 is rate
+# limited the first time it is requested
+PULLS = {
+    1: {"state": "open", "merged": False},
+    2: {"state": "closed", "merged": True},
+    3: {"state": "closed", "merged": False},
+    5: {"state": "closed", "merged": True},
+}
+
+
+class StubApi(BaseHTTPRequestHandler):
+    """Answers like the pull requests endpoint of the GitHub API."""
+
+    protocol_version = "HTTP/1.1"
+    requests = Counter()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        number = int(self.path.split("/")[-1])
+        self.requests[number] += 1
+        if number == 5 and self.requests[number] == 1:
+            return self.answer(429, {}, {"Retry-After": "0"})
+        if number not in PULLS:
+            return self.answer(404, {"message": "Not Found"})
+        etag = '"%d"' % number
+        if self.headers.get("If-None-Match") == etag:
+            self.requests["304"] += 1
+            return self.answer(304, None, {"ETag": etag})
+        self.answer(200, PULLS[number], {"ETag": etag})
+
+    def answer(self, status, body, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if body is None:
+            self.end_headers()
+            return
+        data = json.dumps(body).encode("utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def pull_link(number):
+    """Returns the link of a stub pull request."""
+
+    return "https://github.com/o/r/pull/%d" % number
+
+
+def write_opened(path):
+    """Writes a pr-data.csv with an Opened row for each stub pull request."""
+
+    lines = [",".join(pr_data["columns"])]
+    for number in range(1, 6):
+        lines.append(
+            "https://github.com/o/r,%s,.,org.o.T.test%d,ID,Opened,%s,"
+            % ("0" * 40, number, pull_link(number))
+        )
+    with open(path, "w", encoding="utf-8", newline="") as dataset:
+        dataset.write("\n".join(lines) + "\n")
+    return lines
+
+
+def test_refresh_statuses(tmp_path, serve_http, monkeypatch, capsys):
+    monkeypatch.setattr(refresh_statuses, "BACKOFF", 0.01)
+    StubApi.requests = Counter()
+    path = str(tmp_path / "pr-data.csv")
+    lines = write_opened(path)
+    args = [
+        "--file",
+        path,
+        "--api-url",
+        serve_http(StubApi),
+        "--cache",
+        str(tmp_path / "cache.json"),
+        "--ignore",
+        str(tmp_path / "ignore.csv"),
+        "--format",
+        "json",
+    ]
+
+    assert refresh_statuses.main(args + ["--dry-run"]) == 1
+    out, err = capsys.readouterr()
+    records = [json.loads(line) for line in out.splitlines()]
+    assert [
+        (record["row"], record["rule"], record["message"])
+        for record in records[:-1]
+    ] == [
+        (3, "stale-status", "Status Opened -> Accepted (%s)" % pull_link(2)),
+        (4, "stale-status", "Status Opened -> Rejected (%s)" % pull_link(3)),
+        (
+            5,
+            "refresh-failed",
+            "Couldn't refresh %s: HTTP 404" % pull_link(4),
+        ),
+        (6, "stale-status", "Status Opened -> Accepted (%s)" % pull_link(5)),
+    ]
+    assert records[-1] == {
+        "summary": {"stale-status": 3, "refresh-failed": 1}
+    }
+    assert "(0 unchanged since cached, 1 failed)" in err
+    assert StubApi.requests == {1: 1, 2: 1, 3: 1, 4: 1, 5: 2}
+    with open(path, encoding="utf-8") as dataset:
+        assert dataset.read().splitlines() == lines
+
+    # The responses of the dry run are cached with their ETags
+    assert refresh_statuses.main(args) == 1
+    out, err = capsys.readouterr()
+    assert "(4 unchanged since cached, 1 failed)" in err
+    assert "3 rows updated" in err
+    assert StubApi.requests["304"] == 4
+    with open(path, encoding="utf-8") as dataset:
+        statuses = [line.split(",")[5] for line in dataset.read().splitlines()]
+    assert statuses == [
+        "Status",
+        "Opened",
+        "Accepted",
+        "Rejected",
+        "Opened",
+        "Accepted",
+    ]
@@ -0,0 +1,107 @@
+"""Tests that rows that only moved between two commits aren't checked."""
+
+import os
+import json
+from synthetic import PR_FILE, build_history, git_in
+
+MOVED = (
+    "1 row(s) only moved and weren't checked again; 0 added, 0 modified "
+    "and 0 removed"
+)
+
+
+def move_row(lines, line, to):
+    """Moves the row at line (1-based) so that it ends up at line to."""
+
+    lines.insert(to - 1, lines.pop(line - 1))
+
+
+def set_status(lines, line, status):
+    """Replaces the Status of the row at line (1-based)."""
+
+    fields = lines[line - 1].split(",")
+    fields[5] = status
+    lines[line - 1] = ",".join(fields)
+
+
+def check_range(directory, run_main, base, head):
+    """
+    Checks the changes from base to head, returning the exit code and the
+    (file, row, rule, message) of every diagnostic of pr-data.csv.
+    """
+
+    output = os.path.join(directory, "output.json")
+    code, _ = run_main(
+        directory, base, head, "--format", "json", "--output", output
+    )
+    with open(output, encoding="utf-8") as records:
+        records = [json.loads(line) for line in records]
+    return code, [
+        (record["row"], record["rule"], record["message"])
+        for record in records[:-1]
+        if record["file"] == PR_FILE
+    ]
+
+
+def unsorted_base(tmp_path, commit_lines):
+    """
+    Creates a repository whose last commit gives row 7 an invalid Status
+    and moves it out of order, to row 21. Returns the repository and the
+    commit.
+    """
+
+    directory = str(tmp_path)
+    build_history(directory, 40, 0)
+
+    def edit(lines):
+        set_status(lines, 7, "Bogus")
+        move_row(lines, 7, 21)
+
+    return directory, commit_lines(directory, edit)
+
+
+def test_moved_row_is_not_checked(tmp_path, run_main, commit_lines):
+    directory, base = unsorted_base(tmp_path, commit_lines)
+    # Sorting the file moves the invalid row back without changing it
+    head = commit_lines(directory, lambda lines: move_row(lines, 21, 7))
+
+    code, records = check_range(directory, run_main, base, head)
+    assert code == 0
+    assert records == [
+        (None, "info", MOVED),
+        (None, "info", "There are no changes to be checked"),
+    ]
+
+
+def test_edited_moved_row_is_checked(tmp_path, run_main, commit_lines):
+    directory, base = unsorted_base(tmp_path, commit_lines)
+
+    def edit(lines):
+        move_row(lines, 21, 7)
+        set_status(lines, 7, "Bogus2")
+
+    head = commit_lines(directory, edit)
+
+    code, records = check_range(directory, run_main, base, head)
+    assert code == 1
+    assert records == [(7, "Status", 'Invalid Status: "Bogus2"')]
+
+
+def test_moved_row_out_of_order(tmp_path, run_main, commit_lines):
+    directory = str(tmp_path)
+    build_history(directory, 40, 0)
+    base = git_in(directory, "rev-parse", "HEAD").strip()
+    head = commit_lines(directory, lambda lines: move_row(lines, 7, 21))
+
+    code, records = check_range(directory, run_main, base, head)
+    assert code == 1
+    assert records == [
+        (None, "info", MOVED),
+        (None, "info", "There are no changes to be checked"),
+        (
+            21,
+            "sort-order",
+            "The file is not properly ordered: row 21 should come before "
+            "row 20",
+        ),
+    ]
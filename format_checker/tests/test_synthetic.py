@@ -0,0 +1,12 @@
+"""Tests that the synthetic datasets the benchmarks use are valid."""
+
+from synthetic import build_history
+
+
+def test_uncorrupted_dataset_is_valid(tmp_path, run_main):
+    directory = str(tmp_path)
+    build_history(directory, 2000, 0)
+
+    code, output = run_main(directory, "--all")
+    assert code == 0, output
+    assert "WARNING" not in output and "ERROR" not in output, output
@@ -0,0 +1,50 @@
+"""Tests the rules that check the counts and P-Values of tso-iso-rates.csv."""
+
+import os
+import json
+from synthetic import TSO_ISO_FILE, write_dataset
+from tso_iso_checker import compute_p_value
+
+
+def test_counts_and_p_values(tmp_path, run_main):
+    directory = str(tmp_path)
+    write_dataset(directory, 200)
+    path = os.path.join(directory, TSO_ISO_FILE)
+    with open(path, encoding="utf-8") as dataset:
+        lines = dataset.read().splitlines()
+    # The runs of row 3 don't add up to its Total Runs In Test Suite
+    fields = lines[2].split(",")
+    fields[8] = str(int(fields[8]) + 1)
+    lines[2] = ",".join(fields)
+    # Row 4 failed 5 times in 100 runs of one order and never in the other,
+    # and its P-Value is on the right side of 0.05 but wrong
+    fields = lines[3].split(",")
+    fields[4:8] = ["(5;0)", "(100;100)", "0.9000000", "greater"]
+    fields[8:10] = ["200", "195"]
+    lines[3] = ",".join(fields)
+    with open(path, "w", encoding="utf-8", newline="") as dataset:
+        dataset.write("\n".join(lines) + "\n")
+
+    output = os.path.join(directory, "output.json")
+    code, _ = run_main(
+        directory, "--all", "--format", "json", "--output", output
+    )
+    assert code == 1
+    with open(output, encoding="utf-8") as records:
+        records = [json.loads(line) for line in records]
+    assert [
+        (record["row"], record["rule"], record["message"])
+        for record in records[:-1]
+    ] == [
+        (
+            3,
+            "rate-counts",
+            "On row 3, the runs add up to 2100, not 2101",
+        ),
+        (
+            4,
+            "p-value",
+            "The P-Value 0.9000000 should be %.7g, by a chi-square test of "
+            "the failures and runs" % compute_p_value((5, 0), (100, 100)),
+        ),
+    ]
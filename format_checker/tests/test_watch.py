@@ -0,0 +1,79 @@
+"""Tests that the watch mode reports what a new run would after each save."""
+
+import os
+import random
+from synthetic import (
+    PR_FILE,
+    TIC_FIC_FILE,
+    TSO_ISO_FILE,
+    build_history,
+)
+from watch import Watcher
+
+
+def edit_file(path, edit, rng):
+    """Edits the rows of a dataset file in place, as an editor saves it."""
+
+    with open(path, encoding="utf-8") as dataset:
+        header, *lines = dataset.read().splitlines()
+    edit(lines, rng)
+    with open(path, "w", encoding="utf-8", newline="") as dataset:
+        dataset.write("\n".join([header] + lines) + "\n")
+    # Saves can come faster than the clock of the file system ticks
+    edit_file.clock += 10**9
+    os.utime(path, ns=(edit_file.clock, edit_file.clock))
+
+
+edit_file.clock = 10**18
+
+
+def swap(lines, rng):
+    if len(lines) < 2:
+        return
+    i = rng.randrange(len(lines) - 1)
+    j = i + 1 if rng.random() < 0.5 else rng.randrange(i + 1, len(lines))
+    lines[i], lines[j] = lines[j], lines[i]
+
+
+def move(lines, rng):
+    line = lines.pop(rng.randrange(len(lines)))
+    lines.insert(rng.randrange(len(lines) + 1), line)
+
+
+def delete(lines, rng):
+    if len(lines) > 1:
+        del lines[rng.randrange(len(lines))]
+
+
+def rename(lines, rng):
+    i = rng.randrange(len(lines))
+    fields = lines[i].split(",")
+    fields[3] += "Missing"
+    lines[i] = ",".join(fields)
+
+
+def test_watch_matches_new_runs(tmp_path, monkeypatch, run_main):
+    directory = str(tmp_path)
+    # Few rows, so that the edits often meet rows that refer to each other
+    build_history(directory, 80, 0)
+    monkeypatch.chdir(directory)
+    monkeypatch.setenv("IDOFT_CACHE_DIR", os.path.join(directory, ".c"))
+    output = os.path.join(directory, "output.json")
+    watcher = Watcher([])
+
+    rng = random.Random(1)
+    for step in range(40):
+        filename = rng.choice(
+            [PR_FILE, TIC_FIC_FILE, TIC_FIC_FILE, TSO_ISO_FILE]
+        )
+        edit = rng.choice([swap, swap, move, delete, rename])
+        edit_file(os.path.join(directory, filename), edit, rng)
+        watcher.update()
+
+        run_main(directory, "--format", "json", "--output", output)
+        with open(output, encoding="utf-8") as expected:
+            assert watcher.check().format("json") == expected.read(), (
+                step,
+                filename,
+                edit.__name__,
+            )
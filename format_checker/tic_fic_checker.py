@@ -1,11 +1,10 @@
 """Implements rule checks for the tic-fic-data.csv file."""
 
 import re
-from utils import log_std_error
 from common_checks import (
     common_data,
-    check_common_rules,
-    check_row_length,
+    common_rules,
+    compile_validator,
     run_checks,
 )
 
@@ -40,95 +39,43 @@ tic_fic_data = {
 }
 
 
-def check_days_between(filename, row, i, log):
-    """Checks validity of Days Between TIC-FIC."""
-
-    if not tic_fic_data["Days Between TIC-FIC"].fullmatch(
-        row["Days Between TIC-FIC"]
-    ):
-        log_std_error(filename, log, i, row, "Days Between TIC-FIC")
-
-
-def check_mods(filename, row, i, log):
-    """
-    Checks validity of Flaky Test File Modified, Other Test Files Modified,
-    Code Under Test Files Modified and Build Related Files Modified.
-    """
-
-    keys = [
-        "Flaky Test File Modified",
-        "Other Test Files Modified",
-        "Code Under Test Files Modified",
-        "Build Related Files Modified",
-    ]
-    for key in keys:
-        if not tic_fic_data["Modified"].fullmatch(row[key]):
-            log_std_error(filename, log, i, row, key)
-
-
-def check_fic_sha(filename, row, i, log):
-    """Checks of Flakiness-Introducing Commit SHA."""
-
-    if not common_data["SHA"].fullmatch(
-        row["Flakiness-Introducing Commit SHA"]
-    ):
-        log_std_error(
-            filename, log, i, row, "Flakiness-Introducing Commit SHA"
-        )
-
-
-def check_tic_mp(filename, row, i, log):
-    """Checks validity of Test-Introducing Commit Module Path."""
-
-    if not common_data["Module Path"].fullmatch(
-        row["Test-Introducing Commit Module Path"]
-    ):
-        log_std_error(
-            filename, log, i, row, "Test-Introducing Commit Module Path"
-        )
-
-
-def check_tic_fqn(filename, row, i, log):
-    """Checks validity of Test-Introducing Commit Fully-Qualified Test Name."""
-
-    if not common_data["Fully-Qualified Name"].fullmatch(
-        row["Test-Introducing Commit Fully-Qualified Test Name"]
-    ):
-        log_std_error(
-            filename,
-            log,
-            i,
-            row,
-            "Test-Introducing Commit Fully-Qualified Test Name",
-        )
-
-
-def check_tic_sha(filename, row, i, log):
-    """Checks validity of Test-Introducing Commit SHA."""
-
-    if not common_data["SHA"].fullmatch(row["Test-Introducing Commit SHA"]):
-        log_std_error(filename, log, i, row, "Test-Introducing Commit SHA")
+# Rules of each column of tic-fic-data.csv, checked in this order
+tic_fic_data["rules"] = {
+    **common_rules,
+    "TIC = FIC": tic_fic_data["TIC = FIC"],
+    "Test-Introducing Commit SHA": common_data["SHA"],
+    "Test-Introducing Commit Fully-Qualified Test Name": (
+        common_data["Fully-Qualified Name"]
+    ),
+    "Test-Introducing Commit Module Path": common_data["Module Path"],
+    "Flakiness-Introducing Commit SHA": common_data["SHA"],
+    "Flaky Test File Modified": tic_fic_data["Modified"],
+    "Other Test Files Modified": tic_fic_data["Modified"],
+    "Code Under Test Files Modified": tic_fic_data["Modified"],
+    "Build Related Files Modified": tic_fic_data["Modified"],
+    "Days Between TIC-FIC": tic_fic_data["Days Between TIC-FIC"],
+}
 
 
-def check_tic_eq_fic(filename, row, i, log):
-    """Checks validity of TIC = FIC."""
+# Columns whose values repeat across rows, shared by the rows kept in memory
+tic_fic_data["interned"] = [
+    "Project URL",
+    "Module Path",
+    "TIC = FIC",
+    "Test-Introducing Commit Module Path",
+    "Flaky Test File Modified",
+    "Other Test Files Modified",
+    "Code Under Test Files Modified",
+    "Build Related Files Modified",
+]
 
-    if not tic_fic_data["TIC = FIC"].fullmatch(row["TIC = FIC"]):
-        log_std_error(filename, log, i, row, "TIC = FIC")
+validate_tic_fic = compile_validator(tic_fic_data)
 
 
-def run_checks_tic_fic(log, commit_range):
+def run_checks_tic_fic(log, changes):
     """Checks that tic-fic-data.csv is properly formatted."""
 
-    checks = [
-        check_row_length,
-        check_common_rules,
-        check_tic_eq_fic,
-        check_tic_sha,
-        check_tic_fqn,
-        check_tic_mp,
-        check_fic_sha,
-        check_mods,
-        check_days_between,
-    ]
-    run_checks("tic-fic-data.csv", tic_fic_data, log, commit_range, checks)
+    filename = "tic-fic-data.csv"
+    run_checks(
+        filename, tic_fic_data, log, changes[filename], validate_tic_fic
+    )
@@ -1,12 +1,14 @@
 """Implements rule checks for the tso-iso-rates.csv file."""
 
 import re
-from utils import log_std_error
+import math
 from common_checks import (
-    check_common_rules,
-    check_row_length,
+    column_positions,
+    common_rules,
+    compile_validator,
     run_checks,
 )
+from utils import log_esp_error, log_warning
 
 # Contains information and data unique to tso-iso-rates.csv
 tso_iso_rates = {
@@ -31,74 +33,241 @@ tso_iso_rates = {
 }
 
 
-def check_totals(filename, row, i, log):
+# Rules of each column of tso-iso-rates.csv, checked in this order
+tso_iso_rates["rules"] = {
+    **common_rules,
+    "Number Of Test Failures In Test Suite": tso_iso_rates["Failures/Runs"],
+    "Number Of Test Runs In Test Suite": tso_iso_rates["Failures/Runs"],
+    "P-Value": tso_iso_rates["P-Value"],
+    "Is P-Value Less Or Greater Than 0.05": tso_iso_rates["Less/Greater"],
+    "Total Runs In Test Suite": tso_iso_rates["Last 4"],
+    "Number of Times Test Passed In Test Suite": tso_iso_rates["Last 4"],
+    "Total Runs In Isolation": tso_iso_rates["Last 4"],
+    "Number of Times Test Passed In Isolation": tso_iso_rates["Last 4"],
+}
+
+
+# Columns whose values repeat across rows, shared by the rows kept in memory
+tso_iso_rates["interned"] = [
+    "Project URL",
+    "Module Path",
+    "Is P-Value Less Or Greater Than 0.05",
+]
+
+# Positions of the columns read by the cross-field rules
+(
+    FAILURES,
+    RUNS,
+    P_VALUE,
+    LESS_GREATER,
+    SUITE_RUNS,
+    SUITE_PASSES,
+    ISOLATION_RUNS,
+    ISOLATION_PASSES,
+) = column_positions(tso_iso_rates, *tso_iso_rates["columns"][4:])
+
+# Significance level the Less/Greater column compares the P-Value with
+ALPHA = 0.05
+
+# Largest difference allowed between a P-Value and the recomputed one, on
+# top of the rounding of its last digit
+P_VALUE_TOLERANCE = 5e-8
+
+# P-Values computed so far, by (failures, runs) table
+P_VALUES = {}
+
+
+def parse_counts(value):
+    """Parses a (a;b;c) tuple of counts."""
+
+    return tuple(int(count) for count in value[1:-1].split(";"))
+
+
+def read_counts(fields):
     """
-    Checks validity of Total Runs In Test Suite, Number of Times Test
-    Passed In Test Suite, Total Runs In Isolation and Number of Times
-    Test Passed In Isolation.
+    Returns the failures and runs of the test in each order of the test
+    suite of a row, or None if they don't follow their pattern.
     """
 
-    keys = [
-        "Total Runs In Test Suite",
-        "Number of Times Test Passed In Test Suite",
-        "Total Runs In Isolation",
-        "Number of Times Test Passed In Isolation",
-    ]
-    for key in keys:
-        if not tso_iso_rates["Last 4"].fullmatch(row[key]):
-            log_std_error(filename, log, i, row, key)
+    pattern = tso_iso_rates["Failures/Runs"]
+    if not (
+        pattern.fullmatch(fields[FAILURES]) and pattern.fullmatch(fields[RUNS])
+    ):
+        return None
+    return parse_counts(fields[FAILURES]), parse_counts(fields[RUNS])
 
 
-def check_less_greater(filename, row, i, log):
-    """Checks validity of Is P-Value Less Or Greater Than 0.05."""
+def table_statistic(failures, runs):
+    """
+    Computes the statistic of Pearson's chi-square test of whether the rate
+    at which a test fails depends on the order of the test suite, over its
+    (failures, runs) table, with Yates's correction for two orders. Returns
+    None if the test is undefined, i.e. some order was never run, or the
+    test always or never failed.
+    """
 
-    if not tso_iso_rates["Less/Greater"].fullmatch(
-        row["Is P-Value Less Or Greater Than 0.05"]
-    ):
-        log_std_error(
-            filename, log, i, row, "Is P-Value Less Or Greater Than 0.05"
+    total_failures = sum(failures)
+    total_runs = sum(runs)
+    if 0 in runs or total_failures in (0, total_runs):
+        return None
+    rate = total_failures / total_runs
+    correction = 0.5 if len(runs) == 2 else 0.0
+    statistic = 0.0
+    for failed, run in zip(failures, runs):
+        expected = run * rate
+        difference = max(abs(failed - expected) - correction, 0.0)
+        statistic += difference ** 2 / (expected * (1 - rate))
+    return statistic
+
+
+def chi_square_p(statistic, dof):
+    """
+    Returns the probability that a chi-square variable with dof degrees of
+    freedom is at least statistic, by the closed form of its survival
+    function for whole and half degrees, summed in log space so that it
+    stays exact for tiny values.
+    """
+
+    half = statistic / 2
+    if half == 0:
+        return 1.0
+    if dof % 2:
+        p = math.erfc(math.sqrt(half))
+        exponents = [j + 0.5 for j in range(dof // 2)]
+    else:
+        p = 0.0
+        exponents = list(range(dof // 2))
+    for exponent in exponents:
+        p += math.exp(
+            exponent * math.log(half) - half - math.lgamma(exponent + 1)
         )
+    return min(p, 1.0)
 
 
-def check_pvalue(filename, row, i, log):
-    """Checks validity of P-Value."""
+def compute_p_value(failures, runs):
+    """
+    Returns the P-Value of the chi-square test of a (failures, runs) table,
+    or None if the test is undefined (see table_statistic).
+    """
+
+    statistic = table_statistic(failures, runs)
+    if statistic is None:
+        return None
+    return chi_square_p(statistic, len(runs) - 1)
 
-    if not tso_iso_rates["P-Value"].fullmatch(row["P-Value"]):
-        log_std_error(filename, log, i, row, "P-Value")
 
+def p_value_matches(value, p):
+    """
+    Tells whether a P-Value as written in the dataset is p, rounded to the
+    digits it shows.
+    """
 
-def check_num_runs(filename, row, i, log):
-    """Checks validity of Number Of Test Runs In Test Suite."""
+    mantissa, _, exponent = value.upper().partition("E")
+    decimals = len(mantissa.partition(".")[2])
+    rounding = 0.5 * 10 ** (int(exponent or 0) - decimals)
+    difference = abs(float(value) - p)
+    return difference <= min(rounding, P_VALUE_TOLERANCE) + 1e-9 * p
 
-    if not tso_iso_rates["Failures/Runs"].fullmatch(
-        row["Number Of Test Runs In Test Suite"]
+
+def check_counts(filename, fields, i, log):
+    """
+    Checks that the failures, runs and passes of a row agree with each
+    other, and that Less/Greater agrees with the P-Value.
+    """
+
+    counts = read_counts(fields)
+    problems = []
+    if counts is not None:
+        failures, runs = counts
+        if len(failures) != len(runs):
+            problems.append(
+                "there are failures for %d orders but runs for %d"
+                % (len(failures), len(runs))
+            )
+        elif any(failed > run for failed, run in zip(failures, runs)):
+            problems.append("some order failed more times than it was run")
+        last = tso_iso_rates["Last 4"]
+        if last.fullmatch(fields[SUITE_RUNS]):
+            if sum(runs) != int(fields[SUITE_RUNS]):
+                problems.append(
+                    "the runs add up to %d, not %s"
+                    % (sum(runs), fields[SUITE_RUNS])
+                )
+            elif last.fullmatch(fields[SUITE_PASSES]) and sum(runs) - sum(
+                failures
+            ) != int(fields[SUITE_PASSES]):
+                problems.append(
+                    "the test passed %d times in the test suite, not %s"
+                    % (sum(runs) - sum(failures), fields[SUITE_PASSES])
+                )
+    if (
+        tso_iso_rates["Last 4"].fullmatch(fields[ISOLATION_RUNS])
+        and tso_iso_rates["Last 4"].fullmatch(fields[ISOLATION_PASSES])
+        and int(fields[ISOLATION_PASSES]) > int(fields[ISOLATION_RUNS])
     ):
-        log_std_error(
-            filename, log, i, row, "Number Of Test Runs In Test Suite"
+        problems.append("the test passed in isolation more times than it ran")
+    if tso_iso_rates["P-Value"].fullmatch(fields[P_VALUE]) and fields[
+        LESS_GREATER
+    ] in ("less", "greater"):
+        less = float(fields[P_VALUE]) < ALPHA
+        if less != (fields[LESS_GREATER] == "less"):
+            problems.append(
+                "the P-Value "
+                + fields[P_VALUE]
+                + " isn't "
+                + fields[LESS_GREATER]
+                + " than "
+                + str(ALPHA)
+            )
+    for problem in problems:
+        log_esp_error(
+            filename,
+            log,
+            "On row " + str(i) + ", " + problem,
+            "rate-counts",
+            i,
         )
 
 
-def check_num_failures(filename, row, i, log):
-    """Checks validity of Number Of Test Failures In Test Suite."""
+def check_p_value(filename, fields, i, log):
+    """
+    Checks that the P-Value of a row is the one of the chi-square test of
+    whether its failure rate depends on the order of the test suite, which
+    is computed once for each distinct table of failures and runs.
+    """
 
-    if not tso_iso_rates["Failures/Runs"].fullmatch(
-        row["Number Of Test Failures In Test Suite"]
+    counts = read_counts(fields)
+    if (
+        counts is None
+        or len(counts[0]) != len(counts[1])
+        or not tso_iso_rates["P-Value"].fullmatch(fields[P_VALUE])
     ):
-        log_std_error(
-            filename, log, i, row, "Number Of Test Failures In Test Suite"
+        return
+    if counts not in P_VALUES:
+        P_VALUES[counts] = compute_p_value(*counts)
+    p = P_VALUES[counts]
+    if p is not None and not p_value_matches(fields[P_VALUE], p):
+        log_warning(
+            filename,
+            log,
+            i,
+            "The P-Value "
+            + fields[P_VALUE]
+            + " should be %.7g, by a chi-square test of the failures and "
+            "runs" % p,
+            "p-value",
         )
 
 
-def run_checks_tso_iso(log, commit_range):
+tso_iso_rates["cross_rules"] = [check_counts, check_p_value]
+
+validate_tso_iso = compile_validator(tso_iso_rates)
+
+
+def run_checks_tso_iso(log, changes):
     """Checks that tso-iso-data.csv is properly formatted."""
 
-    checks = [
-        check_row_length,
-        check_common_rules,
-        check_num_failures,
-        check_num_runs,
-        check_pvalue,
-        check_less_greater,
-        check_totals,
-    ]
-    run_checks("tso-iso-rates.csv", tso_iso_rates, log, commit_range, checks)
+    filename = "tso-iso-rates.csv"
+    run_checks(
+        filename, tso_iso_rates, log, changes[filename], validate_tso_iso
+    )
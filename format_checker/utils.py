@@ -1,126 +1,378 @@
 """Contains helper functions used in other modules."""
 
+import os
 import re
+import json
+import shutil
+import tempfile
 import subprocess
+from functools import lru_cache
+from diagnostics import ERROR, INFO, WARNING, Diagnostic
 
 
-def get_commit_list(commit_range):
+# Hash of the empty tree, used as base when a push has no parent commit
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+# Most files of each kind persisted for git blobs, over which the least
+# recently used ones are deleted
+MAX_BLOB_FILES = 32
+
+HUNK_HEADER = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def git(*args):
+    """Runs a git command and returns its decoded standard output."""
+
+    return subprocess.check_output(("git",) + args).decode("utf-8")
+
+
+@lru_cache(maxsize=None)
+def get_cache_dir():
+    """
+    Returns the directory where the tool persists data between runs, which
+    is idoft-cache inside the git directory unless IDOFT_CACHE_DIR is set.
+    """
+
+    if os.environ.get("IDOFT_CACHE_DIR"):
+        return os.environ["IDOFT_CACHE_DIR"]
+    git_dir = git("rev-parse", "--absolute-git-dir").strip()
+    return os.path.join(git_dir, "idoft-cache")
+
+
+def prune_cache_files(pattern, keep=MAX_BLOB_FILES):
+    """
+    Deletes all but the keep most recently used files of the cache
+    directory whose name matches pattern, by modification time, which is
+    updated whenever one of them is used. Files that can't be deleted are
+    left alone.
+    """
+
+    directory = get_cache_dir()
+    try:
+        names = [
+            name for name in os.listdir(directory) if pattern.fullmatch(name)
+        ]
+    except OSError:
+        return
+    if len(names) <= keep:
+        return
+    files = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            files.append((os.stat(path).st_mtime_ns, path))
+        except OSError:
+            pass
+    files.sort(reverse=True)
+    for _, path in files[keep:]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def replace_atomically(filename, write):
+    """
+    Calls write with a new temporary file next to filename, which then
+    replaces filename in a single step, so that it is never seen half
+    written. If write returns False, filename is left as it was.
+    """
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, path = tempfile.mkstemp(
+        dir=directory, prefix="." + os.path.basename(filename) + "."
+    )
+    try:
+        with os.fdopen(handle, "wb") as output:
+            changed = write(output, directory)
+            output.flush()
+            os.fsync(output.fileno())
+        if changed:
+            if os.path.exists(filename):
+                shutil.copymode(filename, path)
+            os.replace(path, filename)
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+    return changed
+
+
+def load_cache(path):
+    """Reads a cache from a JSON file, which is empty if it can't be read."""
+
+    try:
+        with open(path, encoding="utf-8") as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(path, cache):
+    """Writes a cache to a JSON file, replacing the previous one."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(output, directory):
+        output.write(json.dumps(cache, sort_keys=True).encode("utf-8"))
+        return True
+
+    replace_atomically(path, write)
+
+
+def rev_exists(rev):
+    """Checks whether rev names an existing commit."""
+
+    return (
+        subprocess.run(
+            ("git", "rev-parse", "--verify", "-q", rev + "^{commit}"),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode
+        == 0
+    )
+
+
+def is_ancestor(ancestor, rev):
+    """Checks whether the commit ancestor is an ancestor of rev."""
+
+    return (
+        subprocess.run(
+            ("git", "merge-base", "--is-ancestor", ancestor, rev),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode
+        == 0
+    )
+
+
+def get_diff_base(commit_range):
     """
-    Turns the commit range into a useful list of commits (the ones
-    contained in the push/PR).
+    Turns the commit range into the revision the working tree has to be
+    compared against to find every change made in the push/PR.
     """
 
     # If there is no commit range, it must be because the tool is running
-    # locally, so get the list of commits from origin/<current-branch> to the
-    # last commit made
+    # locally, so compare against origin/<current-branch> (if it exists) to
+    # include committed changes that haven't yet been pushed
     if commit_range == []:
-        commit_range = (
-            subprocess.check_output(
-                "git log --oneline origin/"
-                + '$(git branch | grep "\\* *" | cut -d " " -f 2)..'
-                + '$(git rev-parse --short HEAD) | cut -d " " -f 1',
-                shell=True,
-            )
-            .decode("utf-8")
-            .split("\n")[:-1]
-        )
+        branch = git("rev-parse", "--abbrev-ref", "HEAD").strip()
+        if rev_exists("origin/" + branch):
+            return git("merge-base", "origin/" + branch, "HEAD").strip()
+        return "HEAD"
 
     # If it's the first push to a new branch, the event.before commit
     # will consist of 40 zeroes. This needs to be handled separately
-    elif re.fullmatch(r"0{40}", commit_range[0]):
-        commit_range = [commit_range[1][:7]] + subprocess.check_output(
-            "git log --oneline "
-            + str(commit_range[1])
-            + ".."
-            + str(commit_range[2])
-            + ' | cut -d " " -f 1',
-            shell=True,
-        ).decode("utf-8").split("\n")[:-1]
-    else:
-        commit_range = (
-            subprocess.check_output(
-                "git log --oneline "
-                + str(commit_range[0])
-                + ".."
-                + str(commit_range[1])
-                + ' | cut -d " " -f 1',
-                shell=True,
-            )
-            .decode("utf-8")
-            .split("\n")[:-1]
-        )
-    return commit_range
+    if re.fullmatch(r"0{40}", commit_range[0]):
+        if rev_exists(commit_range[1] + "^"):
+            return commit_range[1] + "^"
+        return EMPTY_TREE
+    if not rev_exists(commit_range[0]):
+        return commit_range[0]
+
+    # The checkout of a pull request is its merge into the base branch,
+    # whose first parent is the base, and that of a push descends from
+    # event.before, so the changes are those made since it. Comparing
+    # against their merge-base would also pick up every change made to the
+    # base branch since the fork
+    if is_ancestor(commit_range[0], "HEAD"):
+        return commit_range[0]
 
+    # event.before isn't an ancestor after a force push
+    return git("merge-base", commit_range[0], commit_range[1]).strip()
 
-def get_committed_lines(filename, commit_range):
+
+def new_change(base):
+    """Returns the changes of a file that hasn't changed since base."""
+
+    return {
+        "base": base,
+        "changed": [],
+        "deleted": [],
+        "removed": [],
+        "hunks": [],
+    }
+
+
+def checked_ranges(change):
     """
-    Computes which lines have been modified in the commits contained in the
-    push/PR.
+    Returns the (first, last) ranges of the changed lines of a file whose
+    rows have to be checked: all of them, unless a row diff found that some
+    rows only moved (see row_diff.apply_row_diffs).
     """
 
-    commit_list = get_commit_list(commit_range)
-    if commit_list != []:
-        commit_list = "\\|".join(commit_list)
-        command = (
-            "git blame "
-            + filename
-            + " | grep -n '"
-            + commit_list
-            + "' | cut -f1 -d:"
+    return change.get("checked", change["changed"])
+
+
+def parse_diff(diff, base):
+    """
+    Parses the output of git diff -U0 against base into a dictionary that
+    maps each filename to its changes: the sorted list of (first, last) line
+    ranges that were added or modified in it ("changed"), the (line, count)
+    pairs of rows that were deleted right after the given line without
+    being replaced ("deleted"), the (line, text) pairs of every line of
+    base that was deleted or modified ("removed"), and the (old start, old
+    count, new start, new count) of every hunk, as git wrote them ("hunks").
+    """
+
+    changes = {}
+    change = None
+    remaining = 0
+    old_line = 0
+    for line in diff.split("\n"):
+        if remaining > 0:
+            # Hunk body, which may look like a header ("+++ ...") too
+            if line[:1] == "-":
+                change["removed"].append((old_line, line[1:]))
+                old_line += 1
+            if line[:1] in ("+", "-"):
+                remaining -= 1
+            continue
+        if line.startswith("+++ "):
+            # Deleted files have no lines left to check
+            path = line[4:]
+            change = None
+            if path != "/dev/null":
+                change = changes.setdefault(path[2:], new_change(base))
+        elif line.startswith("@@ ") and change is not None:
+            match = HUNK_HEADER.match(line)
+            old_line = int(match.group(1))
+            removed = 1 if match.group(2) is None else int(match.group(2))
+            start = int(match.group(3))
+            count = 1 if match.group(4) is None else int(match.group(4))
+            change["hunks"].append((old_line, removed, start, count))
+            if count > 0:
+                change["changed"].append((start, start + count - 1))
+            elif removed > 0:
+                change["deleted"].append((start, removed))
+            remaining = removed + count
+    return changes
+
+
+class CatFile:
+    """
+    A git cat-file --batch process that is kept running, so that any
+    number of objects are read without starting a process for each.
+    """
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            ("git", "cat-file", "--batch"),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
         )
-        committed_lines = subprocess.check_output(command, shell=True)
-        committed_lines = committed_lines.decode("utf-8").split("\n")[:-1]
-        return committed_lines
-    return commit_list
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, name):
+        """
+        Returns the id, type and contents of the object with the given
+        name (e.g. a commit, or :path for a staged file), or None if there
+        is no such object.
+        """
 
-def get_uncommitted_lines(filename):
+        self.process.stdin.write(name.encode("utf-8") + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            return None
+        oid, kind, size = header
+        data = self.process.stdout.read(int(size))
+        self.process.stdout.read(1)
+        return oid.decode("ascii"), kind.decode("ascii"), data
+
+    def close(self):
+        """Stops the process."""
+
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def get_changed_lines(filenames, commit_range):
     """
-    Computes which lines have been modified in filename
-    but not yet committed.
+    Computes which lines have been added, modified or deleted in filenames,
+    either in the commits contained in the push/PR or in the working tree,
+    using a single git diff for all files.
     """
 
-    command = "git blame " + filename + " | grep -n '^0\\{8\\} ' | cut -f1 -d:"
-    uncommitted_lines = subprocess.check_output(command, shell=True)
-    uncommitted_lines = uncommitted_lines.decode("utf-8").split("\n")[:-1]
-    return uncommitted_lines
+    return diff_changes(filenames, get_diff_base(commit_range))
+
+
+def get_staged_lines(filenames, cat_file):
+    """
+    Computes which lines have been added, modified or deleted in the staged
+    versions of filenames since HEAD, i.e. in the commit about to be made.
+    """
+
+    base = "HEAD" if cat_file.read("HEAD") is not None else EMPTY_TREE
+    return diff_changes(filenames, base, staged=True)
+
+
+def read_staged(filenames, cat_file):
+    """
+    Reads the staged versions of filenames, mapping each one to the id and
+    contents of its blob. Files that aren't staged are empty.
+    """
+
+    staged = {}
+    for filename in filenames:
+        blob = cat_file.read(":" + filename)
+        staged[filename] = (None, b"") if blob is None else (blob[0], blob[2])
+    return staged
+
+
+def diff_changes(filenames, base, staged=False):
+    """
+    Computes the changes of filenames since base in the working tree or, if
+    staged is set, in the index.
+    """
+
+    diff = git(
+        "diff",
+        *(["--cached"] if staged else []),
+        "-U0",
+        "--no-color",
+        "--no-ext-diff",
+        "--no-renames",
+        base,
+        "--",
+        *filenames,
+    )
+    changes = parse_diff(diff, base)
+    return {
+        filename: changes.get(filename, new_change(base))
+        for filename in filenames
+    }
 
 
 def log_info(filename, log, message):
     """Logs a merely informational message."""
 
-    log.info("INFO: On file " + filename + ": " + message)
+    log.add(Diagnostic(filename, None, None, "info", INFO, message))
 
 
-def log_std_error(filename, log, line, row, key):
-    """Logs a standard error."""
+def log_std_error(filename, log, line, value, key):
+    """Logs a standard error: an invalid value of column key."""
 
-    log_std_error.tracker += 1
-    log.error(
-        "ERROR: On file "
-        + filename
-        + ", row "
-        + line
-        + ":\n"
-        + "Invalid "
-        + key
-        + ': "'
-        + row[key]
-        + '"'
-    )
+    log.add(Diagnostic(filename, line, key, key, ERROR, value))
 
 
-def log_esp_error(filename, log, message):
-    """Logs a special error."""
+def log_std_warning(filename, log, line, value, key):
+    """Logs a standard warning: a value of column key that looks wrong."""
 
-    log_esp_error.tracker += 1
-    log.error("ERROR: On file " + filename + ": " + message)
+    log.add(Diagnostic(filename, line, key, key, WARNING, value))
 
 
-def log_warning(filename, log, line, message):
-    """Logs a warning."""
+def log_esp_error(filename, log, message, rule, line=None):
+    """Logs a special error of the given rule, optionally on a row."""
 
-    log_warning.tracker += 1
-    log.warning(
-        "WARNING: On file " + filename + ", row " + line + ": \n" + message
-    )
+    log.add(Diagnostic(filename, line, None, rule, ERROR, message))
+
+
+def log_warning(filename, log, line, message, rule):
+    """Logs a warning of the given rule."""
+
+    log.add(Diagnostic(filename, line, None, rule, WARNING, message))
@@ -0,0 +1,162 @@
+"""
+Implements a persistent cache of the rows that are known to be valid, so that
+rows whose content has already been checked by the same rules are skipped.
+"""
+
+import os
+import glob
+import time
+import sqlite3
+import hashlib
+from functools import lru_cache
+from utils import get_cache_dir
+
+
+# Number of rows remembered by the cache, the least recently used go first
+MAX_ENTRIES = 1 << 20
+
+# Number of digests looked up with a single query
+LOOKUP_BATCH = 500
+
+# Nanoseconds for which a row counts as recently used, during which finding
+# it again doesn't rewrite it, so that a warm run writes next to nothing
+USED_RESOLUTION = 24 * 3600 * 10**9
+
+
+@lru_cache(maxsize=None)
+def get_ruleset_version():
+    """
+    Computes a hash of the source code of the tool, so that changing any
+    rule (or anything else) invalidates every cached result.
+    """
+
+    version = hashlib.blake2b(digest_size=16)
+    for path in sorted(
+        glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))
+    ):
+        with open(path, "rb") as source:
+            version.update(source.read())
+    return version.digest()
+
+
+class ValidationCache:
+    """
+    Maps the hash of a row's content, together with its file and the
+    ruleset version, to the fact that checking it logged nothing. The
+    cache is kept in an SQLite database under the cache directory and is
+    bounded by max_entries, evicting the least recently used rows, which
+    are tracked to within USED_RESOLUTION. Lookups and additions are kept
+    in memory until save is called.
+    """
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES):
+        if path is None:
+            path = os.path.join(get_cache_dir(), "valid-rows.sqlite")
+        self.path = path
+        self.max_entries = max_entries
+        self.version = get_ruleset_version()
+        self.now = time.time_ns()
+        self.connection = None
+        self.hits = set()
+        self.valid = set()
+
+    def __getstate__(self):
+        # Connections can't be sent to worker processes, which reopen it
+        state = self.__dict__.copy()
+        state["connection"] = None
+        return state
+
+    def connect(self):
+        """Opens the database, returning None if it can't be used."""
+
+        if self.connection is None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.connection = sqlite3.connect(self.path)
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS valid_rows "
+                    "(digest BLOB PRIMARY KEY, used INTEGER NOT NULL) "
+                    "WITHOUT ROWID"
+                )
+            except (OSError, sqlite3.Error):
+                self.connection = None
+        return self.connection
+
+    def digest(self, filename, line):
+        """Hashes the raw bytes of a line of filename."""
+
+        return hashlib.blake2b(
+            filename.encode("utf-8") + b"\0" + line.rstrip(b"\r\n"),
+            digest_size=16,
+            key=self.version,
+        ).digest()
+
+    def lookup(self, digests):
+        """
+        Returns which of the digests belong to rows known to be valid,
+        remembering those that weren't used recently to mark them as used.
+        """
+
+        known = set()
+        connection = self.connect()
+        if connection is None:
+            return known
+        digests = list(digests)
+        for start in range(0, len(digests), LOOKUP_BATCH):
+            batch = digests[start : start + LOOKUP_BATCH]
+            try:
+                rows = connection.execute(
+                    "SELECT digest, used FROM valid_rows WHERE digest IN ("
+                    + ",".join("?" * len(batch))
+                    + ")",
+                    batch,
+                ).fetchall()
+            except sqlite3.Error:
+                return known
+            for digest, used in rows:
+                known.add(digest)
+                if self.now - used > USED_RESOLUTION:
+                    self.hits.add(digest)
+        return known
+
+    def add(self, digest):
+        """Remembers that the row with the given digest is valid."""
+
+        self.valid.add(digest)
+
+    def merge(self, other):
+        """Takes over the lookups and additions made by another instance."""
+
+        self.hits |= other.hits
+        self.valid |= other.valid
+
+    def save(self):
+        """
+        Writes the rows found or added since the last save, marking them as
+        the most recently used, and evicts the oldest rows over the limit.
+        Failing to write the cache is not an error.
+        """
+
+        connection = self.connect()
+        if connection is None or not (self.hits or self.valid):
+            return
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO valid_rows VALUES (?, ?)",
+                    ((digest, self.now) for digest in self.hits | self.valid),
+                )
+                (count,) = connection.execute(
+                    "SELECT COUNT(*) FROM valid_rows"
+                ).fetchone()
+                if count > self.max_entries:
+                    connection.execute(
+                        "DELETE FROM valid_rows WHERE digest IN (SELECT "
+                        "digest FROM valid_rows ORDER BY used LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+        except sqlite3.Error:
+            pass
+        self.hits = set()
+        self.valid = set()
+        self.now = time.time_ns()
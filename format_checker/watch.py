@@ -0,0 +1,419 @@
+"""
+Implements the watch mode, which keeps the dataset files and their changes in
+memory and, whenever one of them is saved, finds its changes with git diff as
+a new run would, checking again only the rows that were edited since the
+previous save.
+"""
+
+import os
+import time
+import subprocess
+from array import array
+from collections import Counter
+from itertools import accumulate
+from common_checks import (
+    BULK_DELETION,
+    check_fields,
+    log_unsorted,
+    sort_key,
+)
+from diagnostics import Diagnostics
+from key_index import (
+    PR_FILE,
+    REFERENCE_KEY,
+    REFERRING_FILES,
+    UNIQUE_KEY,
+    get_blob_ids,
+    key_hash,
+    log_dangling,
+    log_duplicate,
+    log_removed,
+)
+from line_index import merge_ranges, parse_line, split_lines
+from row_diff import apply_row_diff
+from schemas import SCHEMAS
+from utils import checked_ranges, diff_changes, get_changed_lines, log_info
+
+
+# Seconds between two looks at the modification time of the files
+POLL_INTERVAL = 0.1
+
+
+def common_prefix(old, new):
+    """
+    Returns the length of the common prefix of two byte strings, halving
+    the part that is compared each time so that no copies are made.
+    """
+
+    view = memoryview(new)
+    low, high = 0, min(len(old), len(new))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old.startswith(view[low:middle], low):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def common_suffix(old, new, limit):
+    """
+    Returns the length of the common suffix of two byte strings, up to
+    limit bytes, like common_prefix.
+    """
+
+    view = memoryview(new)
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old.endswith(
+            view[len(new) - middle : len(new) - low], 0, len(old) - low
+        ):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def edited_region(old, new, line_count):
+    """
+    Finds the lines that differ between two versions of a file, split by
+    newlines, of which the old one has line_count. Returns the first and
+    end of the slice of the old lines that was replaced (counting from 0),
+    and the new lines that replaced it: lines before and after the slice
+    are the same in both. Only the bytes around the edit are split.
+    """
+
+    prefix = common_prefix(old, new)
+    first = old.count(b"\n", 0, prefix)
+    start = old.rfind(b"\n", 0, prefix) + 1
+    suffix = common_suffix(old, new, min(len(old), len(new)) - start)
+    tail = new.count(b"\n", len(new) - suffix)
+    end = new.find(b"\n", len(new) - suffix) if tail else len(new)
+    return first, line_count - tail, new[start:end].split(b"\n")
+
+
+def read_blob(blob):
+    """Returns the raw contents of a git blob."""
+
+    return subprocess.check_output(("git", "cat-file", "blob", blob))
+
+
+def count_keys(lines, positions):
+    """Counts the hashed keys of the well-formed rows among lines."""
+
+    keys = Counter()
+    for line in lines:
+        fields = parse_line(line)
+        if len(fields) > max(UNIQUE_KEY):
+            keys[key_hash(fields, positions)] += 1
+    return keys
+
+
+class WatchedFile:
+    """
+    A dataset file as it was last saved: its lines, its changes since the
+    base of the diff, the diagnostics of the rows that were checked and how
+    many rows refer to each test. Rows are numbered from 1, as in the file.
+    """
+
+    def __init__(self, filename, change):
+        self.filename = filename
+        self.data_dict, self.validate = SCHEMAS[filename]
+        self.base = change["base"]
+        blob = get_blob_ids(self.base).get(filename)
+        self.base_lines = [] if blob is None else split_lines(read_blob(blob))
+        # Line of the base where each test first appears
+        self.base_tests = {}
+        for j, line in enumerate(self.base_lines[1:], 1):
+            fields = parse_line(line)
+            if len(fields) > max(UNIQUE_KEY):
+                self.base_tests.setdefault(key_hash(fields, REFERENCE_KEY), j)
+        self.logs = {}
+        self.load(change)
+
+    def load(self, change):
+        """Reads the whole file, given its changes since the base."""
+
+        stat = os.stat(self.filename)
+        self.version = (stat.st_mtime_ns, stat.st_size)
+        with open(self.filename, "rb") as dataset:
+            self.data = dataset.read()
+        self.lines = self.data.split(b"\n")
+        self.unique = count_keys(self.lines[1:], UNIQUE_KEY)
+        self.references = count_keys(self.lines[1:], REFERENCE_KEY)
+        # Fields of the tests of the base that are no longer in the file
+        self.removed = {}
+        for key, j in self.base_tests.items():
+            if self.references[key] <= 0:
+                self.removed[key] = parse_line(self.base_lines[j])
+        self.apply(change)
+
+    def apply(self, change):
+        """
+        Takes the changes of the file since the base and checks the rows a
+        new run would check: those that changed and didn't only move (see
+        row_diff). Rows that were checked with the same contents and number
+        keep their diagnostics. Returns the number of rows checked again.
+        """
+
+        self.change = change
+        self.moved = Diagnostics()
+        if change["removed"] and change["changed"]:
+            apply_row_diff(
+                self.filename, change, self.data, self.index(), self.moved
+            )
+        changed = bytearray(len(self.lines))
+        for first, last in change["changed"]:
+            last = min(last, len(self.lines))
+            changed[first - 1 : last] = b"\1" * (last - first + 1)
+        self.changed = changed
+        # Number of base lines deleted right before each row
+        self.seams = {line + 1: count for line, count in change["deleted"]}
+
+        logs = {}
+        checked = 0
+        for first, last in merge_ranges(checked_ranges(change)):
+            for i in range(first, last + 1):
+                if not self.is_row(i):
+                    continue
+                line = self.lines[i - 1]
+                known = self.logs.get(i)
+                if known is not None and known[0] == line:
+                    logs[i] = known
+                else:
+                    logs[i] = (line, self.check_row(i))
+                    checked += 1
+        self.logs = logs
+        return checked
+
+    def index(self):
+        """
+        Returns the offset at which each line starts, like
+        line_index.build_line_index, from the lengths of the lines.
+        """
+
+        index = array(
+            "q", accumulate((len(line) + 1 for line in self.lines), initial=0)
+        )
+        # Drops the offset past the end, and that of what follows the last
+        # newline, which isn't a line
+        index.pop()
+        if self.lines[-1] == b"":
+            index.pop()
+        return index
+
+    def is_row(self, i):
+        """Tells whether line i holds a row, not the end of the file."""
+
+        return 1 <= i <= len(self.lines) and (
+            i < len(self.lines) or self.lines[-1] != b""
+        )
+
+    def changed_rows(self):
+        """Yields the number of every changed line, in order."""
+
+        find = self.changed.find
+        start = find(1)
+        while start != -1:
+            end = find(0, start)
+            if end == -1:
+                end = len(self.changed)
+            for i in range(start + 1, end + 1):
+                if self.is_row(i):
+                    yield i
+            start = find(1, end)
+
+    def check_row(self, i):
+        """Checks line i, returning what it logged."""
+
+        log = Diagnostics()
+        fields = parse_line(self.lines[i - 1])
+        check_fields(
+            self.filename, self.data_dict, log, self.validate, i, fields
+        )
+        return log.records
+
+    def update(self):
+        """
+        Reads the file again if it was saved, and diffs it against the base
+        with git, so that its lines are matched with those of the base as a
+        new run would match them. Returns the number of rows checked again,
+        or None if it didn't change.
+        """
+
+        try:
+            stat = os.stat(self.filename)
+            version = (stat.st_mtime_ns, stat.st_size)
+            if version == self.version:
+                return None
+            with open(self.filename, "rb") as dataset:
+                data = dataset.read()
+        except OSError:
+            # Editors may replace the file, so it can be briefly missing
+            return None
+        if data == self.data:
+            self.version = version
+            return None
+        change = diff_changes([self.filename], self.base)[self.filename]
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        if (stat.st_mtime_ns, stat.st_size) != version:
+            # Saved again while git read it, so it is read at the next look
+            return None
+
+        self.version = version
+        first, old_end, lines = edited_region(
+            self.data, data, len(self.lines)
+        )
+        self.count_rows(first, old_end, -1)
+        self.data = data
+        self.lines[first:old_end] = lines
+        self.count_rows(first, first + len(lines), 1)
+        return self.apply(change)
+
+    def count_rows(self, first, end, sign):
+        """
+        Adds (or subtracts) the keys of lines first to end to the counts,
+        keeping track of the tests of the base that were removed.
+        """
+
+        for line in self.lines[max(first, 1) : end]:
+            fields = parse_line(line)
+            if len(fields) > max(UNIQUE_KEY):
+                self.unique[key_hash(fields, UNIQUE_KEY)] += sign
+                key = key_hash(fields, REFERENCE_KEY)
+                self.references[key] += sign
+                if self.references[key] > 0:
+                    self.removed.pop(key, None)
+                elif key in self.base_tests:
+                    self.removed[key] = fields
+
+    def check_sort(self, log):
+        """
+        Checks the order of the rows next to a changed row or to a deleted
+        one, or of every row if the header changed or many rows were
+        deleted, like check_sort.
+        """
+
+        if (
+            self.changed[0]
+            or 1 in self.seams
+            or sum(self.seams.values()) > BULK_DELETION
+        ):
+            boundaries = range(3, len(self.lines) + 1)
+        else:
+            boundaries = set(self.seams)
+            for i in self.changed_rows():
+                boundaries.update((i, i + 1))
+            boundaries = sorted(boundaries)
+        for i in boundaries:
+            if i >= 3 and self.is_row(i):
+                if sort_key(self.lines[i - 1]) < sort_key(self.lines[i - 2]):
+                    log_unsorted(self.filename, log, i)
+                    return
+
+    def report(self, log):
+        """Logs the diagnostics of the checked rows."""
+
+        if not checked_ranges(self.change):
+            log_info(self.filename, log, "There are no changes to be checked")
+        for i in sorted(self.logs):
+            for record in self.logs[i][1]:
+                log.add(record)
+
+    def changed_fields(self):
+        """Yields the number and fields of the well-formed changed rows."""
+
+        for i in self.changed_rows():
+            if i > 1:
+                fields = parse_line(self.lines[i - 1])
+                if len(fields) > max(UNIQUE_KEY):
+                    yield i, fields
+
+
+class Watcher:
+    """
+    Keeps every dataset file in memory, together with its changes since
+    the base of the diff that was computed when it was created.
+    """
+
+    def __init__(self, commit_range):
+        changes = get_changed_lines(list(SCHEMAS), commit_range)
+        self.files = {
+            filename: WatchedFile(filename, changes[filename])
+            for filename in SCHEMAS
+        }
+
+    def update(self):
+        """
+        Checks again the rows of the files saved since the last update,
+        returning how many there were, or None if no file was saved.
+        """
+
+        checked = None
+        for watched in self.files.values():
+            rows = watched.update()
+            if rows is not None:
+                checked = (checked or 0) + rows
+        return checked
+
+    def check(self):
+        """Collects the diagnostics of the files as they are now."""
+
+        log = Diagnostics()
+        for watched in self.files.values():
+            log.extend(watched.moved)
+        for filename, watched in self.files.items():
+            watched.report(log)
+            if filename == PR_FILE:
+                watched.check_sort(log)
+        self.check_integrity(log)
+        return log
+
+    def check_integrity(self, log):
+        """
+        Checks the references between the files like check_changed_integrity
+        does, with the counts of every key kept in memory.
+        """
+
+        pr_file = self.files[PR_FILE]
+        for i, fields in pr_file.changed_fields():
+            if pr_file.unique[key_hash(fields, UNIQUE_KEY)] > 1:
+                log_duplicate(log, i, fields)
+        for filename in REFERRING_FILES:
+            for i, fields in self.files[filename].changed_fields():
+                key = key_hash(fields, REFERENCE_KEY)
+                if pr_file.references[key] <= 0:
+                    log_dangling(filename, log, i, fields)
+
+        # Removed tests are reported in the order they were in the base
+        removed = sorted(pr_file.removed, key=pr_file.base_tests.__getitem__)
+        for filename in REFERRING_FILES:
+            references = self.files[filename].references
+            for key in removed:
+                if references[key] > 0:
+                    log_removed(filename, log, pr_file.removed[key])
+
+
+def watch(commit_range, report, interval=POLL_INTERVAL):
+    """
+    Checks the dataset files and then checks them again whenever they are
+    saved, until interrupted. Each time, report is called with the
+    diagnostics, the number of rows checked again and the seconds it took.
+    """
+
+    start = time.perf_counter()
+    watcher = Watcher(commit_range)
+    report(watcher.check(), None, time.perf_counter() - start)
+    try:
+        while True:
+            time.sleep(interval)
+            start = time.perf_counter()
+            checked = watcher.update()
+            if checked is not None:
+                report(watcher.check(), checked, time.perf_counter() - start)
+    except KeyboardInterrupt:
+        pass